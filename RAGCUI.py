@@ -7,9 +7,10 @@ from rich.table import Table
 from rich.markdown import Markdown
 from rich.control import Control
 from rag.llm import get_llm, extract_user_need
-from rag.db import search_db
+from rag.db import default_db_path
 from rag.utils import load_llm_config, load_multi_llm_config
-from rag.rag_service import get_user_need, retrieve_context, build_history_str, count_tokens
+from rag.rag_service import get_user_need, retrieve_context, retrieve_context_many, build_history_str
+from vector_api.tokens import count_tokens, StreamTokenCounter
 import tempfile
 import subprocess
 import sys
@@ -87,10 +88,13 @@ def main():
         output_dir = Path("output")
         output_dir.mkdir(exist_ok=True)
         label_list = ['A1', 'B1', 'C1']
+        # 先提取全部检索需求，再一次性批量检索
+        user_needs = [extract_user_need(main_llm, question) for question in test_questions]
+        retrieved = retrieve_context_many(user_needs, default_db_path(), top_k=5)
         for idx, question in enumerate(test_questions):
             console.rule(f"[bold cyan]自动测试问题 {idx+1}: {question}")
-            user_need = extract_user_need(main_llm, question)
-            meta_list = search_db(user_need, top_k=5)
+            user_need = user_needs[idx]
+            meta_list, merged_context = retrieved[idx]
             if meta_list:
                 table = Table(title="数据库检索元数据", show_lines=True, expand=True)
                 for k in meta_list[0].keys():
@@ -100,20 +104,6 @@ def main():
                 console.print(table)
             else:
                 console.print("[red]未检索到相关资料")
-            db_zip_path = str(Path(__file__).parent / "db" / "wiki_allinone.zip")
-            from vector_api.main_embedding import load_from_zip
-            _, id2meta, id2content, _, _ = load_from_zip(db_zip_path)
-            context_list = []
-            used = set()
-            for meta in meta_list:
-                for idx2, m in id2meta.items():
-                    if m == meta and idx2 not in used:
-                        fragment = id2content[idx2]
-                        context_list.append(fragment)
-                        used.add(idx2)
-            merged_context = "\n".join(context_list)
-            if len(merged_context) > 60000:
-                merged_context = merged_context[:60000]
             console.print(Panel(f"[bold green]LLM 提取需求：[/bold green]{user_need}", title="LLM 提取的检索需求"))
             # 捕获流式输出
             system_prompt = load_system_prompt()
@@ -138,7 +128,7 @@ def main():
             console.print(f"[green]已保存: {out_path}")
         return
     history = []
-    db_zip_path = str(Path(__file__).parent / "db" / "wiki_allinone.zip")
+    db_zip_path = default_db_path()
     while True:
         question = better_file_input(prompts.get("user_input_prompt", "请输入你的问题（支持多轮，输入exit/quit/q退出）："))
         if question.strip().lower() in ("exit", "quit", "q", ""):
@@ -197,7 +187,7 @@ def main():
         # 8. LLM 回答
         stream = main_llm.stream(final_prompt)
         md_buffer = ""
-        token_count = 0
+        counter = StreamTokenCounter()
         from rich.progress import Progress, SpinnerColumn, TextColumn
         with Progress(
             SpinnerColumn(),
@@ -211,17 +201,17 @@ def main():
                 content = chunk.content if hasattr(chunk, 'content') else chunk
                 if isinstance(content, str):
                     md_buffer += content
-                    token_count += count_tokens(content)
+                    counter.feed(content)
                 elif isinstance(content, list):
                     joined = ''.join(str(item) for item in content)
                     md_buffer += joined
-                    token_count += count_tokens(joined)
+                    counter.feed(joined)
                 else:
                     s = str(content)
                     md_buffer += s
-                    token_count += count_tokens(s)
-                progress.update(task, completed=token_count)
-        answer_tokens = count_tokens(md_buffer)
+                    counter.feed(s)
+                progress.update(task, completed=counter.total)
+        answer_tokens = counter.total
         console.print("[bold green]Markdown 渲染：[/bold green]")
         console.print(Markdown(md_buffer), soft_wrap=True)
         console.print(f"\n[yellow]本轮LLM输出 Token数：{answer_tokens}[/yellow]")
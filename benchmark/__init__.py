@@ -0,0 +1 @@
+# 性能基准脚本，均可用 python -m benchmark.<模块名> 运行
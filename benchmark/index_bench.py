@@ -0,0 +1,150 @@
+"""
+索引类型基准：以 IndexFlatL2 的精确结果为基线，报告各索引配置的 recall@k、
+p50/p99 单条查询延迟、构建耗时、索引体积及相对 float32 的内存节省，用于为当前语料规模选择配置。
+
+用法：
+    python -m benchmark.index_bench --archive db/wiki_allinone.zip
+    python -m benchmark.index_bench --synthetic 100000 --dim 1024 --json output/index_bench.json
+    python -m benchmark.index_bench --synthetic 50000 --config hnsw:M=32,efSearch=128 --config ivf_pq:nprobe=32
+    python -m benchmark.index_bench --archive db/wiki_allinone.zip --config sq8 --config pq:rerank=1,k_factor_rf=8
+"""
+import argparse
+import json
+import time
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+from vector_api.faiss_utils import build_index, extract_vectors, search_index, memory_report
+
+DEFAULT_CONFIGS = [
+    ('flat', {}),
+    ('hnsw', {'efSearch': 32}),
+    ('hnsw', {'efSearch': 64}),
+    ('hnsw', {'efSearch': 128}),
+    ('ivf_flat', {'nprobe': 8}),
+    ('ivf_flat', {'nprobe': 32}),
+    ('ivf_pq', {'nprobe': 16}),
+    ('ivf_pq', {'nprobe': 64}),
+    ('fp16', {}),
+    ('sq8', {}),
+    ('sq8', {'rerank': 1}),
+    ('pq', {}),
+    ('pq', {'rerank': 1, 'k_factor_rf': 8}),
+]
+
+
+def synthetic_vectors(n, dim, n_clusters=256, seed=0):
+    """高斯混合向量，比均匀随机更接近真实嵌入的聚类结构。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype('float32')
+    labels = rng.integers(0, n_clusters, size=n)
+    vecs = centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype('float32')
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs.astype('float32')
+
+
+def archive_vectors(db_path):
+    from vector_api.archive import load_archive
+    _, vecs = extract_vectors(load_archive(db_path).index)
+    return np.ascontiguousarray(vecs, dtype='float32')
+
+
+def make_queries(vectors, n_queries, noise=0.05, seed=1):
+    # 取语料中的向量加扰动作为查询，模拟“与某些分片相近”的真实提问
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + noise * rng.standard_normal((len(picks), vectors.shape[1])).astype('float32')
+    return np.ascontiguousarray(queries, dtype='float32')
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def bench_config(vectors, queries, truth, k, index_type, params):
+    t0 = time.perf_counter()
+    index, config = build_index(vectors, index_type=index_type, params=params)
+    build_s = time.perf_counter() - t0
+    latencies = []
+    found = []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, I = search_index(index, q, k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(I[0])
+    latencies = np.asarray(latencies)
+    memory = memory_report(index, exact=True)
+    return {
+        'index_type': index_type,
+        'params': {**config['build'], **config['search']},
+        'recall_at_k': round(recall_at_k(found, truth, k), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'build_s': round(build_s, 3),
+        'size_mb': round(memory['bytes'] / 2**20, 2),
+        'saved_ratio': memory['saved_ratio'],
+    }
+
+
+def run(vectors, configs=DEFAULT_CONFIGS, k=10, n_queries=500):
+    queries = make_queries(vectors, n_queries)
+    flat, _ = build_index(vectors, index_type='flat')
+    _, truth = search_index(flat, queries, k)
+    results = []
+    for index_type, params in configs:
+        try:
+            results.append(bench_config(vectors, queries, truth, k, index_type, params))
+        except ValueError as e:
+            # 例如语料过小无法训练 PQ
+            results.append({'index_type': index_type, 'params': params, 'error': str(e)})
+    return results
+
+
+def parse_config(spec):
+    """'hnsw:M=32,efSearch=64' -> ('hnsw', {'M': 32, 'efSearch': 64})"""
+    index_type, _, rest = spec.partition(':')
+    params = {}
+    for item in filter(None, rest.split(',')):
+        key, _, value = item.partition('=')
+        params[key] = int(value)
+    return index_type, params
+
+
+def print_results(results, n, dim, k):
+    table = Table(title=f"索引基准（N={n}, dim={dim}, recall@{k} 以 Flat 为基线）")
+    for col in ('索引', '参数', f'recall@{k}', 'p50(ms)', 'p99(ms)', '构建(s)', '体积(MB)', '内存节省'):
+        table.add_column(col)
+    for r in results:
+        params = ', '.join(f"{k_}={v}" for k_, v in r['params'].items())
+        if 'error' in r:
+            table.add_row(r['index_type'], params, f"[red]{r['error']}", '', '', '', '', '')
+            continue
+        table.add_row(r['index_type'], params, f"{r['recall_at_k']:.4f}", f"{r['p50_ms']:.3f}",
+                      f"{r['p99_ms']:.3f}", f"{r['build_s']:.2f}", f"{r['size_mb']:.1f}", f"{r['saved_ratio']:.0%}")
+    Console().print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ANN 索引 recall / 延迟基准')
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--archive', help='从已有归档中取向量')
+    src.add_argument('--synthetic', type=int, metavar='N', help='生成 N 条合成向量')
+    parser.add_argument('--dim', type=int, default=1024, help='合成向量维度（bge-m3 为 1024）')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--config', action='append', help='索引配置，如 hnsw:M=32,efSearch=64；可重复')
+    parser.add_argument('--json', help='结果另存为 JSON')
+    args = parser.parse_args()
+    vectors = archive_vectors(args.archive) if args.archive else synthetic_vectors(args.synthetic, args.dim)
+    configs = [parse_config(c) for c in args.config] if args.config else DEFAULT_CONFIGS
+    results = run(vectors, configs, k=args.k, n_queries=args.queries)
+    print_results(results, len(vectors), vectors.shape[1], args.k)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'n': len(vectors), 'dim': int(vectors.shape[1]), 'k': args.k, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
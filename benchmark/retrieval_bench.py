@@ -0,0 +1,293 @@
+"""
+端到端检索基准：生成 wiki_cleaned 结构的合成语料（按目标分片数），依次测量
+分片（slice_content）吞吐、归档构建耗时、归档加载耗时、单条/批量查询延迟与上下文拼接耗时，结果输出为 JSON。
+
+向量不经过嵌入API，按分片生成聚类结构的合成向量（与 index_bench 相同），只衡量本地的分片、索引、存储与检索链路。
+需要连同嵌入请求一起测量时，可先启动 mock_server.py 并传 --embed-url。
+
+用法：
+    python -m benchmark.retrieval_bench --sizes 1k,10k,100k --json output/retrieval_bench.json
+    python -m benchmark.retrieval_bench --sizes 1m --dim 256 --format aadb --index-type hnsw
+    python -m benchmark.retrieval_bench --sizes 10k --embed-url http://127.0.0.1:9000/v1/embeddings
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+from vector_api.slice_utils import slice_content
+from vector_api.faiss_utils import build_index
+from vector_api.archive import save_archive, load_archive, get_archive, invalidate_archive
+from vector_api.storage_utils import load_from_zip
+from benchmark.index_bench import synthetic_vectors, make_queries
+from rag.context_packer import DEFAULT_CONTEXT_TOKENS
+
+CATEGORIES = ['角色', '光锥', '开拓任务', '开拓续闻']
+PATHS = ['毁灭', '巡猎', '智识', '同谐', '虚无', '存护', '丰饶']
+# 常用汉字，用来拼出合成句子
+_CHARS = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后'
+          '多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政'
+          '四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题'
+          '党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严')
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1m' -> 1000000"""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def _sentence_pool(rng, n=2000):
+    chars = np.array(list(_CHARS))
+    return [''.join(rng.choice(chars, size=int(rng.integers(12, 40)))) + '。' for _ in range(n)]
+
+
+def generate_corpus(out_dir, n_slices, max_length, context_length, seed=0):
+    """
+    生成约 n_slices 个分片的 wiki_cleaned 结构语料（每页一个 JSON，含 content 与 meta），已存在则复用。
+    每页 1~8 个分片，返回页面数。
+    """
+    out_dir = Path(out_dir)
+    marker = out_dir / '_corpus.json'
+    params = {'n_slices': n_slices, 'max_length': max_length, 'context_length': context_length, 'seed': seed}
+    if marker.exists():
+        with open(marker, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('params') == params:
+            return info['pages']
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+    rng = np.random.default_rng(seed)
+    pool = _sentence_pool(rng)
+    total = pages = 0
+    while total < n_slices:
+        target = min(int(rng.integers(1, 9)), n_slices - total)
+        sentences = []
+        length = 0
+        while length < target * max_length * 0.9:
+            s = pool[int(rng.integers(len(pool)))]
+            sentences.append(s)
+            length += len(s)
+        content = ''.join(sentences)
+        title = f'页面{pages:07d}'
+        meta = {
+            'category': CATEGORIES[pages % len(CATEGORIES)],
+            'title': title,
+            '命途': PATHS[pages % len(PATHS)],
+            '稀有度': str(4 + pages % 2),
+        }
+        with open(out_dir / f'{title}.json', 'w', encoding='utf-8') as f:
+            json.dump({'content': f'{title}\n{content}', 'meta': meta}, f, ensure_ascii=False)
+        total += len(slice_content(content, max_length=max_length, context_length=context_length))
+        pages += 1
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'pages': pages, 'slices': total}, f)
+    return pages
+
+
+def read_and_slice(data_dir, max_length, context_length):
+    """
+    与 embed_and_store_all_in_one 相同的读取与分片过程，分别计时读取与分片。
+    """
+    files = sorted(Path(data_dir).glob('*.json'))
+    read_s = slice_s = 0.0
+    chars = 0
+    id2meta, id2content, id2title, id2raw, title2ids = {}, {}, {}, {}, {}
+    for file in files:
+        t0 = time.perf_counter()
+        with open(file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        read_s += time.perf_counter() - t0
+        content = data.get('content', '')
+        meta = data.get('meta', {})
+        title = file.stem
+        t0 = time.perf_counter()
+        slices = slice_content(content, max_length=max_length, context_length=context_length)
+        slice_s += time.perf_counter() - t0
+        chars += len(content)
+        id2raw[title] = {'content': content, 'meta': meta, 'title': title}
+        for slice_idx, slice_text in enumerate(slices):
+            idx = len(id2content)
+            id2meta[idx] = dict(meta, slice_index=slice_idx + 1, origin_title=title)
+            id2content[idx] = slice_text
+            id2title[idx] = title
+            title2ids.setdefault(title, []).append(idx)
+    stats = {
+        'pages': len(files),
+        'slices': len(id2content),
+        'read_s': round(read_s, 3),
+        'slice_s': round(slice_s, 3),
+        'slice_mb_per_s': round(chars * 3 / 2**20 / slice_s, 2) if slice_s else None,  # 按 UTF-8 字节估算
+        'slices_per_s': round(len(id2content) / slice_s) if slice_s else None,
+    }
+    return (id2meta, id2content, id2title, id2raw, title2ids), stats
+
+
+def _latency_stats(latencies_ms):
+    arr = np.asarray(latencies_ms)
+    return {'p50_ms': round(float(np.percentile(arr, 50)), 3), 'p99_ms': round(float(np.percentile(arr, 99)), 3)}
+
+
+def bench_queries(archive, queries, k, batch_size):
+    single = []
+    for q in queries:
+        t0 = time.perf_counter()
+        archive.search(q.reshape(1, -1), k)
+        single.append((time.perf_counter() - t0) * 1000)
+    batched = []
+    for i in range(0, len(queries), batch_size):
+        t0 = time.perf_counter()
+        archive.search(queries[i:i + batch_size], k)
+        batched.append((time.perf_counter() - t0) * 1000)
+    per_query = sum(batched) / len(queries)
+    return {
+        'single': _latency_stats(single),
+        'batched': dict(_latency_stats(batched), batch_size=batch_size, per_query_ms=round(per_query, 3)),
+    }
+
+
+def bench_lexical(archive, contents, n_queries, k, seed=2):
+    # 取语料中的一小段作为词法查询
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(contents), size=min(n_queries, len(contents)), replace=False)
+    latencies = []
+    for idx in picks:
+        text = contents[int(idx)]
+        start = int(rng.integers(0, max(1, len(text) - 8)))
+        t0 = time.perf_counter()
+        archive.lexical_search(text[start:start + 8], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return _latency_stats(latencies)
+
+
+def bench_context(db_path, archive, queries, k, max_tokens):
+    from rag.db import build_context_from_ids
+    from vector_api.main_embedding import _unique_page_hits
+    _, I = archive.search(queries, k)
+    latencies = []
+    for row in I:
+        t0 = time.perf_counter()
+        hits = _unique_page_hits(archive, row)
+        build_context_from_ids([idx for idx, _ in hits], max_tokens=max_tokens, db_zip_path=db_path)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return _latency_stats(latencies)
+
+
+def bench_size(n_slices, args, workdir):
+    data_dir = workdir / f'corpus_{n_slices}'
+    t0 = time.perf_counter()
+    pages = generate_corpus(data_dir, n_slices, args.max_length, args.context_length)
+    result = {'target_slices': n_slices, 'generate_s': round(time.perf_counter() - t0, 3)}
+    tables, slicing = read_and_slice(data_dir, args.max_length, args.context_length)
+    id2meta, id2content, id2title, id2raw, title2ids = tables
+    result['slicing'] = slicing
+    vectors = synthetic_vectors(len(id2content), args.dim)
+    queries = make_queries(vectors, args.queries)
+    result['formats'] = {}
+    for fmt in args.formats:
+        db_path = str(workdir / f'db_{n_slices}.{fmt}')
+        invalidate_archive(db_path)
+        t0 = time.perf_counter()
+        index, config = build_index(vectors, index_type=args.index_type)
+        index_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        save_archive(db_path, index, id2meta, id2content, id2title, id2raw, title2ids, config)
+        save_s = time.perf_counter() - t0
+        del index
+        entry = {'build': {'index_s': round(index_s, 3), 'save_s': round(save_s, 3),
+                           'size_mb': round(_path_size(db_path) / 2**20, 2)}}
+        load = {}
+        if fmt == 'zip':
+            t0 = time.perf_counter()
+            load_from_zip(db_path)
+            load['load_from_zip_s'] = round(time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+        load_archive(db_path)
+        load['load_archive_s'] = round(time.perf_counter() - t0, 3)
+        entry['load'] = load
+        archive = get_archive(db_path)
+        entry['query'] = bench_queries(archive, queries, args.k, args.batch_size)
+        entry['lexical_query'] = bench_lexical(archive, id2content, args.queries, args.k)
+        entry['context'] = bench_context(db_path, archive, queries, args.k, args.max_tokens)
+        if args.embed_url:
+            entry['embed_build_s'] = bench_embed_build(data_dir, workdir / f'embed_{n_slices}.{fmt}', args)
+        result['formats'][fmt] = entry
+        invalidate_archive(db_path)
+    result['pages'] = pages
+    return result
+
+
+def bench_embed_build(data_dir, db_path, args):
+    """经由嵌入API（通常是 mock_server.py）完整执行 embed_and_store_all_in_one，不使用嵌入缓存。"""
+    from vector_api.main_embedding import embed_and_store_all_in_one
+    t0 = time.perf_counter()
+    embed_and_store_all_in_one(str(data_dir), str(db_path), args.embed_url, 'mock', max_length=args.max_length,
+                               context_length=args.context_length, use_cache=False, index_type=args.index_type)
+    return round(time.perf_counter() - t0, 3)
+
+
+def _path_size(path):
+    if os.path.isdir(path):
+        return sum(f.stat().st_size for f in Path(path).iterdir() if f.is_file())
+    return os.path.getsize(path)
+
+
+def print_results(results):
+    table = Table(title="端到端检索基准")
+    for col in ('分片数', '格式', '分片(条/s)', '建索引(s)', '写归档(s)', '加载(s)', '单条 p50/p99(ms)',
+                '批量每条(ms)', '词法 p50(ms)', '拼接 p50(ms)'):
+        table.add_column(col)
+    for r in results:
+        for fmt, e in r['formats'].items():
+            table.add_row(str(r['slicing']['slices']), fmt, str(r['slicing']['slices_per_s']),
+                          f"{e['build']['index_s']:.2f}", f"{e['build']['save_s']:.2f}",
+                          f"{e['load']['load_archive_s']:.3f}",
+                          f"{e['query']['single']['p50_ms']:.3f}/{e['query']['single']['p99_ms']:.3f}",
+                          f"{e['query']['batched']['per_query_ms']:.3f}",
+                          f"{e['lexical_query']['p50_ms']:.3f}", f"{e['context']['p50_ms']:.3f}")
+    Console().print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片 → 嵌入 → 索引 → 检索 端到端基准')
+    parser.add_argument('--sizes', default='1k,10k,100k', help='目标分片数，逗号分隔，如 1k,10k,100k,1m')
+    parser.add_argument('--workdir', default='output/retrieval_bench', help='合成语料与归档的存放目录（语料可复用）')
+    parser.add_argument('--format', dest='formats', default='zip,aadb', help='归档格式：zip、aadb，逗号分隔')
+    parser.add_argument('--index-type', default='flat')
+    parser.add_argument('--dim', type=int, default=256, help='合成向量维度；1m 规模下 1024 维需约 4GB 内存')
+    parser.add_argument('--max-length', type=int, default=500, help='分片长度，默认小于线上的 5000 以控制语料体积')
+    parser.add_argument('--context-length', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_CONTEXT_TOKENS, help='上下文拼接的 token 预算')
+    parser.add_argument('--embed-url', help='另外经由该嵌入API完整构建一次（如 mock_server.py）')
+    parser.add_argument('--json', help='结果另存为 JSON')
+    args = parser.parse_args()
+    args.formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for size in args.sizes.split(','):
+        n = parse_size(size)
+        print(f'规模 {n} 分片 ...')
+        results.append(bench_size(n, args, workdir))
+    print_results(results)
+    report = {
+        'params': {k: v for k, v in vars(args).items() if k != 'json'},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
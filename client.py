@@ -12,6 +12,7 @@ from rich.table import Table
 from rich.prompt import Prompt
 from rich.progress import Progress, SpinnerColumn, TextColumn
 import time
+from vector_api.tokens import StreamTokenCounter  # 与服务端同一套 token 计数
 
 def better_file_input(prompt):
     with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.txt') as f:
@@ -44,11 +45,6 @@ def disable_temp_api_key(key):
     except Exception:
         pass
 
-# 新增：Token计数函数（与服务端保持一致）
-def count_tokens(text: str) -> int:
-    """简单的Token计数（示例实现，可替换为服务端同款）"""
-    return len(text.encode('utf-8')) // 4  # 近似：1token≈4字节（中文场景可调整）
-
 def main():
     console = Console()
     api_url = os.environ.get("AA_API_URL", "http://127.0.0.1:8080/v1/chat/completions")
@@ -105,7 +101,7 @@ def main():
                 prompt_tokens = 0
                 completion_tokens = 0
                 total_tokens = 0
-                manual_completion_tokens = 0  # 手动累加的Token数
+                counter = StreamTokenCounter()  # 服务端未返回 usage 时的本地计数
                 for line in resp.iter_lines(decode_unicode=True):
                     if not line or not line.startswith('data: '):
                         continue
@@ -128,8 +124,7 @@ def main():
                     content = delta.get('content', '')
                     if content:
                         md_buffer += content
-                        manual_completion_tokens += count_tokens(content)
-                        progress.update(task, completed=manual_completion_tokens)
+                        progress.update(task, completed=counter.feed(content))
                     # 更新Token统计（如果服务端返回部分信息）
                     usage = data.get('usage', {})
                     prompt_tokens = usage.get('prompt_tokens', prompt_tokens)
@@ -137,7 +132,7 @@ def main():
                     total_tokens = usage.get('total_tokens', total_tokens)
                 # 若服务端未返回，使用手动累加值
                 if completion_tokens == 0:
-                    completion_tokens = manual_completion_tokens
+                    completion_tokens = counter.total
                     total_tokens = prompt_tokens + completion_tokens
 
             # 输出token统计信息（已定义变量）
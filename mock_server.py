@@ -0,0 +1,198 @@
+"""
+离线压测用的 OpenAI 兼容替身服务：/v1/embeddings 返回按文本哈希生成的确定性向量，
+/v1/chat/completions 返回固定的（可流式）回复。支持注入延迟、抖动与错误。
+
+用法：
+    python mock_server.py --port 9000 --dim 1024 --latency-ms 30 --jitter-ms 10 --error-rate 0.01 \
+        --write-config config/api_keys.mock.json
+    ASTRAL_API_KEYS=config/api_keys.mock.json python server.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Any, List, Optional, Union
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger("AstralArchives.mock")
+
+DEFAULT_REPLY = (
+    "## 模拟回答\n\n"
+    "这是离线替身服务返回的固定回复，用于在无网络环境下对检索、嵌入与流式输出链路做可复现的压测。\n\n"
+    "- 要点一：回复内容与输入无关，长度固定。\n"
+    "- 要点二：流式输出按固定字符数分块。\n"
+)
+
+
+class MockSettings:
+    def __init__(self, dim=1024, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_codes=(500, 429),
+                 reply=DEFAULT_REPLY, chunk_chars=8, chunk_latency_ms=0.0, seed=0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.reply = reply
+        self.chunk_chars = chunk_chars
+        self.chunk_latency_ms = chunk_latency_ms
+        # 延迟与错误注入使用固定种子，同一请求序列的表现可复现
+        self.rng = random.Random(seed)
+
+
+settings = MockSettings()
+app = FastAPI()
+
+
+class EmbeddingRequest(BaseModel):
+    model: str = "BAAI/bge-m3"
+    input: Union[str, List[str]]
+    encoding_format: Optional[str] = "float"
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: Any = ""
+
+
+class ChatRequest(BaseModel):
+    model: str = "mock-chat"
+    messages: List[ChatMessage]
+    stream: Optional[bool] = False
+
+
+def hash_vector(text, model, dim):
+    """由 (模型, 文本) 的 sha256 作种子生成单位长度向量，同一输入在任何机器上结果一致。"""
+    seed = int.from_bytes(hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    return vec / np.linalg.norm(vec)
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 2)
+
+
+async def _inject():
+    """按配置休眠并可能返回一个注入的错误响应。"""
+    delay = settings.latency_ms + settings.rng.uniform(-settings.jitter_ms, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if settings.error_rate and settings.rng.random() < settings.error_rate:
+        code = settings.rng.choice(settings.error_codes)
+        return JSONResponse(status_code=code, content={"error": {"message": "injected error", "code": code}})
+    return None
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "mock-chat", "object": "model"}, {"id": "BAAI/bge-m3", "object": "model"}]}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(req: EmbeddingRequest):
+    error = await _inject()
+    if error is not None:
+        return error
+    texts = [req.input] if isinstance(req.input, str) else req.input
+    data = [{"object": "embedding", "index": i, "embedding": hash_vector(text, req.model, settings.dim).tolist()}
+            for i, text in enumerate(texts)]
+    tokens = sum(_count_tokens(text) for text in texts)
+    return {"object": "list", "data": data, "model": req.model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+def _chunk(model, created, delta, finish_reason=None):
+    return "data: " + json.dumps({
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }, ensure_ascii=False) + "\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(req: ChatRequest):
+    error = await _inject()
+    if error is not None:
+        return error
+    reply = settings.reply
+    created = int(time.time())
+    prompt_tokens = sum(_count_tokens(str(m.content)) for m in req.messages)
+    if not req.stream:
+        completion_tokens = _count_tokens(reply)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": created,
+            "model": req.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    async def stream():
+        yield _chunk(req.model, created, {"role": "assistant", "content": ""})
+        step = max(1, settings.chunk_chars)
+        for i in range(0, len(reply), step):
+            if settings.chunk_latency_ms:
+                await asyncio.sleep(settings.chunk_latency_ms / 1000)
+            yield _chunk(req.model, created, {"content": reply[i:i + step]})
+        yield _chunk(req.model, created, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def write_mock_config(path, host, port):
+    """写出指向本服务的 api_keys 配置，配合环境变量 ASTRAL_API_KEYS 使用。"""
+    base = f"http://{host}:{port}/v1"
+    config = {
+        "embedding": {"api_url": f"{base}/embeddings", "api_key": "mock"},
+        "llm": {"base_url": base, "api_key": "mock", "model": "mock-chat"},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线嵌入/对话替身服务（OpenAI 兼容）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--dim", type=int, default=1024, help="嵌入维度，bge-m3 为 1024")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求的基础延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟在 ±jitter 内均匀抖动")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例（0~1）")
+    parser.add_argument("--error-codes", default="500,429", help="注入错误时随机选用的状态码")
+    parser.add_argument("--reply-file", help="固定回复内容文件，默认内置一段 Markdown")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="流式输出每块的字符数")
+    parser.add_argument("--chunk-latency-ms", type=float, default=0.0, help="流式输出块间延迟")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write-config", help="写出指向本服务的 api_keys 配置文件路径")
+    args = parser.parse_args()
+
+    global settings
+    reply = DEFAULT_REPLY
+    if args.reply_file:
+        with open(args.reply_file, "r", encoding="utf-8") as f:
+            reply = f.read()
+    settings = MockSettings(dim=args.dim, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate,
+                            error_codes=[int(c) for c in args.error_codes.split(",") if c],
+                            reply=reply, chunk_chars=args.chunk_chars, chunk_latency_ms=args.chunk_latency_ms,
+                            seed=args.seed)
+    if args.write_config:
+        write_mock_config(args.write_config, args.host, args.port)
+        print(f"已写入 {args.write_config}，设置 ASTRAL_API_KEYS={args.write_config} 即可让各组件使用本服务")
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# rag/app_state.py
+"""
+服务端的应用级状态：配置、提示词、LLM 客户端与向量归档在启动时加载一次，
+请求处理中直接取用，不再逐请求读文件、新建连接池。
+
+后台任务定期 stat 配置文件（api_keys.json、prompts.json）与归档，变化时重新加载；
+LLM 配置变化时才重建客户端。上游 LLM 的连接由共享的 httpx 客户端保持长连接。
+"""
+import asyncio
+import logging
+import os
+import httpx
+from rag.llm import get_llm, prompts, prompts_path, reload_prompts
+from rag.utils import api_keys_path, load_llm_config
+from rag.db import default_db_path, load_embed_api
+
+logger = logging.getLogger("AstralArchives")
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class AppState:
+    """
+    由 FastAPI lifespan 创建：start() 加载全部资源并启动文件监视，close() 停止监视并关闭连接。
+    """
+    def __init__(self, temperature=0.3, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.temperature = temperature
+        self.poll_interval = poll_interval
+        self.prompts = prompts
+        self.llm = None
+        self.llm_config = None
+        self.embed_api = None
+        self.db_path = None
+        self._archive_error = None
+        self._stats = {}
+        self._watcher = None
+        self._http_client = None
+        self._http_async_client = None
+
+    def _new_http_clients(self):
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+        self._http_client = httpx.Client(timeout=120, limits=limits)
+        self._http_async_client = httpx.AsyncClient(timeout=120, limits=limits)
+
+    def _watched(self):
+        return {"api_keys": str(api_keys_path()), "prompts": str(prompts_path())}
+
+    def _load_config(self):
+        llm_config = load_llm_config()
+        self.embed_api = load_embed_api()
+        if llm_config != self.llm_config or self.llm is None:
+            base_url, api_key = llm_config
+            self.llm = get_llm(base_url, api_key, temperature=self.temperature,
+                               http_client=self._http_client, http_async_client=self._http_async_client)
+            self.llm_config = llm_config
+            logger.info("LLM client (re)built")
+
+    def _load_archive(self):
+        from vector_api.archive import get_archive
+        self.db_path = default_db_path()
+        # get_archive 按文件变化自动重载，这里提前触发，避免首个请求承担加载耗时
+        get_archive(self.db_path)
+
+    def _reload(self, names):
+        loaders = {"api_keys": self._load_config, "prompts": reload_prompts}
+        for name in names:
+            try:
+                loaders[name]()
+                logger.info(f"Reloaded {name}")
+            except Exception as e:
+                # 保留旧配置继续服务，文件修正后下次轮询再试
+                logger.error(f"Failed to load {name}: {str(e)}")
+
+    def _changed(self):
+        changed = []
+        for name, path in self._watched().items():
+            key = _stat_key(path)
+            if self._stats.get(name) != key:
+                self._stats[name] = key
+                changed.append(name)
+        return changed
+
+    def _refresh_archive(self):
+        try:
+            self._load_archive()
+            self._archive_error = None
+        except Exception as e:
+            # 归档缺失或损坏时每次轮询都会失败，同一错误只记录一次
+            if str(e) != self._archive_error:
+                self._archive_error = str(e)
+                logger.error(f"Failed to load archive: {self._archive_error}")
+
+    async def start(self):
+        self._new_http_clients()
+        self._changed()
+        await asyncio.to_thread(self._reload, ["api_keys", "prompts"])
+        await asyncio.to_thread(self._refresh_archive)
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            changed = self._changed()
+            if changed:
+                await asyncio.to_thread(self._reload, changed)
+            await asyncio.to_thread(self._refresh_archive)
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+        if self._http_client is not None:
+            self._http_client.close()
+
+    def require_llm(self):
+        if self.llm is None:
+            raise RuntimeError("LLM 配置未加载，请检查 api_keys.json")
+        return self.llm
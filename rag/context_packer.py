@@ -0,0 +1,123 @@
+# rag/context_packer.py
+"""
+按 token 预算拼接资料片段：片段按得分排序后贪心装入完整片段（不在片段中间截断），
+同一页面相邻分片共享的上下文只保留一份，合并为连续文本。
+"""
+from vector_api.tokens import count_tokens as _count_tokens
+
+DEFAULT_CONTEXT_TOKENS = 24000
+MIN_OVERLAP = 8  # 短于此长度的首尾重合视为巧合，不合并
+
+
+def _overlap(a, b, limit=2000):
+    """a 的后缀与 b 的前缀的最长重合长度（相邻分片各自携带的上下文）。"""
+    if not a or not b:
+        return 0
+    tail = a[-limit:]
+    p = tail.find(b[0])
+    while p != -1 and len(tail) - p >= MIN_OVERLAP:
+        if b.startswith(tail[p:]):
+            return len(tail) - p
+        p = tail.find(b[0], p + 1)
+    return 0
+
+
+def fragments_from_hits(archive, hits, neighbours=0, decay=0.5):
+    """
+    检索命中 [(分片id, meta)] -> 候选片段 [(分片id, 得分)]，得分按排名取 1/(名次+1)。
+    neighbours > 0 时把同页前后各 neighbours 个分片以 得分*decay^距离 加入候选，预算有余时补充上下文。
+    """
+    scores = {}
+    for rank, (idx, meta) in enumerate(hits):
+        score = 1.0 / (rank + 1)
+        scores[idx] = max(scores.get(idx, 0.0), score)
+        if not neighbours:
+            continue
+        page_ids = archive.ids_for_title(meta.get('origin_title'))
+        if idx not in page_ids:
+            continue
+        pos = page_ids.index(idx)
+        for dist in range(1, neighbours + 1):
+            for near in (pos - dist, pos + dist):
+                if 0 <= near < len(page_ids):
+                    near_id = page_ids[near]
+                    scores[near_id] = max(scores.get(near_id, 0.0), score * decay ** dist)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def _assemble(selected, texts, slots):
+    """
+    已选片段 -> [(块得分, 文本)]：同页 slice_index 连续的片段合并为一块并去掉重合部分，块按最高得分排序。
+    """
+    by_page = {}
+    for idx in selected:
+        title, slice_index = slots[idx]
+        by_page.setdefault(title, []).append((slice_index, idx))
+    blocks = []
+    for title, items in by_page.items():
+        items.sort(key=lambda item: (item[0] is None, item[0] or 0))
+        current, score, last = None, 0.0, None
+        for slice_index, idx in items:
+            text = texts[idx]
+            if current is not None and last is not None and slice_index == last + 1:
+                current += text[_overlap(current, text):]
+                score = max(score, selected[idx])
+            else:
+                if current is not None:
+                    blocks.append((score, current))
+                current, score = text, selected[idx]
+            last = slice_index
+        if current is not None:
+            blocks.append((score, current))
+    blocks.sort(key=lambda block: -block[0])
+    return blocks
+
+
+def pack_context(archive, candidates, max_tokens=DEFAULT_CONTEXT_TOKENS, count_tokens=None,
+                 fragment_format="{fragment}", separator="\n"):
+    """
+    candidates: [(分片id, 得分)]。按得分从高到低贪心装入，放不下的片段整体跳过、继续尝试后面较短的片段。
+    返回 (拼接后的资料文本, 选中的分片id列表)，文本的 token 数不超过 max_tokens。
+    """
+    count = count_tokens or _count_tokens
+    texts, slots = {}, {}
+    for idx, _ in candidates:
+        if idx in archive.id2content and idx not in texts:
+            texts[idx] = archive.id2content[idx]
+            meta = archive.id2meta.get(idx) or {}
+            slots[idx] = (meta.get('origin_title'), meta.get('slice_index'))
+    by_slot = {}
+    selected = {}
+    sep_cost = count(separator) + count(fragment_format.replace("{fragment}", ""))
+    used = 0
+    for idx, score in sorted(candidates, key=lambda item: -item[1]):
+        if idx not in texts or idx in selected:
+            continue
+        title, slice_index = slots[idx]
+        body = texts[idx]
+        joined = False
+        if slice_index is not None:
+            prev = by_slot.get((title, slice_index - 1))
+            nxt = by_slot.get((title, slice_index + 1))
+            if prev is not None:
+                body = body[_overlap(texts[prev], body):]
+            if nxt is not None:
+                body = body[:len(body) - _overlap(body, texts[nxt])]
+            joined = prev is not None or nxt is not None
+        cost = count(body) + (0 if joined else sep_cost)
+        if used + cost > max_tokens:
+            continue
+        selected[idx] = score
+        by_slot[(title, slice_index)] = idx
+        used += cost
+
+    def render():
+        blocks = _assemble(selected, texts, slots)
+        return separator.join(fragment_format.format(fragment=text) for _, text in blocks)
+
+    context = render()
+    # 分段计数与整体计数在片段边界处可能略有出入，超出时按得分从低到高剔除
+    while selected and count(context) > max_tokens:
+        del selected[min(selected, key=selected.get)]
+        context = render()
+    return context, list(selected)
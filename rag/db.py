@@ -4,29 +4,89 @@
 """
 from pathlib import Path
 import json
-from vector_api.main_embedding import search_all_in_one_meta, load_from_zip
+from vector_api.main_embedding import (hybrid_search_hits, async_hybrid_search_hits, search_many_hits, async_search_many_hits,
+                                       DEFAULT_SEARCH_MODE)
+from vector_api.archive import get_archive
 
-def search_db(keywords, top_k=5):
-    db_zip_path = str(Path(__file__).parent.parent / "db" / "wiki_allinone.zip")
-    config_path = Path(__file__).parent.parent / "config" / "api_keys.json"
+DB_DIR = Path(__file__).parent.parent / "db"
+DEFAULT_DB_ZIP_PATH = str(DB_DIR / "wiki_allinone.zip")
+DEFAULT_DB_MMAP_PATH = str(DB_DIR / "wiki_allinone.aadb")
+DEFAULT_DB_SHARDS_PATH = str(DB_DIR / "wiki_shards")
+
+def default_db_path():
+    """
+    优先使用按分类分片的库（shard_by_category=True 构建），其次是可 mmap 的目录归档
+    （由 python -m vector_api.mmap_store 转换得到），否则回退到 zip。
+    """
+    if (Path(DEFAULT_DB_SHARDS_PATH) / "shards.json").is_file():
+        return DEFAULT_DB_SHARDS_PATH
+    return DEFAULT_DB_MMAP_PATH if Path(DEFAULT_DB_MMAP_PATH).is_dir() else DEFAULT_DB_ZIP_PATH
+
+def load_embed_api():
+    from rag.utils import api_keys_path
+    config_path = api_keys_path()
     with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
     api_url = config.get("embedding", {}).get("api_url", "https://api.siliconflow.cn/v1/embeddings")
     api_key = config.get("embedding", {}).get("api_key")
-    results = search_all_in_one_meta(keywords, db_zip_path, api_url, api_key, top_k=top_k)
-    return results
-
-def build_context_from_db(meta_list, max_chars=64000):
-    db_zip_path = str(Path(__file__).parent.parent / "db" / "wiki_allinone.zip")
-    _, id2meta, id2content, _, _ = load_from_zip(db_zip_path)
-    context = ""
-    used = set()
-    for meta in meta_list:
-        for idx, m in id2meta.items():
-            if m == meta and idx not in used:
-                fragment = id2content[idx]
-                if len(context) + len(fragment) > max_chars:
-                    return context
-                context += f"\n【资料片段】{fragment}\n"
-                used.add(idx)
+    return api_url, api_key
+
+def search_db_hits(keywords, top_k=5, db_zip_path=None, mode=DEFAULT_SEARCH_MODE, filters=None, diversity=None):
+    """
+    返回 [(分片id, meta)]，分片id可直接用于 build_context_from_ids。
+    mode 见 hybrid_search_hits：默认纯向量检索；'hybrid' 为词法与向量融合，'auto' 在关键词恰为页面标题时只走词法、不调用嵌入API。
+    filters 按元数据限定范围，如 {'category': '角色'}。
+    diversity（0~1）指定时以 MMR 重排候选，减少同一长页面的冗余分片。
+    """
+    api_url, api_key = load_embed_api()
+    return hybrid_search_hits(keywords, db_zip_path or default_db_path(), api_url, api_key, top_k=top_k, mode=mode,
+                              filters=filters, diversity=diversity)
+
+def search_db(keywords, top_k=5, filters=None):
+    return [meta for _, meta in search_db_hits(keywords, top_k=top_k, filters=filters)]
+
+async def async_search_db_hits(keywords, top_k=5, db_zip_path=None, mode=DEFAULT_SEARCH_MODE, filters=None, diversity=None,
+                               embed_api=None):
+    """
+    search_db_hits 的异步版本，供 async 请求处理函数使用。
+    embed_api 为已加载的 (api_url, api_key)，不传时读取配置文件。
+    """
+    api_url, api_key = embed_api or load_embed_api()
+    return await async_hybrid_search_hits(keywords, db_zip_path or default_db_path(), api_url, api_key,
+                                          top_k=top_k, mode=mode, filters=filters, diversity=diversity)
+
+async def async_search_db(keywords, top_k=5, filters=None):
+    return [meta for _, meta in await async_search_db_hits(keywords, top_k=top_k, filters=filters)]
+
+def search_db_many_hits(keywords_list, top_k=5, db_zip_path=None, mode=DEFAULT_SEARCH_MODE, filters=None, diversity=None):
+    """
+    多个关键词一次检索（一次嵌入请求、一次批量索引查询），返回每个关键词的 [(分片id, meta)]。
+    """
+    api_url, api_key = load_embed_api()
+    return search_many_hits(keywords_list, db_zip_path or default_db_path(), api_url, api_key, top_k=top_k,
+                            mode=mode, filters=filters, diversity=diversity)
+
+def search_db_many(keywords_list, top_k=5, filters=None):
+    return [[meta for _, meta in hits] for hits in search_db_many_hits(keywords_list, top_k=top_k, filters=filters)]
+
+async def async_search_db_many_hits(keywords_list, top_k=5, db_zip_path=None, mode=DEFAULT_SEARCH_MODE, filters=None, diversity=None):
+    api_url, api_key = load_embed_api()
+    return await async_search_many_hits(keywords_list, db_zip_path or default_db_path(), api_url, api_key,
+                                        top_k=top_k, mode=mode, filters=filters, diversity=diversity)
+
+def build_context_from_ids(slice_ids, max_tokens=None, db_zip_path=None):
+    """
+    按 slice_ids 的先后作为得分，在 token 预算内拼接完整片段（见 rag.context_packer）。
+    """
+    from rag.context_packer import DEFAULT_CONTEXT_TOKENS, pack_context
+    archive = get_archive(db_zip_path or default_db_path())
+    slice_ids = list(dict.fromkeys(slice_ids))
+    candidates = [(idx, 1.0 / (rank + 1)) for rank, idx in enumerate(slice_ids)]
+    context, _ = pack_context(archive, candidates, max_tokens=max_tokens or DEFAULT_CONTEXT_TOKENS,
+                              fragment_format="\n【资料片段】{fragment}\n", separator="")
     return context
+
+def build_context_from_db(meta_list, max_tokens=None):
+    archive = get_archive(default_db_path())
+    slice_ids = [idx for meta in meta_list for idx in archive.ids_for_meta(meta)]
+    return build_context_from_ids(slice_ids, max_tokens=max_tokens)
@@ -4,10 +4,15 @@ LLM相关接口，便于后续切换模型或多模型支持。
 """
 # 从 langchain_openai 导入 ChatOpenAI
 from langchain_openai import ChatOpenAI
+from langchain_core.output_parsers import StrOutputParser
 import json
 from pathlib import Path
 
-def get_llm(base_url, api_key, model="deepseek-chat", temperature=0.5, max_tokens=8192):
+def get_llm(base_url, api_key, model="deepseek-chat", temperature=0.5, max_tokens=8192,
+            http_client=None, http_async_client=None):
+    """
+    http_client / http_async_client 传入共享的 httpx 客户端时复用其长连接池（见 rag/app_state.py）。
+    """
     return ChatOpenAI(
         model=model,
         temperature=temperature,
@@ -15,21 +20,39 @@ def get_llm(base_url, api_key, model="deepseek-chat", temperature=0.5, max_token
         api_key=api_key,
         base_url=base_url,
         streaming=True,  # 显式启用流式支持（关键修改）
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
 
+def prompts_path():
+    return Path(__file__).parent.parent / "config" / "prompts.json"
+
 def _load_prompts():
-    prompt_path = Path(__file__).parent.parent / "config" / "prompts.json"
-    with open(prompt_path, "r", encoding="utf-8") as f:
+    with open(prompts_path(), "r", encoding="utf-8") as f:
         return json.load(f)
 
 prompts = _load_prompts()
 
+def reload_prompts():
+    """重新读取 prompts.json 并原地更新 prompts（引用该字典的调用方立即生效）。"""
+    new_prompts = _load_prompts()
+    prompts.update(new_prompts)
+    for key in [key for key in prompts if key not in new_prompts]:
+        del prompts[key]
+    return prompts
+
 def extract_user_need(llm, question):
     prompt = prompts["extract_need_prompt"].replace("{question}", question)
     result = llm.invoke(prompt)
     return result.content.strip()
 
-def answer_with_rag(llm, question, context, dialogue_history=None, system_prompt=None, context_insert=None):
+async def aextract_user_need(llm, question):
+    """extract_user_need 的异步版本（ainvoke，不阻塞事件循环）。"""
+    prompt = prompts["extract_need_prompt"].replace("{question}", question)
+    result = await llm.ainvoke(prompt)
+    return result.content.strip()
+
+def _answer_prompt(question, context, dialogue_history=None, system_prompt=None, context_insert=None):
     # 支持可选参数，便于主流程灵活拼接
     p = prompts["answer_with_rag_prompt"]
     if system_prompt is None:
@@ -44,9 +67,30 @@ def answer_with_rag(llm, question, context, dialogue_history=None, system_prompt
         question=question,
         context_insert=context_insert
     )
+    return prompt
+
+def answer_with_rag(llm, question, context, dialogue_history=None, system_prompt=None, context_insert=None):
+    prompt = _answer_prompt(question, context, dialogue_history, system_prompt, context_insert)
     result = llm.invoke(prompt)
     return result.content.strip()
 
+async def aanswer_with_rag(llm, question, context, dialogue_history=None, system_prompt=None, context_insert=None):
+    """answer_with_rag 的异步版本。"""
+    prompt = _answer_prompt(question, context, dialogue_history, system_prompt, context_insert)
+    result = await llm.ainvoke(prompt)
+    return result.content.strip()
+
+async def astream_answer_with_rag(llm, question, context, dialogue_history=None, system_prompt=None, context_insert=None):
+    """answer_with_rag 的异步流式版本，逐块产出文本。"""
+    prompt = _answer_prompt(question, context, dialogue_history, system_prompt, context_insert)
+    async for chunk in astream_text(llm, prompt):
+        yield chunk
+
+async def astream_text(llm, prompt):
+    """以 astream 流式调用 LLM，逐块产出文本（服务端生成回答时使用）。"""
+    async for chunk in (llm | StrOutputParser()).astream(prompt):
+        yield chunk
+
 def extract_key_info_multi_llm(llm_list, context_list):
     """
     llm_list: [(llm对象, 名称)]
@@ -66,7 +110,59 @@ def extract_key_info_multi_llm(llm_list, context_list):
         results.append(item)
     return results
 
+def _route_prompt(question, history_str):
+    return prompts["extract_need_with_history_prompt"].replace("{question}", question).replace("{history}", history_str or "无")
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() not in ("", "n", "no", "false", "0", "否")
+    return bool(value)
+
+def parse_route(text):
+    """
+    解析路由输出 -> {"need_retrieval": bool, "keywords": str, "category": str 或 None}。
+    模型未按 JSON 输出时，单行文本视为关键词（兼容只输出关键词的提示词），单独的 "Y"/"N" 只表示是否检索；
+    含 "{" 或多行的输出（非法 JSON、直接作答等）不作为关键词，keywords 为空，由调用方回退到原问题。
+    """
+    text = (text or "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            keywords = data.get("keywords") or ""
+            if isinstance(keywords, list):
+                keywords = ",".join(str(k).strip() for k in keywords if str(k).strip())
+            category = data.get("category")
+            category = str(category).strip() if category and str(category).strip().lower() not in ("null", "none") else None
+            return {
+                "need_retrieval": _as_bool(data.get("need_retrieval", True)),
+                "keywords": str(keywords).strip(),
+                "category": category,
+            }
+    keywords = text.strip('"')
+    if "{" in text or "\n" in text or keywords.upper() in ("Y", "N"):
+        keywords = ""
+    return {"need_retrieval": _as_bool(text), "keywords": keywords, "category": None}
+
+def route_request(llm, question, history_str=""):
+    """
+    一次 LLM 调用完成检索路由：是否需要检索、检索关键词、可选的分类过滤。
+    """
+    result = llm.invoke(_route_prompt(question, history_str))
+    return parse_route(result.content)
+
+async def aroute_request(llm, question, history_str=""):
+    """route_request 的异步版本。"""
+    result = await llm.ainvoke(_route_prompt(question, history_str))
+    return parse_route(result.content)
+
 def extract_user_need_with_history(llm, question, history_str):
-    prompt = prompts["extract_need_with_history_prompt"].replace("{question}", question).replace("{history}", history_str)
-    result = llm.invoke(prompt)
-    return result.content.strip()
+    # 路由判定无需检索时 keywords 为空，调用方已决定检索，回退到原问题
+    return route_request(llm, question, history_str)["keywords"] or question
+
+async def aextract_user_need_with_history(llm, question, history_str):
+    """extract_user_need_with_history 的异步版本。"""
+    return (await aroute_request(llm, question, history_str))["keywords"] or question
@@ -4,7 +4,9 @@ RAG 业务逻辑分离：检索、拼接资料、历史对话构造、token统
 """
 from pathlib import Path
 from rag.llm import extract_user_need
-from rag.db import search_db
+from rag.db import search_db_hits, async_search_db_hits, search_db_many_hits
+from rag.context_packer import DEFAULT_CONTEXT_TOKENS, fragments_from_hits, pack_context
+from vector_api.tokens import count_tokens, count_tokens_batch, StreamTokenCounter  # noqa: F401  统一的 token 计数
 
 def get_user_need(llm, question, history_str=None):
     from rag.llm import extract_user_need_with_history, extract_user_need
@@ -13,33 +15,42 @@ def get_user_need(llm, question, history_str=None):
     else:
         return extract_user_need(llm, question)
 
-def retrieve_context(user_need, db_zip_path, top_k=5):
-    meta_list = search_db(user_need, top_k=top_k)
-    from vector_api.main_embedding import load_from_zip
-    _, id2meta, id2content, _, _ = load_from_zip(db_zip_path)
-    context_list = []
-    used = set()
-    for meta in meta_list:
-        for idx, m in id2meta.items():
-            if m == meta and idx not in used:
-                fragment = id2content[idx]
-                context_list.append(fragment)
-                used.add(idx)
-    merged_context = "\n".join(context_list)
-    if len(merged_context) > 60000:
-        merged_context = merged_context[:60000]
+def _merge_hits(hits, db_zip_path, max_tokens=DEFAULT_CONTEXT_TOKENS, neighbours=0):
+    """
+    按 token 预算拼接命中分片：按排名贪心装入完整片段，同页相邻分片去重合并。
+    neighbours > 0 时预算有余则补充命中分片前后的同页分片。
+    """
+    meta_list = [meta for _, meta in hits]
+    from vector_api.archive import get_archive
+    archive = get_archive(db_zip_path)
+    candidates = fragments_from_hits(archive, hits, neighbours=neighbours)
+    merged_context, _ = pack_context(archive, candidates, max_tokens=max_tokens)
     return meta_list, merged_context
 
+def retrieve_context(user_need, db_zip_path, top_k=5, filters=None, diversity=None,
+                     max_tokens=DEFAULT_CONTEXT_TOKENS, neighbours=0):
+    hits = search_db_hits(user_need, top_k=top_k, db_zip_path=db_zip_path, filters=filters, diversity=diversity)
+    return _merge_hits(hits, db_zip_path, max_tokens=max_tokens, neighbours=neighbours)
+
+async def async_retrieve_context(user_need, db_zip_path, top_k=5, filters=None, diversity=None,
+                                 max_tokens=DEFAULT_CONTEXT_TOKENS, neighbours=0, embed_api=None):
+    import asyncio
+    hits = await async_search_db_hits(user_need, top_k=top_k, db_zip_path=db_zip_path, filters=filters,
+                                      diversity=diversity, embed_api=embed_api)
+    # token 计数与片段读取放到线程池，不阻塞事件循环
+    return await asyncio.to_thread(_merge_hits, hits, db_zip_path, max_tokens, neighbours)
+
+def retrieve_context_many(user_needs, db_zip_path, top_k=5, filters=None, diversity=None,
+                          max_tokens=DEFAULT_CONTEXT_TOKENS, neighbours=0):
+    """
+    多条检索需求一次完成检索，返回与 user_needs 等长的 [(meta_list, merged_context)]。
+    max_tokens 为每条需求的资料 token 预算。
+    """
+    hits_list = search_db_many_hits(user_needs, top_k=top_k, db_zip_path=db_zip_path, filters=filters, diversity=diversity)
+    return [_merge_hits(hits, db_zip_path, max_tokens=max_tokens, neighbours=neighbours) for hits in hits_list]
+
 def build_history_str(history, turn_format, history_format):
     history_str = "\n".join([
         turn_format.format(user=h["user"], assistant=h["assistant"]) for h in history
     ]) if history else ""
     return history_format.format(history=history_str)
-
-def count_tokens(text, encoding_name="cl100k_base"):
-    try:
-        import tiktoken
-        enc = tiktoken.get_encoding(encoding_name)
-        return len(enc.encode(text))
-    except Exception:
-        return len(text)  # fallback: char count
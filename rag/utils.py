@@ -3,17 +3,24 @@
 RAG相关工具函数，可根据后续需求扩展。
 """
 import json
+import os
 from pathlib import Path
 
+def api_keys_path():
+    """
+    API 配置文件路径；设置环境变量 ASTRAL_API_KEYS 可切换到其它配置（如 mock_server.py 写出的离线配置）。
+    """
+    return Path(os.environ.get("ASTRAL_API_KEYS") or Path(__file__).parent.parent / "config" / "api_keys.json")
+
 def load_llm_config():
-    config_path = Path(__file__).parent.parent / "config" / "api_keys.json"
+    config_path = api_keys_path()
     with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
     llm_conf = config.get("llm", {})
     return llm_conf.get("base_url"), llm_conf.get("api_key")
 
 def load_embed_config():
-    config_path = Path(__file__).parent.parent / "config" / "api_keys.json"
+    config_path = api_keys_path()
     with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
     embed_conf = config.get("embedding", {})
@@ -23,7 +30,7 @@ def load_multi_llm_config():
     """
     支持多 LLM 配置，返回 [(base_url, api_key, model, name)]
     """
-    config_path = Path(__file__).parent.parent / "config" / "api_keys.json"
+    config_path = api_keys_path()
     with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
     llm_list = []
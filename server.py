@@ -1,25 +1,37 @@
 import os
 import sys
+import asyncio
 import logging
 import time
 import json
 from functools import wraps
-from pathlib import Path
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any, Generator, Union, AsyncGenerator
 from fastapi import FastAPI, Request, Header
 from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
-from rag.llm import get_llm, extract_user_need
-from rag.db import search_db
-from rag.utils import load_llm_config, load_multi_llm_config
-from rag.rag_service import count_tokens
+from rag.llm import aroute_request, astream_text
+from rag.app_state import AppState
+from rag.rag_service import async_retrieve_context
+from vector_api.tokens import count_tokens, count_tokens_batch, StreamTokenCounter
 from config.apikey_db import init_db, check_api_key, add_token_usage
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.output_parsers import StrOutputParser
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 配置、提示词、LLM 客户端与归档只在启动时加载，之后由文件监视热重载
+    state = AppState(temperature=0.3)
+    await state.start()
+    app.state.rag = state
+    try:
+        yield
+    finally:
+        await state.close()
+        from vector_api.embed_utils import close_async_client
+        await close_async_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS 配置
 app.add_middleware(
@@ -118,50 +130,49 @@ def meta_to_md_table(meta_list: List[dict]) -> str:
     )
     return header + rows
 
-async def generate_response(
-    llm,
-    prompt_template: str,
+def prompt_values(
     system_prompt: str,
     history_messages: List[Union[HumanMessage, AIMessage]],
     question: str,
     keyword: str = "",
     metadata_table: str = "",
     context: Optional[str] = None
-) -> AsyncGenerator[str, None]:
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    chain = prompt | llm | StrOutputParser()
-    
+) -> Dict[str, str]:
     formatted_context = f"相关文档：\n{metadata_table}\n\n资料片段：\n{context}" if context else ""
-    
-    async for chunk in chain.astream({
+    return {
         "system_prompt": system_prompt,
         "history": "\n".join(f"{msg.type}: {msg.content}" for msg in history_messages),
         "keyword": keyword,
         "metadata_table": metadata_table,
         "context": formatted_context,
         "question": question
-    }):
-        yield chunk
+    }
 
-@log_execution_time
-async def determine_retrieval_need(llm, question: str, history: list) -> bool:
-    prompt = """根据对话历史和当前问题，判断是否需要检索知识库：
-历史对话：
-{history}
+async def generate_response(llm, prompt_text: str) -> AsyncGenerator[str, None]:
+    async for chunk in astream_text(llm, prompt_text):
+        yield chunk
 
-当前问题：{question}
+async def record_usage(api_key: str, prompt_tokens: int, completion_tokens: int) -> Usage:
+    """累计到 API 密钥的用量（sqlite 写入放到线程中，不阻塞事件循环）。"""
+    usage = Usage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens
+    )
+    try:
+        await asyncio.to_thread(add_token_usage, api_key, usage.total_tokens)
+    except Exception as e:
+        logger.error(f"Failed to record token usage: {str(e)}")
+    return usage
 
-请用Y/N回答是否需要检索："""
-    
-    response = await llm.ainvoke(prompt.format(
-        history="\n".join([f"{msg.type}: {msg.content}" for msg in history]),
-        question=question
-    ))
-    return response.content.strip().upper() == "Y"
+@log_execution_time
+async def route_request(llm, question: str, history: list) -> Dict[str, Any]:
+    """一次调用同时得到是否检索、检索关键词与可选的分类过滤（提示词见 prompts.json）。"""
+    return await aroute_request(llm, question, "\n".join(f"{msg.type}: {msg.content}" for msg in history))
 
 @app.post("/v1/chat/completions")
 @log_execution_time
-async def chat_completions(req: ChatCompletionRequest, authorization: Optional[str] = Header(None)):
+async def chat_completions(req: ChatCompletionRequest, request: Request, authorization: Optional[str] = Header(None)):
     logger.info(f"New request received. Messages count: {len(req.messages)}")
     
     try:
@@ -177,13 +188,15 @@ async def chat_completions(req: ChatCompletionRequest, authorization: Optional[s
         history_messages = format_messages(req.messages[:-1])
         current_question = req.messages[-1].content
         
-        # 加载配置
-        base_url, api_key = load_llm_config()
-        llm_cfgs = load_multi_llm_config()
-        main_llm = get_llm(base_url, api_key, temperature=0.3)
+        # 应用级状态（启动时加载，配置文件变化时自动重载）
+        state = request.app.state.rag
+        main_llm = state.require_llm()
+        prompts = state.prompts
         
-        # 动态检索判断
-        need_retrieval = await determine_retrieval_need(main_llm, current_question, history_messages)
+        # 检索路由：是否检索、关键词与分类过滤一次得到
+        route = await route_request(main_llm, current_question, history_messages)
+        need_retrieval = route["need_retrieval"]
+        category = route["category"]
         
         # 知识库检索流程
         merged_context = ""
@@ -191,36 +204,38 @@ async def chat_completions(req: ChatCompletionRequest, authorization: Optional[s
         meta_list = []
         meta_md = ""
         if need_retrieval:
-            user_need = extract_user_need(main_llm, current_question)
-            logger.info(f"Starting retrieval with user_need: {user_need}")
+            user_need = route["keywords"] or current_question
+            logger.info(f"Starting retrieval with user_need: {user_need}, category: {category}")
             
             logger.debug(f"Searching DB with query: {user_need}")
-            meta_list = search_db(user_need, top_k=5)
+            filters = {"category": category} if category else None
+            meta_list, merged_context = await async_retrieve_context(user_need, state.db_path, top_k=5, filters=filters,
+                                                                     embed_api=state.embed_api)
+            if filters and not meta_list:
+                # 模型给出的分类可能不存在于资料库，过滤后无结果时不加过滤重试
+                logger.info(f"No hits in category {category}, retrying without filter")
+                category = None
+                meta_list, merged_context = await async_retrieve_context(user_need, state.db_path, top_k=5,
+                                                                         embed_api=state.embed_api)
             logger.info(f"Found {len(meta_list)} metadata entries")
-            
-            # 构建上下文
-            db_zip_path = Path(__file__).parent / "db" / "wiki_allinone.zip"
-            from vector_api.main_embedding import load_from_zip
-            _, id2meta, id2content, _, _ = load_from_zip(str(db_zip_path))
-            
-            context_list = []
-            used = set()
-            for meta in meta_list:
-                for idx, m in id2meta.items():
-                    if m == meta and idx not in used:
-                        context_list.append(id2content[idx])
-                        used.add(idx)
-            merged_context = "\n".join(context_list)[:60000]
             meta_md = meta_to_md_table(meta_list)
 
-        # 加载提示词配置
-        with open(Path(__file__).parent / "config" / "prompts.json") as f:
-            prompts = json.load(f)
+        prompt_template = RAG_PROMPT_TEMPLATE if need_retrieval else BASIC_PROMPT_TEMPLATE
+        values = prompt_values(
+            system_prompt=prompts.get("system_prompt", ""),
+            history_messages=history_messages,
+            question=current_question,
+            keyword=user_need,
+            metadata_table=meta_md,
+            context=merged_context
+        )
+        # 实际发送给模型的提示词（同时用于 token 统计）
+        prompt_text = prompt_template.format(**values)
 
         # 流式响应处理
         if req.stream:
             async def stream_generator():
-                full_content = ""
+                counter = StreamTokenCounter()
                 
                 # 预发送元数据
                 if need_retrieval:
@@ -233,6 +248,7 @@ async def chat_completions(req: ChatCompletionRequest, authorization: Optional[s
                                 "metadata": {
                                     "search_used": True,
                                     "keywords": user_need.split(','),
+                                    "category": category,
                                     "doc_count": len(meta_list)
                                 }
                             },
@@ -243,17 +259,8 @@ async def chat_completions(req: ChatCompletionRequest, authorization: Optional[s
                     yield f"data: {metadata_chunk}\n\n"
                 
                 # 流式生成内容
-                async for chunk in generate_response(
-                    llm=main_llm,
-                    prompt_template=RAG_PROMPT_TEMPLATE if need_retrieval else BASIC_PROMPT_TEMPLATE,
-                    system_prompt=prompts.get("system_prompt", ""),
-                    history_messages=history_messages,
-                    question=current_question,
-                    keyword=user_need,
-                    metadata_table=meta_md,
-                    context=merged_context
-                ):
-                    full_content += chunk
+                async for chunk in generate_response(main_llm, prompt_text):
+                    counter.feed(chunk)
                     yield f"""data: {json.dumps({
                         'id': 'chatcmpl-astralarchives',
                         'object': 'chat.completion.chunk',
@@ -264,38 +271,37 @@ async def chat_completions(req: ChatCompletionRequest, authorization: Optional[s
                         }]
                     }, ensure_ascii=False)}\n\n"""
                 
+                usage = await record_usage(api_key_header, count_tokens(prompt_text), counter.total)
+                yield f"""data: {json.dumps({
+                    'id': 'chatcmpl-astralarchives',
+                    'object': 'chat.completion.chunk',
+                    'choices': [{
+                        'delta': {},
+                        'index': 0,
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': usage.model_dump()
+                }, ensure_ascii=False)}\n\n"""
                 yield "data: [DONE]\n\n"
             
             return StreamingResponse(stream_generator(), media_type="text/event-stream")
         
         # 非流式响应
         else:
-            full_response = ""
-            if need_retrieval:
-                full_response += f"检索关键词：{user_need}\n\n相关文档：\n{meta_md}\n\n"
+            answer = ""
+            async for chunk in generate_response(main_llm, prompt_text):
+                answer += chunk
             
-            async for chunk in generate_response(
-                llm=main_llm,
-                prompt_template=RAG_PROMPT_TEMPLATE if need_retrieval else BASIC_PROMPT_TEMPLATE,
-                system_prompt=prompts.get("system_prompt", ""),
-                history_messages=history_messages,
-                question=current_question,
-                keyword=user_need,
-                metadata_table=meta_md,
-                context=merged_context
-            ):
-                full_response += chunk
+            full_response = answer
+            if need_retrieval:
+                full_response = f"检索关键词：{user_need}\n\n相关文档：\n{meta_md}\n\n" + answer
             
-            prompt_tokens = count_tokens(full_response)
-            completion_tokens = count_tokens(full_response)
+            prompt_tokens, completion_tokens = count_tokens_batch([prompt_text, answer])
+            usage = await record_usage(api_key_header, prompt_tokens, completion_tokens)
             
             return ChatCompletionResponse(
                 choices=[Choice(index=0, message={"role": "assistant", "content": full_response})],
-                usage=Usage(
-                    prompt_tokens=prompt_tokens,
-                    completion_tokens=completion_tokens,
-                    total_tokens=prompt_tokens + completion_tokens
-                )
+                usage=usage
             )
 
     except Exception as e:
@@ -10,15 +10,17 @@ def embed_data_menu():
     console.rule("[bold cyan]数据嵌入")
 
     # 从配置文件读取API密钥
-    config_path = Path("config/api_keys.json")
+    from rag.utils import api_keys_path
+    config_path = api_keys_path()
     if not config_path.exists():
-        console.print("[bold red]未找到配置文件 config/api_keys.json")
+        console.print(f"[bold red]未找到配置文件 {config_path}")
    
         return
 
     with open(config_path, "r", encoding="utf-8") as f:
         api_config = json.load(f)
     api_key = api_config.get("embedding", {}).get("api_key")
+    api_url = api_config.get("embedding", {}).get("api_url", "https://api.siliconflow.cn/v1/embeddings")
 
     if not api_key:
         console.print("[bold red]未在配置文件中找到有效的API密钥")
@@ -30,7 +32,7 @@ def embed_data_menu():
         embed_and_store_all_in_one(
             data_dir="wiki_cleaned",
             db_zip_path="./db/wiki_allinone.zip",
-            api_url="https://api.siliconflow.cn/v1/embeddings",
+            api_url=api_url,
             api_key=api_key
         )
         console.print("[bold green]数据嵌入完成！")
@@ -14,9 +14,10 @@ def search_data_menu():
     query = Prompt.ask("请输入查询关键词")
 
     # 读取配置文件以获取 API URL 和密钥
-    with open("config/api_keys.json", "r", encoding="utf-8") as f:
+    from rag.utils import api_keys_path
+    with open(api_keys_path(), "r", encoding="utf-8") as f:
         config = json.load(f)
-    api_url = "https://api.siliconflow.cn/v1/embeddings"
+    api_url = config["embedding"].get("api_url", "https://api.siliconflow.cn/v1/embeddings")
     api_key = config["embedding"]["api_key"]
 
     # 检索向量数据库
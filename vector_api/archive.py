@@ -0,0 +1,342 @@
+"""
+向量库归档的进程内句柄：首次访问时加载，之后在同一进程内复用，
+归档文件的 mtime/大小/校验和变化时自动热重载。
+"""
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from .storage_utils import load_from_zip, load_pickle_from_zip, load_json_from_zip, load_bytes_from_zip, save_to_zip
+from .faiss_utils import apply_search_params, search_index, reconstruct_lookup, reconstruct_vectors
+from .lexical_index import LexicalIndex, LexicalIndexBuilder, build_lexical_index
+from .meta_filter import MetaBitmaps, MetaBitmapBuilder, build_meta_bitmaps
+from .dedup import DuplicateGroups, duplicate_groups, ZIP_ENTRY as DEDUP_ENTRY
+from .mmap_store import is_dir_archive, load_from_dir, read_manifest, save_to_dir, MmapArchiveWriter, MANIFEST_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class VectorArchive:
+    """
+    已加载的向量库归档，持有 faiss 索引与各映射表。
+    """
+    def __init__(self, path, index, id2meta, id2content, id2title, id2raw=None, title2ids=None, checksum=None,
+                 index_config=None, lexical=None, filters=None, dedup=None):
+        self.path = path
+        self.index = index
+        self.id2meta = id2meta
+        self.id2content = id2content
+        self.id2title = id2title
+        self.id2raw = id2raw
+        # 旧归档没有倒排表时按 id2meta 现建一次
+        self.title2ids = title2ids if title2ids is not None else build_title_index(id2meta)
+        self.checksum = checksum
+        # 旧归档没有索引配置，即 IndexFlatL2
+        self.index_config = index_config or {'index_type': 'flat', 'build': {}, 'search': {}}
+        apply_search_params(index, self.index_config.get('search'))
+        self._lexical = lexical
+        self._filters = filters
+        # 近重复分组（见 dedup）：索引中只有代表分片的向量
+        self.dedup = dedup
+        self._lazy_lock = threading.Lock()
+        self._reconstruct_lookup = None
+        self._reconstruct_ready = False
+
+    def as_tuple(self):
+        """兼容 load_from_zip 的返回格式。"""
+        return self.index, self.id2meta, self.id2content, self.id2title, self.id2raw
+
+    def search(self, query_vecs, top_k, ef_search=None, nprobe=None, k_factor=None, filters=None):
+        """
+        返回 (D, I)；ef_search / nprobe / k_factor 覆盖归档中保存的查询参数。
+        filters 如 {'category': '角色', '命途': ['巡猎', '毁灭']}，由预建位图在 faiss 内部筛选。
+        有近重复分组时，命中的代表分片展开为组内各分片。
+        """
+        id_filter = self.filter_mask(filters)
+        if self.dedup is None:
+            return search_index(self.index, query_vecs, top_k, ef_search=ef_search, nprobe=nprobe, k_factor=k_factor,
+                                id_filter=id_filter)
+        D, I = search_index(self.index, query_vecs, top_k, ef_search=ef_search, nprobe=nprobe, k_factor=k_factor,
+                            id_filter=self.dedup.rep_mask(id_filter))
+        return self.dedup.expand(D, I, top_k, id_filter)
+
+    def reconstruct(self, ids):
+        """
+        由索引重建分片向量 (len(ids), d)，供 MMR 等重排使用；近重复分片取其代表分片的向量。
+        """
+        if not self._reconstruct_ready:
+            with self._lazy_lock:
+                if not self._reconstruct_ready:
+                    self._reconstruct_lookup = reconstruct_lookup(self.index)
+                    self._reconstruct_ready = True
+        ids = np.asarray(ids, dtype='int64')
+        if self.dedup is not None:
+            ids = self.dedup.canonical[ids]
+        return reconstruct_vectors(self.index, ids, self._reconstruct_lookup)
+
+    @property
+    def lexical(self):
+        """BM25 倒排索引；旧归档未保存时首次访问现建一次。"""
+        if self._lexical is None:
+            with self._lazy_lock:
+                if self._lexical is None:
+                    self._lexical = build_lexical_index(self.id2content, self.id2meta)
+        return self._lexical
+
+    @property
+    def filters(self):
+        """元数据过滤位图；旧归档未保存时首次访问现建一次。"""
+        if self._filters is None:
+            with self._lazy_lock:
+                if self._filters is None:
+                    self._filters = build_meta_bitmaps(self.id2meta)
+        return self._filters
+
+    def filter_mask(self, filters):
+        return self.filters.mask(filters) if filters else None
+
+    def lexical_search(self, query, top_k, filters=None):
+        """
+        纯词法检索，不调用嵌入API，返回 [(分片id, 得分)]。
+        """
+        return self.lexical.search(query, top_k, id_filter=self.filter_mask(filters))
+
+    def ids_for_title(self, origin_title):
+        return self.title2ids.get(origin_title, [])
+
+    def ids_for_meta(self, meta):
+        """
+        由检索返回的 meta 反查分片 id，只在同一页面的分片内比较。
+        """
+        return [idx for idx in self.ids_for_title(meta.get('origin_title'))
+                if self.id2meta.get(idx) == meta]
+
+    def fragments(self, slice_ids):
+        return [self.id2content[idx] for idx in slice_ids if idx in self.id2content]
+
+
+def build_title_index(id2meta):
+    """
+    origin_title -> [分片 id]（按 id 升序，即按分片顺序）。
+    """
+    title2ids = {}
+    for idx in sorted(id2meta):
+        title = id2meta[idx].get('origin_title')
+        if title is not None:
+            title2ids.setdefault(title, []).append(idx)
+    return title2ids
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def archive_checksum(db_path):
+    """
+    zip 归档取整个文件的 sha256；目录归档与分片库取清单中的构建id。
+    """
+    from .shards import is_shard_set, read_shard_manifest
+    if is_shard_set(db_path):
+        return read_shard_manifest(db_path)['build_id']
+    if is_dir_archive(db_path):
+        return read_manifest(db_path)['build_id']
+    return file_checksum(db_path)
+
+
+def archive_stat_path(db_path):
+    """用于检测变化的文件：目录归档以最后写入的 manifest 为准，分片库以 shards.json 为准。"""
+    from .shards import is_shard_set, MANIFEST_NAME as SHARDS_MANIFEST
+    if is_shard_set(db_path):
+        return os.path.join(str(db_path), SHARDS_MANIFEST)
+    if is_dir_archive(db_path):
+        return os.path.join(str(db_path), MANIFEST_NAME)
+    return str(db_path)
+
+
+def load_archive(db_zip_path):
+    """
+    从磁盘完整加载一次归档（不经过缓存），按路径自动识别 zip、目录格式或分片库。
+    """
+    from .shards import is_shard_set, load_sharded
+    if is_shard_set(db_zip_path):
+        return load_sharded(db_zip_path)
+    if is_dir_archive(db_zip_path):
+        index, id2meta, id2content, id2title, id2raw, title2ids, manifest = load_from_dir(db_zip_path)
+        return VectorArchive(db_zip_path, index, id2meta, id2content, id2title, id2raw,
+                             title2ids=title2ids, checksum=manifest['build_id'], index_config=manifest.get('index'),
+                             lexical=LexicalIndex.load_dir(str(db_zip_path)),
+                             filters=MetaBitmaps.load_dir(str(db_zip_path)),
+                             dedup=DuplicateGroups.load_dir(str(db_zip_path)))
+    checksum = file_checksum(db_zip_path)
+    index, id2meta, id2content, id2title, id2raw = load_from_zip(db_zip_path)
+    title2ids = load_pickle_from_zip(db_zip_path, 'title2ids.pkl')
+    index_config = load_json_from_zip(db_zip_path, 'index_config.json')
+    lexical_bytes = load_bytes_from_zip(db_zip_path, 'lexical.npz')
+    filters_bytes = load_bytes_from_zip(db_zip_path, 'meta_bitmaps.npz')
+    dedup_bytes = load_bytes_from_zip(db_zip_path, DEDUP_ENTRY)
+    return VectorArchive(db_zip_path, index, id2meta, id2content, id2title, id2raw,
+                         title2ids=title2ids, checksum=checksum, index_config=index_config,
+                         lexical=LexicalIndex.from_bytes(lexical_bytes) if lexical_bytes is not None else None,
+                         filters=MetaBitmaps.from_bytes(filters_bytes) if filters_bytes is not None else None,
+                         dedup=DuplicateGroups.from_bytes(dedup_bytes) if dedup_bytes is not None else None)
+
+
+def save_archive(db_path, index, id2meta, id2content, id2title, id2raw=None, title2ids=None, index_config=None,
+                 canonical=None):
+    """
+    按路径写入 zip 或目录归档，同时建立词法倒排索引与元数据过滤位图。
+    canonical 为近重复分组（见 dedup.find_near_duplicates），此时 index 中只含代表分片的向量。
+    """
+    dedup = duplicate_groups(canonical)
+    if is_dir_archive(db_path):
+        save_to_dir(db_path, index, id2meta, id2content, id2raw,
+                    extra_manifest={'index': index_config} if index_config else None,
+                    canonical=dedup.canonical if dedup is not None else None)
+    else:
+        save_to_zip(db_path, index, id2meta, id2content, id2title, id2raw, title2ids, index_config,
+                    lexical=build_lexical_index(id2content, id2meta), filters=build_meta_bitmaps(id2meta),
+                    dedup=dedup)
+
+
+class ZipArchiveWriter:
+    """
+    与 MmapArchiveWriter 接口一致的 zip 写入器。zip 只能整体写出，分片先在内存中累积。
+    """
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.id2meta = {}
+        self.id2content = {}
+        self.id2title = {}
+        self.id2raw = {}
+        self._lexical = LexicalIndexBuilder()
+        self._filters = MetaBitmapBuilder()
+
+    @property
+    def count(self):
+        return len(self.id2content)
+
+    def append(self, text, meta):
+        idx = len(self.id2content)
+        self.id2content[idx] = text
+        self.id2meta[idx] = meta
+        self.id2title[idx] = meta.get('origin_title')
+        self._lexical.add(idx, text, meta)
+        self._filters.add(idx, meta)
+        return idx
+
+    def add_raw(self, key, record):
+        self.id2raw[key] = record
+
+    def finalize(self, index, extra_manifest=None):
+        title2ids = {}
+        for idx in sorted(self.id2meta, key=lambda i: (self.id2title[i] or '', self.id2meta[i].get('slice_index', 0))):
+            if self.id2title[idx] is not None:
+                title2ids.setdefault(self.id2title[idx], []).append(idx)
+        save_to_zip(self.db_path, index, self.id2meta, self.id2content, self.id2title, self.id2raw, title2ids,
+                    (extra_manifest or {}).get('index'), lexical=self._lexical.build(),
+                    filters=self._filters.build())
+
+    def abort(self):
+        pass
+
+
+def open_archive_writer(db_path):
+    """按路径返回目录或 zip 归档的追加写入器。"""
+    if is_dir_archive(db_path):
+        return MmapArchiveWriter(db_path)
+    return ZipArchiveWriter(db_path)
+
+
+class ArchiveHandle:
+    """
+    单个归档路径的缓存句柄。每次 get() 只做一次 stat；
+    仅当 mtime 或大小变化时才计算校验和，校验和也变化时才重新加载。
+    """
+    def __init__(self, db_zip_path):
+        self.path = os.path.abspath(db_zip_path)
+        self._archive = None
+        self._stat_key = None
+        self._failed_key = None  # 重载失败时的文件状态，状态不变就不再重试
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        st = os.stat(archive_stat_path(self.path))
+        return st.st_mtime_ns, st.st_size
+
+    def get(self):
+        archive = self._archive
+        try:
+            stat_key = self._stat()
+        except OSError:
+            if archive is None:
+                raise
+            return archive
+        if archive is not None and stat_key in (self._stat_key, self._failed_key):
+            return archive
+        with self._lock:
+            # 双重检查：其它线程可能已完成重载
+            if self._archive is not None and stat_key in (self._stat_key, self._failed_key):
+                return self._archive
+            try:
+                if self._archive is not None and archive_checksum(self.path) == self._archive.checksum:
+                    # 仅 mtime 变化（如 touch），内容未变，无需重载
+                    self._stat_key = stat_key
+                    return self._archive
+                self._archive = load_archive(self.path)
+            except Exception as e:
+                if self._archive is None:
+                    raise
+                # 新归档不可用（写入中或已损坏）时继续使用已加载的版本，文件再次变化后重试
+                logger.error(f"重载归档 {self.path} 失败，继续使用已加载的版本: {e}")
+                self._failed_key = stat_key
+                return self._archive
+            self._stat_key = stat_key
+            self._failed_key = None
+            return self._archive
+
+    def invalidate(self):
+        with self._lock:
+            self._archive = None
+            self._stat_key = None
+            self._failed_key = None
+
+
+_handles = {}
+_handles_lock = threading.Lock()
+
+
+def get_archive(db_zip_path):
+    """
+    获取进程内共享的归档（按绝对路径缓存），文件变化时自动重载。
+    """
+    key = os.path.abspath(str(db_zip_path))
+    handle = _handles.get(key)
+    if handle is None:
+        with _handles_lock:
+            handle = _handles.get(key)
+            if handle is None:
+                handle = ArchiveHandle(key)
+                _handles[key] = handle
+    return handle.get()
+
+
+def invalidate_archive(db_zip_path=None):
+    """
+    丢弃缓存的归档；不传路径时清空全部。
+    """
+    with _handles_lock:
+        if db_zip_path is None:
+            handles = list(_handles.values())
+        else:
+            handle = _handles.get(os.path.abspath(str(db_zip_path)))
+            handles = [handle] if handle else []
+    for handle in handles:
+        handle.invalidate()
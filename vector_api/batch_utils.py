@@ -0,0 +1,64 @@
+"""
+嵌入请求批处理：按条数与 token 预算把分片打包成多输入请求，
+结果按分片 id 回填；某一批因输入问题（4xx）失败时二分拆批，定位并单独报告出错的输入。
+"""
+import asyncio
+import httpx
+from .embed_utils import async_embed_texts
+
+
+def estimate_tokens(text):
+    # bge-m3 对中文约 1 字 1 token，按字符数估算即可
+    return len(text)
+
+
+def pack_batches(items, max_batch_size=32, max_batch_tokens=32000, count_tokens=estimate_tokens):
+    """
+    items: [(key, text)]，按原顺序打包为 [[(key, text)], ...]。
+    单条超出 token 预算时独占一批。
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for key, text in items:
+        n = count_tokens(text)
+        if batch and (len(batch) >= max_batch_size or batch_tokens + n > max_batch_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append((key, text))
+        batch_tokens += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _is_client_error(e):
+    # 4xx（429 除外）说明输入本身有问题，重试无意义，直接拆批
+    return (isinstance(e, httpx.HTTPStatusError)
+            and 400 <= e.response.status_code < 500
+            and e.response.status_code != 429)
+
+
+async def embed_batch(session, api_url, api_key, batch, model='BAAI/bge-m3', retries=10, retry_delay=2):
+    """
+    嵌入一批 [(key, text)]，返回 [(key, 向量)]。
+    5xx、429 与网络错误按 retries 重试，用尽后抛出最后一次的异常（服务整体不可用，拆批无济于事）；
+    4xx 说明某条输入有问题：多条时对半拆分依次处理以定位，单条立即抛出 RuntimeError。
+    拆出的子批串行执行，始终只占用调用方的一个并发名额。
+    """
+    texts = [text for _, text in batch]
+    for attempt in range(retries):
+        try:
+            vecs = await async_embed_texts(session, api_url, api_key, texts, model)
+            return [(key, vec) for (key, _), vec in zip(batch, vecs)]
+        except Exception as e:
+            if _is_client_error(e):
+                if len(batch) == 1:
+                    raise RuntimeError(f"嵌入失败: {texts[0][:30]}... ({e.response.status_code})") from e
+                break
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(retry_delay)
+    mid = len(batch) // 2
+    left = await embed_batch(session, api_url, api_key, batch[:mid], model, retries, retry_delay)
+    right = await embed_batch(session, api_url, api_key, batch[mid:], model, retries, retry_delay)
+    return left + right
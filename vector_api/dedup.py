@@ -0,0 +1,201 @@
+"""
+嵌入前的近重复分片检测（MinHash + LSH 分桶）。
+
+wiki 中大量任务页面共用模板文字、多个光锥共用同一段故事，逐条嵌入与存储都是浪费。
+按字符 shingle 计算 MinHash 签名，签名按段分桶找出候选对，估计的 Jaccard 相似度
+不低于阈值时并入先出现的代表分片：同组分片共用代表分片的向量与文本，各自保留 meta。
+
+结果以 canonical 数组表示：canonical[i] 为分片 i 的代表分片 id，代表分片满足 canonical[i] == i。
+索引中只存代表分片的向量，检索命中代表分片后展开为组内全部分片。
+"""
+import io
+import os
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 8
+DEFAULT_SHINGLE = 5
+FILE_NAME = 'canonical.npy'
+ZIP_ENTRY = 'canonical.npy'
+
+_PRIME = np.uint64(1099511628211)
+
+
+def _permutations(num_perm, seed=1):
+    rng = np.random.default_rng(seed)
+    # multiply-shift 哈希族：a 取奇数
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def shingle_hashes(text, shingle=DEFAULT_SHINGLE):
+    """text 中所有长度为 shingle 的字符片段的 64 位哈希（去重），以 numpy 按码点滚动计算。"""
+    cps = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(cps) < shingle:
+        # 过短的分片整体作为一个 shingle
+        shingle = max(1, len(cps))
+    if not len(cps):
+        return np.zeros(1, dtype=np.uint64)
+    n = len(cps) - shingle + 1
+    h = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(shingle):
+            h = h * _PRIME + cps[j:j + n]
+    return np.unique(h)
+
+
+def minhash_signatures(texts, num_perm=DEFAULT_NUM_PERM, shingle=DEFAULT_SHINGLE, seed=1):
+    """返回 (len(texts), num_perm) 的 uint32 签名矩阵。"""
+    a, b = _permutations(num_perm, seed)
+    sigs = np.empty((len(texts), num_perm), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for i, text in enumerate(texts):
+            h = shingle_hashes(text, shingle)
+            sigs[i] = ((a * h[None, :] + b) >> np.uint64(32)).min(axis=1)
+    return sigs
+
+
+def find_near_duplicates(texts, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS,
+                         shingle=DEFAULT_SHINGLE):
+    """
+    返回 canonical 数组（int64，长度 len(texts)）。
+    按顺序处理分片：与某个已有代表分片共桶且签名相似度不低于 threshold 时并入该组，
+    否则自成代表。只与代表分片比较，组内每个分片都与其代表足够相似（不会沿链条漂移）。
+    """
+    if num_perm % bands:
+        raise ValueError(f'num_perm={num_perm} 必须能被 bands={bands} 整除')
+    sigs = minhash_signatures(texts, num_perm=num_perm, shingle=shingle)
+    rows = num_perm // bands
+    canonical = np.arange(len(texts), dtype=np.int64)
+    buckets = [{} for _ in range(bands)]
+    for i in range(len(texts)):
+        keys = [sigs[i, band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+        seen = set()
+        for band, key in enumerate(keys):
+            for rep in buckets[band].get(key, ()):
+                if rep in seen:
+                    continue
+                seen.add(rep)
+                if np.count_nonzero(sigs[i] == sigs[rep]) >= threshold * num_perm:
+                    canonical[i] = rep
+                    break
+            if canonical[i] != i:
+                break
+        if canonical[i] == i:
+            # 只有代表分片进桶，桶的大小与重复组数相关而与组内分片数无关
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(i)
+    return canonical
+
+
+def dedup_report(texts, canonical, dim=None):
+    """
+    统计近重复合并带来的节省：少嵌入的文本条数、少存储的文本字节与向量字节。
+    与完全相同文本的去重（嵌入缓存按文本哈希已做到）分开计算，只统计近重复额外省下的部分。
+    """
+    canonical = np.asarray(canonical)
+    dup_rows = np.flatnonzero(canonical != np.arange(len(canonical)))
+    rep_texts = {texts[i] for i in np.flatnonzero(canonical == np.arange(len(canonical)))}
+    dup_texts = {texts[i] for i in dup_rows} - rep_texts
+    return {
+        'slices': len(canonical),
+        'duplicates': int(len(dup_rows)),
+        'groups': int(len(np.unique(canonical[dup_rows]))),
+        'embed_saved': len(dup_texts),
+        'text_bytes_saved': sum(len(texts[i].encode('utf-8')) for i in dup_rows),
+        'vector_bytes_saved': int(len(dup_rows)) * dim * 4 if dim else 0,
+    }
+
+
+def describe_dedup(report):
+    return (f"近重复分片：{report['duplicates']}/{report['slices']}条并入{report['groups']}组，"
+            f"少嵌入{report['embed_saved']}条，文本节省{report['text_bytes_saved'] / 1024:.1f} KB，"
+            f"向量节省{report['vector_bytes_saved'] / 1024:.1f} KB")
+
+
+class DuplicateGroups:
+    """
+    归档中的近重复分组：canonical[i] 为分片 i 的代表分片。
+    """
+    def __init__(self, canonical):
+        self.canonical = np.asarray(canonical, dtype=np.int64)
+        order = np.argsort(self.canonical, kind='stable')
+        reps, starts = np.unique(self.canonical[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        # 代表分片 -> 组内全部分片 id（升序，代表分片在首位），只记录有重复的组
+        self._members = {int(rep): order[bounds[k]:bounds[k + 1]] for k, rep in enumerate(reps)
+                         if bounds[k + 1] - bounds[k] > 1}
+
+    def __len__(self):
+        return len(self.canonical)
+
+    def canonical_id(self, idx):
+        return int(self.canonical[idx])
+
+    def members(self, rep):
+        return self._members.get(int(rep), np.asarray([rep], dtype=np.int64))
+
+    def rep_mask(self, id_filter):
+        """
+        分片位图 -> 代表分片位图：组内任一分片被选中时代表分片即被选中，供 faiss 内部筛选。
+        """
+        if id_filter is None:
+            return None
+        bits = np.unpackbits(id_filter, bitorder='little')[:len(self.canonical)].astype(bool)
+        rep_bits = np.zeros(len(id_filter) * 8, dtype=bool)
+        rep_bits[self.canonical[bits]] = True
+        return np.ascontiguousarray(np.packbits(rep_bits, bitorder='little'))
+
+    def expand(self, D, I, top_k, id_filter=None):
+        """
+        把按代表分片返回的 (D, I) 展开为组内各分片（同组共用距离），去掉不在 id_filter 内的分片后截取 top_k。
+        """
+        from .meta_filter import bitmap_contains
+        D_out = np.full((len(I), top_k), np.inf, dtype='float32')
+        I_out = np.full((len(I), top_k), -1, dtype='int64')
+        for row in range(len(I)):
+            ids, dists = [], []
+            for dist, rep in zip(D[row], I[row]):
+                if rep == -1 or len(ids) >= top_k:
+                    break
+                members = self.members(rep)
+                if id_filter is not None:
+                    members = members[bitmap_contains(id_filter, members)]
+                take = members[:top_k - len(ids)].tolist()
+                ids.extend(take)
+                dists.extend([dist] * len(take))
+            I_out[row, :len(ids)] = ids
+            D_out[row, :len(dists)] = dists
+        return D_out, I_out
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.save(buf, self.canonical)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.load(io.BytesIO(data), allow_pickle=False))
+
+    def save_dir(self, dir_path):
+        np.save(os.path.join(dir_path, FILE_NAME), self.canonical)
+
+    @classmethod
+    def load_dir(cls, dir_path):
+        """目录归档中没有近重复分组时返回 None。"""
+        path = os.path.join(dir_path, FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        return cls(np.load(path, mmap_mode='r'))
+
+
+def duplicate_groups(canonical):
+    """canonical 中没有重复时返回 None，归档中不必保存。"""
+    if canonical is None:
+        return None
+    canonical = np.asarray(canonical, dtype=np.int64)
+    if (canonical == np.arange(len(canonical))).all():
+        return None
+    return DuplicateGroups(canonical)
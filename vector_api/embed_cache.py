@@ -0,0 +1,113 @@
+"""
+以 (模型, 分片文本哈希) 为键的持久化嵌入缓存（sqlite），用于增量重建索引：
+只有新增或内容变化的分片才需要调用嵌入API。
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import numpy as np
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+LEGACY_CACHE_NAME = 'embed_cache.sqlite'
+
+
+def default_cache_path(db_path):
+    """
+    每个归档一个缓存文件：<归档路径>.embed_cache.sqlite（与归档同目录）。
+    构建结束时按本归档的分片清理缓存，共用一个文件会删掉同目录其它归档仍需要的向量。
+    首次使用且旧版共用的 embed_cache.sqlite 存在时以其副本为起点，升级后不必重新嵌入。
+    """
+    db_path = os.path.abspath(str(db_path)).rstrip('/\\')
+    path = f'{db_path}.embed_cache.sqlite'
+    legacy = os.path.join(os.path.dirname(db_path), LEGACY_CACHE_NAME)
+    if not os.path.exists(path) and os.path.isfile(legacy):
+        tmp = f'{path}.tmp-{os.getpid()}'
+        shutil.copyfile(legacy, tmp)
+        os.replace(tmp, path)
+    return path
+
+
+class EmbeddingCache:
+    def __init__(self, cache_path, check_same_thread=True):
+        self.cache_path = str(cache_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # 多线程共享时传 check_same_thread=False，并由调用方自行加锁
+        self._conn = sqlite3.connect(self.cache_path, check_same_thread=check_same_thread)
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            updated_at INTEGER,
+            PRIMARY KEY (model, text_hash)
+        )''')
+        self._conn.commit()
+
+    def get_many(self, model, hashes, chunk_size=500):
+        """返回 {text_hash: 向量}，未命中的哈希不出现在结果中。"""
+        hashes = list(hashes)
+        found = {}
+        for i in range(0, len(hashes), chunk_size):
+            chunk = hashes[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model=? AND text_hash IN ({placeholders})",
+                (model, *chunk))
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype='float32')
+        return found
+
+    def put_many(self, model, items):
+        """items: [(text_hash, 向量)]"""
+        now = int(time.time())
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(model, h, int(vec.shape[-1]), np.asarray(vec, dtype='float32').tobytes(), now) for h, vec in items])
+        self._conn.commit()
+
+    def prune(self, model, keep_hashes):
+        """删除该模型下不在 keep_hashes 中的向量（对应已删除或已变化的分片），返回删除条数。"""
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_hashes (text_hash TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM keep_hashes")
+        self._conn.executemany("INSERT OR IGNORE INTO keep_hashes (text_hash) VALUES (?)",
+                               ((h,) for h in keep_hashes))
+        cur = self._conn.execute(
+            "DELETE FROM embeddings WHERE model=? AND text_hash NOT IN (SELECT text_hash FROM keep_hashes)",
+            (model,))
+        self._conn.execute("DELETE FROM keep_hashes")
+        self._conn.commit()
+        return cur.rowcount
+
+    def touch_many(self, model, hashes):
+        """刷新命中条目的时间戳，配合 prune_older_than 做流式清理。"""
+        now = int(time.time())
+        self._conn.executemany("UPDATE embeddings SET updated_at=? WHERE model=? AND text_hash=?",
+                               ((now, model, h) for h in hashes))
+        self._conn.commit()
+
+    def prune_older_than(self, model, timestamp):
+        """删除该模型下 updated_at 早于 timestamp 的向量（本次构建未用到的），返回删除条数。"""
+        cur = self._conn.execute("DELETE FROM embeddings WHERE model=? AND updated_at < ?", (model, int(timestamp)))
+        self._conn.commit()
+        return cur.rowcount
+
+    def count(self, model=None):
+        if model is None:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model=?", (model,)).fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
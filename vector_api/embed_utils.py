@@ -1,6 +1,35 @@
+import asyncio
 import httpx
 import numpy as np
 
+# 进程级共享的异步客户端：长连接复用，h2 可用时启用 HTTP/2
+_async_client = None
+_async_client_loop = None
+
+def get_async_client():
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client.is_closed or _async_client_loop is not loop:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        _async_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=60,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def close_async_client():
+    global _async_client, _async_client_loop
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
+
 async def async_embed_text(session, api_url, api_key, text, model='BAAI/bge-m3'):
     headers = {
         'Authorization': f'Bearer {api_key}',
@@ -30,3 +59,39 @@ def embed_text(api_url, api_key, text, model='BAAI/bge-m3'):
     response.raise_for_status()
     embedding = response.json()['data'][0]['embedding']
     return np.array(embedding, dtype='float32')
+
+def _parse_embeddings(resp_json, n):
+    # 按返回的 index 字段还原输入顺序
+    data = sorted(resp_json['data'], key=lambda d: d.get('index', 0))
+    if len(data) != n:
+        raise ValueError(f"嵌入返回条数不符: 期望{n}，实际{len(data)}")
+    return [np.array(d['embedding'], dtype='float32') for d in data]
+
+# 批量版本：一次请求嵌入多条文本，返回与 texts 等长的向量列表
+async def async_embed_texts(session, api_url, api_key, texts, model='BAAI/bge-m3'):
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        'model': model,
+        'input': list(texts),
+        'encoding_format': 'float'
+    }
+    resp = await session.post(api_url, headers=headers, json=payload, timeout=60)
+    resp.raise_for_status()
+    return _parse_embeddings(resp.json(), len(payload['input']))
+
+def embed_texts(api_url, api_key, texts, model='BAAI/bge-m3'):
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        'model': model,
+        'input': list(texts),
+        'encoding_format': 'float'
+    }
+    response = httpx.post(api_url, headers=headers, json=payload, timeout=60)
+    response.raise_for_status()
+    return _parse_embeddings(response.json(), len(payload['input']))
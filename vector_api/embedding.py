@@ -13,32 +13,8 @@ import sys
 # 兼容旧接口，推荐直接用 main_embedding.py
 from .main_embedding import embed_and_store_all_in_one, search_all_in_one
 
-def slice_content(content, max_length=5000, context_length=50):
-    """
-    切片算法：将content字段切片为不超过max_length字符的片段，
-    每个片段包含context_length字符的上下文。
-    """
-    slices = []
-    start = 0
-    while start < len(content):
-        end = min(start + max_length, len(content))
-
-        # 确保不会在关键处断裂
-        if end < len(content):
-            while end > start and content[end] not in ['。', '！', '？', '\n']:
-                end -= 1
-            if end == start:
-                end = start + max_length
-
-        # 添加上下文
-        slice_start = max(0, start - context_length)
-        slice_end = min(len(content), end + context_length)
-        sliced_content = content[slice_start:slice_end]
-
-        slices.append(sliced_content)
-        start = end
-
-    return slices
+# 切片实现统一在 slice_utils 中
+from .slice_utils import slice_content
 
 def initialize_faiss_db(db_path: str, vector_dim: int):
     """
@@ -91,8 +67,9 @@ def search_vectors(query_text: str, db_path: str, api_url: str, api_key: str, k:
 
     index = faiss.read_index(db_path)
 
-    # 获取查询文本的嵌入
-    query_embedding = embed_text(api_url, api_key, query_text)
+    # 获取查询文本的嵌入（带进程内缓存）
+    from .query_cache import embed_query
+    query_embedding = embed_query(api_url, api_key, query_text)
 
     # 检索
     D, I = search_faiss_db(index, query_embedding, k=k)
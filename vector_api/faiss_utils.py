@@ -15,3 +15,289 @@ def add_to_faiss_db(index, embedding: np.ndarray, db_path: str):
 def search_faiss_db(index, query_embedding: np.ndarray, k: int = 1):
     D, I = index.search(query_embedding.reshape(1, -1), k)  # type: ignore
     return D, I
+
+# ---- 可选索引类型 ----
+# flat: 精确暴力检索（基线）；hnsw: 图索引；ivf_flat / ivf_pq: 倒排聚类（后者带乘积量化）
+# fp16 / sq8 / pq: 压缩向量的暴力检索（每维 2 字节 / 1 字节 / pq_m*pq_nbits 比特每条）
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq', 'fp16', 'sq8', 'pq')
+
+DEFAULT_INDEX_PARAMS = {
+    'flat': {},
+    'hnsw': {'M': 32, 'efConstruction': 200, 'efSearch': 64},
+    'ivf_flat': {'nlist': None, 'nprobe': 16},
+    'ivf_pq': {'nlist': None, 'nprobe': 16, 'pq_m': 64, 'pq_nbits': 8},
+    'fp16': {},
+    'sq8': {},
+    'pq': {'pq_m': 64, 'pq_nbits': 8},
+}
+
+# 查询期参数，写入归档并在加载时生效；k_factor_rf 为精确重排时的候选放大倍数
+SEARCH_PARAM_KEYS = ('efSearch', 'nprobe', 'k_factor_rf')
+
+def auto_nlist(n):
+    # 经验值 4*sqrt(N)，并保证每个聚类至少约 39 个训练点
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+
+def resolve_index_params(index_type, n, dim, params=None):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"未知索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    resolved = dict(DEFAULT_INDEX_PARAMS[index_type])
+    resolved.update(params or {})
+    if 'nlist' in resolved and not resolved['nlist']:
+        resolved['nlist'] = auto_nlist(n)
+    if resolved.get('rerank'):
+        if index_type == 'flat':
+            raise ValueError("flat 索引本身即为精确检索，无需 rerank")
+        resolved.setdefault('k_factor_rf', 4)
+    if 'pq_m' in resolved:
+        if dim % resolved['pq_m']:
+            raise ValueError(f"pq_m={resolved['pq_m']} 必须整除向量维度 {dim}")
+        if n < (1 << resolved['pq_nbits']):
+            raise ValueError(f"{index_type} 至少需要 {1 << resolved['pq_nbits']} 条训练向量，当前 {n} 条")
+    return resolved
+
+
+def index_factory_string(index_type, params):
+    if index_type == 'flat':
+        desc = 'Flat'
+    elif index_type == 'hnsw':
+        desc = f"HNSW{params['M']},Flat"
+    elif index_type == 'ivf_flat':
+        desc = f"IVF{params['nlist']},Flat"
+    elif index_type == 'ivf_pq':
+        desc = f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    elif index_type == 'fp16':
+        desc = 'SQfp16'
+    elif index_type == 'sq8':
+        desc = 'SQ8'
+    else:
+        desc = f"PQ{params['pq_m']}x{params['pq_nbits']}"
+    if params.get('rerank'):
+        # 额外保存 float32 原始向量，对压缩索引召回的 k*k_factor 个候选做精确重排
+        desc += ',RFlat'
+    return f"IDMap,{desc}"
+
+
+def create_index(dim, index_type='flat', params=None, n_train=0):
+    """
+    创建空的 IDMap 索引，返回 (index, config)。IVF 类索引需随后调用 index.train()。
+    config 形如 {'index_type', 'build': {...}, 'search': {...}}，随归档一起保存。
+    """
+    params = resolve_index_params(index_type, n_train, dim, params)
+    index = faiss.index_factory(dim, index_factory_string(index_type, params))
+    if index_type == 'hnsw':
+        base = faiss.downcast_index(index.index)
+        if isinstance(base, faiss.IndexRefine):
+            base = faiss.downcast_index(base.base_index)
+        base.hnsw.efConstruction = params['efConstruction']
+    search = {k: params[k] for k in SEARCH_PARAM_KEYS if k in params}
+    build = {k: v for k, v in params.items() if k not in SEARCH_PARAM_KEYS}
+    config = {'index_type': index_type, 'build': build, 'search': search}
+    apply_search_params(index, search)
+    return index, config
+
+
+def index_needs_training(dim, index_type='flat', params=None):
+    """新建的该类型索引是否需要先训练（IVF、PQ、SQ 类及其 rerank 变体）。"""
+    index, _ = create_index(dim, index_type, params, n_train=1 << 16)
+    return not index.is_trained
+
+
+def build_index(vectors, ids=None, index_type='flat', params=None):
+    """
+    由完整向量矩阵构建索引（训练 + 添加），返回 (index, config)。
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if ids is None:
+        ids = np.arange(len(vectors), dtype='int64')
+    index, config = create_index(vectors.shape[1], index_type, params, n_train=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)  # type: ignore
+    index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))  # type: ignore
+    return index, config
+
+
+def apply_search_params(index, search_params):
+    """把 efSearch / nprobe 等查询期参数设为索引默认值。"""
+    ps = faiss.ParameterSpace()
+    for name, value in (search_params or {}).items():
+        if value is not None:
+            ps.set_index_parameter(index, name, value)
+
+
+def _unwrap_idmap(index):
+    return faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+
+
+def _base_index(index):
+    inner = _unwrap_idmap(index)
+    return faiss.downcast_index(inner.base_index) if isinstance(inner, faiss.IndexRefine) else inner
+
+
+def supports_selector(index):
+    """IndexPQ 不接受 SearchParameters，无法在检索时应用 IDSelector。"""
+    return not isinstance(_base_index(index), faiss.IndexPQ)
+
+
+def make_search_params(index, ef_search=None, nprobe=None, k_factor=None, sel=None):
+    """
+    构造单次查询的 SearchParameters 覆盖项；无覆盖时返回 None。
+    sel 为按外部 id（分片 id）筛选的 faiss.IDSelector。
+    """
+    inner = _unwrap_idmap(index)
+    is_refine = isinstance(inner, faiss.IndexRefine)
+    base_index = _base_index(index)
+    base_sel = sel
+    if sel is not None and is_refine and hasattr(index, 'id_map'):
+        # IndexIDMap 只转换最外层参数的选择器，传给基础索引的选择器需自行转换为内部 id
+        base_sel = faiss.IDSelectorTranslated(index.id_map, sel)
+    # 只构造与底层索引类型匹配的参数，不适用的覆盖项直接忽略；
+    # 仅因过滤而构造参数时沿用索引当前的 nprobe / efSearch（参数对象的默认值会覆盖它们）
+    base = None
+    ivf = faiss.try_extract_index_ivf(base_index)
+    if ivf is not None and (nprobe is not None or sel is not None):
+        base = faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe)
+    elif isinstance(base_index, faiss.IndexHNSW) and (ef_search is not None or sel is not None):
+        base = faiss.SearchParametersHNSW(efSearch=ef_search or base_index.hnsw.efSearch)
+    elif sel is not None:
+        base = faiss.SearchParameters()
+    if base is not None and sel is not None:
+        base.sel = base_sel
+        base.referenced_sel = (sel, base_sel)  # 保持 Python 侧引用
+    if is_refine and (base is not None or k_factor is not None):
+        # 重排索引的参数对象须显式携带 k_factor，否则会被重置为 1
+        params = faiss.IndexRefineSearchParameters(k_factor=k_factor or inner.k_factor)
+        if base is not None:
+            params.base_index_params = base
+            params.referenced_base_params = base  # 保持 Python 侧引用
+        if sel is not None:
+            params.sel = sel
+        return params
+    return base
+
+
+def _post_filter_search(index, query_vecs, k, id_filter, params):
+    """
+    不支持 IDSelector 的索引：按位图选中比例扩大召回数后再过滤。
+    """
+    from .meta_filter import bitmap_contains
+    n_selected = int(np.unpackbits(id_filter).sum())
+    D = np.full((len(query_vecs), k), np.inf, dtype='float32')
+    I = np.full((len(query_vecs), k), -1, dtype='int64')
+    if n_selected == 0 or index.ntotal == 0:
+        return D, I
+    k_over = int(min(index.ntotal, max(k, k * index.ntotal // n_selected * 2)))
+    D_all, I_all = index.search(query_vecs, k_over, params=params) if params is not None else index.search(query_vecs, k_over)
+    for row in range(len(query_vecs)):
+        keep = bitmap_contains(id_filter, I_all[row])
+        n = min(k, int(keep.sum()))
+        D[row, :n] = D_all[row][keep][:n]
+        I[row, :n] = I_all[row][keep][:n]
+    return D, I
+
+
+def search_index(index, query_vecs, k, ef_search=None, nprobe=None, k_factor=None, id_filter=None):
+    """
+    id_filter 为打包的分片 id 位图（见 meta_filter），只在位图选中的分片中检索。
+    """
+    query_vecs = np.ascontiguousarray(query_vecs, dtype='float32').reshape(-1, index.d)
+    if id_filter is not None and not supports_selector(index):
+        params = make_search_params(index, ef_search, nprobe, k_factor)
+        return _post_filter_search(index, query_vecs, k, id_filter, params)
+    sel = None
+    if id_filter is not None:
+        sel = faiss.IDSelectorBitmap(len(id_filter) * 8, faiss.swig_ptr(id_filter))
+    params = make_search_params(index, ef_search, nprobe, k_factor, sel=sel)
+    if params is None:
+        return index.search(query_vecs, k)  # type: ignore
+    return index.search(query_vecs, k, params=params)  # type: ignore
+
+
+def index_bytes(index):
+    """
+    按索引结构估算占用：编码（ntotal * code_size）、id、码本与图结构，不复制索引。
+    """
+    index = faiss.downcast_index(index)
+    if hasattr(index, 'id_map'):
+        return int(index.id_map.size()) * 8 + index_bytes(index.index)
+    if isinstance(index, faiss.IndexRefine):
+        return index_bytes(index.base_index) + index_bytes(index.refine_index)
+    if hasattr(index, 'hnsw'):
+        hnsw = index.hnsw
+        graph = int(hnsw.neighbors.size()) * 4 + int(hnsw.offsets.size()) * 8 + int(hnsw.levels.size()) * 4
+        return graph + index_bytes(index.storage)
+    nbytes = int(index.ntotal) * int(getattr(index, 'code_size', index.d * 4))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # 倒排表为每条编码另存一个 int64 id
+        nbytes += int(index.ntotal) * 8 + index_bytes(ivf.quantizer)
+    if hasattr(index, 'pq'):
+        nbytes += int(index.pq.centroids.size()) * 4
+    return nbytes
+
+
+def memory_report(index, exact=False):
+    """
+    索引体积及相对同规模 float32 Flat 索引的节省比例。
+    默认按结构估算（index_bytes）；exact=True 时序列化整个索引取精确值（会复制一份索引，仅供基准使用）。
+    """
+    nbytes = int(faiss.serialize_index(index).nbytes) if exact else index_bytes(index)
+    flat_bytes = int(index.ntotal) * int(index.d) * 4 + int(index.ntotal) * 8  # 向量 + IDMap 的 id
+    return {
+        'bytes': nbytes,
+        'flat_bytes': flat_bytes,
+        'saved_ratio': round(1 - nbytes / flat_bytes, 4) if flat_bytes else 0.0,
+    }
+
+
+def describe_index_memory(index, config=None):
+    report = memory_report(index)
+    index_type = (config or {}).get('index_type', 'flat')
+    return (f"索引类型 {index_type}：{report['bytes'] / 2**20:.1f} MB，"
+            f"float32 Flat 需 {report['flat_bytes'] / 2**20:.1f} MB，节省 {report['saved_ratio']:.0%}")
+
+
+def extract_vectors(index):
+    """
+    从 IDMap 索引中取回 (ids, 向量矩阵)；量化索引取回的是近似向量。
+    """
+    inner = _unwrap_idmap(index)
+    ids = faiss.vector_to_array(index.id_map) if hasattr(index, 'id_map') else np.arange(index.ntotal, dtype='int64')
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return ids, inner.reconstruct_n(0, inner.ntotal)
+
+
+def reconstruct_lookup(index):
+    """
+    为按外部 id 重建向量做准备：IVF 索引建立 direct map，返回外部 id -> 内部位置的查找表
+    (sorted_ids, positions)；外部 id 即内部位置时返回 None。结果应由调用方缓存。
+    """
+    ivf = faiss.try_extract_index_ivf(_unwrap_idmap(index))
+    if ivf is not None and ivf.direct_map.no():
+        ivf.make_direct_map()
+    if not hasattr(index, 'id_map'):
+        return None
+    ids = faiss.vector_to_array(index.id_map)
+    if np.array_equal(ids, np.arange(len(ids))):
+        return None
+    order = np.argsort(ids, kind='stable')
+    return ids[order], order
+
+
+def reconstruct_vectors(index, ids, lookup=None):
+    """
+    按外部 id（分片 id）重建向量，返回 (len(ids), d)。量化索引得到的是近似向量，
+    带 RFlat 精确重排的索引得到原始向量。lookup 为 reconstruct_lookup(index) 的结果。
+    """
+    ids = np.asarray(ids, dtype='int64')
+    pos = ids
+    if lookup is not None:
+        sorted_ids, order = lookup
+        at = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        if not np.array_equal(sorted_ids[at], ids):
+            raise KeyError(f'索引中不存在分片 id: {ids[sorted_ids[at] != ids][:5].tolist()}')
+        pos = order[at]
+    return _unwrap_idmap(index).reconstruct_batch(pos)
@@ -0,0 +1,210 @@
+"""
+中文 n-gram 倒排索引（BM25），与 faiss 索引一同写入归档。
+
+分词：NFKC 规范化并转小写后，连续的中日文字符切成相邻二元组（单字成段时保留单字），
+字母数字串整体作为一个词。名称类查询（角色、光锥、任务名称）可直接命中，无需嵌入API。
+
+存储为 5 个数组（词表按字典序排列，查询时二分查找，便于 mmap 直接使用）：
+    terms   词表（unicode 数组）
+    off     每个词的倒排表在 ids/tf 中的起止偏移（uint64，长度为词数+1）
+    ids     分片 id（uint32，按词分组、组内升序）
+    tf      词频（uint16）
+    doclen  每个分片的词数（float32）
+"""
+import io
+import math
+import os
+import re
+import unicodedata
+from array import array
+import numpy as np
+
+ARRAY_NAMES = ('terms', 'off', 'ids', 'tf', 'doclen')
+ZIP_ENTRY = 'lexical.npz'
+
+_TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+|[0-9a-z]+')
+# 不参与索引的 meta 字段
+_SKIP_META_KEYS = {'slice_index'}
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if run[0] < '\x80' or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def lexical_text(text, meta):
+    """
+    分片的可检索文本：meta 中的字段值（含 origin_title）加上分片正文。
+    """
+    parts = []
+    for key, value in (meta or {}).items():
+        if key in _SKIP_META_KEYS or value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            parts.extend(str(v) for v in value)
+        else:
+            parts.append(str(value))
+    parts.append(text)
+    return '\n'.join(parts)
+
+
+class LexicalIndexBuilder:
+    """
+    逐条 add() 分片，build() 生成 LexicalIndex。倒排数据以紧凑的 array 累积，
+    分片 id 须为 0..N-1（与归档一致）。
+    """
+    def __init__(self):
+        self._vocab = {}
+        self._term_ids = array('I')
+        self._doc_ids = array('I')
+        self._tfs = array('H')
+        self._doclen = {}
+
+    def add(self, idx, text, meta=None):
+        tokens = tokenize(lexical_text(text, meta))
+        self._doclen[idx] = len(tokens)
+        if not tokens:
+            return
+        vocab = self._vocab
+        term_ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in tokens), dtype='uint32', count=len(tokens))
+        uniq, counts = np.unique(term_ids, return_counts=True)
+        self._term_ids.frombytes(uniq.astype('uint32').tobytes())
+        self._doc_ids.frombytes(np.full(len(uniq), idx, dtype='uint32').tobytes())
+        self._tfs.frombytes(np.minimum(counts, 65535).astype('uint16').tobytes())
+
+    def build(self):
+        n_docs = max(self._doclen) + 1 if self._doclen else 0
+        doclen = np.zeros(n_docs, dtype='float32')
+        for idx, n in self._doclen.items():
+            doclen[idx] = n
+        terms = sorted(self._vocab)
+        # 原词号 -> 字典序词号
+        rank = np.empty(len(terms), dtype='uint32')
+        for new_id, term in enumerate(terms):
+            rank[self._vocab[term]] = new_id
+        term_ids = rank[np.frombuffer(self._term_ids, dtype='uint32')]
+        doc_ids = np.frombuffer(self._doc_ids, dtype='uint32')
+        tfs = np.frombuffer(self._tfs, dtype='uint16')
+        order = np.lexsort((doc_ids, term_ids))
+        off = np.zeros(len(terms) + 1, dtype='uint64')
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=off[1:])
+        return LexicalIndex({
+            'terms': np.asarray(terms, dtype=str) if terms else np.zeros(0, dtype='<U1'),
+            'off': off,
+            'ids': doc_ids[order],
+            'tf': tfs[order],
+            'doclen': doclen,
+        })
+
+
+class LexicalIndex:
+    def __init__(self, arrays, k1=1.2, b=0.75):
+        self.terms = arrays['terms']
+        self.off = arrays['off']
+        self.ids = arrays['ids']
+        self.tf = arrays['tf']
+        self.doclen = arrays['doclen']
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(self.doclen)
+        self.avgdl = float(np.mean(self.doclen)) if self.n_docs else 0.0
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def _term_id(self, term):
+        pos = int(np.searchsorted(self.terms, term))
+        if pos < len(self.terms) and self.terms[pos] == term:
+            return pos
+        return None
+
+    def postings(self, term):
+        """返回 (分片id数组, 词频数组)，词不存在时为空数组。"""
+        tid = self._term_id(term)
+        if tid is None:
+            return self.ids[:0], self.tf[:0]
+        start, end = int(self.off[tid]), int(self.off[tid + 1])
+        return self.ids[start:end], self.tf[start:end]
+
+    def search(self, query, top_k=10, id_filter=None):
+        """
+        BM25 检索，返回按得分降序的 [(分片id, 得分)]；id_filter 为打包的分片 id 位图（见 meta_filter）。
+        """
+        tokens = tokenize(query)
+        if not tokens or not self.n_docs:
+            return []
+        all_ids, all_scores = [], []
+        for term, qtf in zip(*np.unique(np.asarray(tokens, dtype=str), return_counts=True)):
+            ids, tf = self.postings(str(term))
+            if not len(ids):
+                continue
+            df = len(ids)
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            tf = tf.astype('float32')
+            norm = self.k1 * (1 - self.b + self.b * self.doclen[ids] / self.avgdl)
+            all_ids.append(ids)
+            all_scores.append(qtf * idf * tf * (self.k1 + 1) / (tf + norm))
+        if not all_ids:
+            return []
+        uniq, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if id_filter is not None:
+            from .meta_filter import bitmap_contains
+            keep = bitmap_contains(id_filter, uniq)
+            uniq, scores = uniq[keep], scores[keep]
+            if not len(uniq):
+                return []
+        if len(uniq) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(uniq))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(uniq[i]), float(scores[i])) for i in top]
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, **self.arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            return cls({name: npz[name] for name in ARRAY_NAMES})
+
+    def save_dir(self, dir_path):
+        for name, arr in self.arrays.items():
+            np.save(os.path.join(dir_path, f'lexical.{name}.npy'), arr)
+
+    @classmethod
+    def load_dir(cls, dir_path):
+        """目录归档中不存在倒排索引时返回 None。"""
+        if not os.path.exists(os.path.join(dir_path, 'lexical.off.npy')):
+            return None
+        return cls({name: np.load(os.path.join(dir_path, f'lexical.{name}.npy'), mmap_mode='r')
+                    for name in ARRAY_NAMES})
+
+
+def build_lexical_index(id2content, id2meta):
+    builder = LexicalIndexBuilder()
+    for idx in sorted(id2content):
+        builder.add(idx, id2content[idx], id2meta.get(idx))
+    return builder.build()
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """
+    倒数排名融合：rankings 为若干个按相关度排好序的分片id列表，返回融合后的 [(分片id, 得分)]。
+    """
+    scores = {}
+    for r, ranking in enumerate(rankings):
+        w = 1.0 if weights is None else weights[r]
+        for rank, idx in enumerate(ranking):
+            scores[idx] = scores.get(idx, 0.0) + w / (k + rank + 1)
+    return sorted(scores.items(), key=lambda kv: -kv[1])
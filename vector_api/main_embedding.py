@@ -1,9 +1,17 @@
 import json
 from .slice_utils import slice_content
 from .embed_utils import async_embed_text, embed_text
-from .faiss_utils import initialize_faiss_db, add_to_faiss_db, search_faiss_db
+from .faiss_utils import initialize_faiss_db, add_to_faiss_db, search_faiss_db, build_index, describe_index_memory
 from .storage_utils import save_to_zip, load_from_zip
+from .archive import get_archive, save_archive
 from .async_utils import run_async
+from .query_cache import embed_query, async_embed_query, embed_queries, async_embed_queries
+from .batch_utils import pack_batches, embed_batch
+from .embed_cache import EmbeddingCache, default_cache_path, text_hash
+from .stream_pipeline import embed_and_store_streaming
+from .lexical_index import reciprocal_rank_fusion
+from .meta_table import MetaTableBuilder
+from .mmr import mmr_rerank, cosine_relevance, scale_scores
 import numpy as np
 import faiss
 import os
@@ -13,16 +21,46 @@ import httpx
 
 # 主流程：分片、嵌入、存储
 
-def embed_and_store_all_in_one(data_dir, db_zip_path, api_url, api_key, model='BAAI/bge-m3', max_length=5000, context_length=50, max_concurrency=32):
-    files = list(sorted(Path(data_dir).glob('*.json')))
-    vectors = []
-    id2meta = {}
+def embed_and_store_all_in_one(data_dir, db_zip_path, api_url, api_key, model='BAAI/bge-m3', max_length=5000, context_length=50, max_concurrency=32,
+                               batch_size=32, batch_tokens=32000, use_cache=True, cache_path=None, streaming=False,
+                               index_type='flat', index_params=None, files=None, shard_by_category=False, categories=None,
+                               max_tokens=None, dedup=False, dedup_threshold=0.9):
+    """
+    index_type: flat / hnsw / ivf_flat / ivf_pq / fp16 / sq8 / pq，index_params 覆盖构建参数与查询参数
+    （efSearch、nprobe、k_factor_rf），配置随归档保存，检索时自动生效。
+    压缩类型可加 index_params={'rerank': True} 对候选做 float32 精确重排。
+    files 指定时只嵌入这些文件（默认 data_dir 下全部 *.json）。
+    shard_by_category=True 时 db_zip_path 为分片库目录（如 db/wiki_shards），每个分类一个分片；
+    categories 限定只重建这些分类的分片。
+    max_tokens 指定时分片同时受 token 数限制（按嵌入模型的输入上限设置，如 bge-m3 为 8192）。
+    dedup=True 时在嵌入前做近重复检测（MinHash，见 dedup），估计相似度不低于 dedup_threshold 的分片
+    共用代表分片的向量与文本，各自保留 meta；流式模式下不做近重复检测。
+    """
+    if shard_by_category:
+        from .shards import embed_and_store_sharded
+        return embed_and_store_sharded(data_dir, db_zip_path, api_url, api_key, categories=categories,
+                                       cache_path=cache_path, model=model, max_length=max_length,
+                                       context_length=context_length, max_concurrency=max_concurrency,
+                                       batch_size=batch_size, batch_tokens=batch_tokens, use_cache=use_cache,
+                                       streaming=streaming, index_type=index_type, index_params=index_params,
+                                       max_tokens=max_tokens, dedup=dedup, dedup_threshold=dedup_threshold)
+    if streaming:
+        # 有界队列流水线，内存占用与语料规模无关
+        return embed_and_store_streaming(data_dir, db_zip_path, api_url, api_key, model=model, max_length=max_length,
+                                         context_length=context_length, max_concurrency=max_concurrency,
+                                         batch_size=batch_size, batch_tokens=batch_tokens,
+                                         use_cache=use_cache, cache_path=cache_path,
+                                         index_type=index_type, index_params=index_params, files=files,
+                                         max_tokens=max_tokens)
+    files = list(sorted(Path(data_dir).glob('*.json'))) if files is None else list(files)
+    meta_table = MetaTableBuilder()  # 页面 meta 只登记一次，分片只记 (页面号, slice_index)
     id2content = {}
     id2title = {}
     id2raw = {}  # 新增：原始数据
+    title2ids = {}  # origin_title -> [分片id]，供上下文拼接直接查找
     next_id = 0
     total_slices = 0
-    slice_infos = []  # [(slice_text, meta_with_slice, title, raw_id)]
+    slice_infos = []  # [(slice_text, (doc_id, slice_index), title, raw_id)]
     # raw_id_map = {}  # 文件名或自定义唯一id -> raw_id
     for file in files:
         with open(file, 'r', encoding='utf-8') as f:
@@ -32,74 +70,91 @@ def embed_and_store_all_in_one(data_dir, db_zip_path, api_url, api_key, model='B
         title = file.stem
         raw_id = title  # 以文件名为唯一id
         id2raw[raw_id] = {'content': content, 'meta': meta, 'title': title}
-        slices = slice_content(content, max_length=max_length, context_length=context_length)
+        slices = slice_content(content, max_length=max_length, context_length=context_length, max_tokens=max_tokens)
+        doc_id = meta_table.add_doc(dict(meta, origin_title=title))
         for slice_idx, slice_text in enumerate(slices):
-            meta_with_slice = dict(meta)
-            meta_with_slice['slice_index'] = slice_idx + 1
-            meta_with_slice['origin_title'] = title
-            slice_infos.append((slice_text, meta_with_slice, title, raw_id))
+            slice_infos.append((slice_text, (doc_id, slice_idx + 1), title, raw_id))
         total_slices += len(slices)
-    async def embed_slice(session, api_url, api_key, model, slice_text):
-        for _ in range(10):  # 重试10次
-            try:
-                return await async_embed_text(session, api_url, api_key, slice_text, model)
-            except Exception:
-                import asyncio; await asyncio.sleep(2)  # 等待2秒后重试
-        # 如果重试10次仍然失败，则抛出异常
-        raise RuntimeError(f"嵌入失败: {slice_text[:30]}...")
-    async def process_all():
-        import asyncio
-        sem = asyncio.Semaphore(max_concurrency)
-        from typing import Any
-        results: list[Any] = [None] * len(slice_infos)
-        async with httpx.AsyncClient() as session:
-            async def worker(idx, slice_text, meta_with_slice, title, raw_id):
-                async with sem:
-                    emb = await embed_slice(session, api_url, api_key, model, slice_text)
-                    results[idx] = (emb, meta_with_slice, slice_text, title, raw_id)
-                    progress.update(task, advance=1)
-            tasks = [worker(idx, slice_text, meta_with_slice, title, raw_id)
-                     for idx, (slice_text, meta_with_slice, title, raw_id) in enumerate(slice_infos)]
-            await asyncio.gather(*tasks)
-        return results
     if not slice_infos:
         print('[无可嵌入的数据]')
         return
     os.makedirs(os.path.dirname(db_zip_path), exist_ok=True)
-    with Progress(
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("{task.completed}/{task.total}"),
-        TimeElapsedColumn(),
-        TimeRemainingColumn(),
-        transient=False
-    ) as progress:
-        task = progress.add_task("嵌入分片中", total=total_slices)
-        results = run_async(process_all())
-    for tup in results:
-        if tup is None:
-            continue
-        emb, meta_with_slice, slice_text, title, raw_id = tup
-        vectors.append(emb)
-        id2meta[next_id] = meta_with_slice
-        id2content[next_id] = slice_text
-        id2title[next_id] = title
-        next_id += 1
-    vectors_np = np.stack(vectors)
-    dim = vectors_np.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    id_index = faiss.IndexIDMap(index)
-    ids = np.arange(len(vectors_np), dtype='int64')
-    id_index.add_with_ids(vectors_np.astype('float32'), ids) # type: ignore
-    faiss.write_index(id_index, 'faiss.index')
-    save_to_zip(db_zip_path, 'faiss.index', id2meta, id2content, id2title, id2raw)
-    print(f"已写入 {db_zip_path}，共{len(vectors_np)}条（分片）")
+    canonical = None
+    if dedup:
+        from .dedup import find_near_duplicates
+        canonical = find_near_duplicates([info[0] for info in slice_infos], threshold=dedup_threshold)
+        rep_rows = np.flatnonzero(canonical == np.arange(len(canonical)))
+    else:
+        rep_rows = np.arange(len(slice_infos))
+    # 查询嵌入缓存：只嵌入新增或内容变化的分片，相同文本只嵌入一次；近重复分片只嵌入代表分片
+    hashes = [text_hash(slice_infos[i][0]) for i in rep_rows]
+    cache = EmbeddingCache(cache_path or default_cache_path(db_zip_path)) if use_cache else None
+    try:
+        hash2vec = cache.get_many(model, set(hashes)) if cache else {}
+        cache_hits = sum(1 for h in hashes if h in hash2vec)
+        pending = {}
+        for h, i in zip(hashes, rep_rows):
+            if h not in hash2vec and h not in pending:
+                pending[h] = slice_infos[i][0]
+        # 按条数与token预算打包为多输入请求
+        batches = pack_batches(pending.items(), max_batch_size=batch_size, max_batch_tokens=batch_tokens)
+        async def process_all():
+            import asyncio
+            sem = asyncio.Semaphore(max_concurrency)
+            async with httpx.AsyncClient() as session:
+                async def worker(batch):
+                    async with sem:
+                        pairs = await embed_batch(session, api_url, api_key, batch, model)
+                    # 每批立即落盘，中断后重跑可从缓存续上
+                    if cache:
+                        cache.put_many(model, pairs)
+                    hash2vec.update(pairs)
+                    progress.update(task, advance=len(batch))
+                await asyncio.gather(*(worker(batch) for batch in batches))
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+            TimeRemainingColumn(),
+            transient=False
+        ) as progress:
+            task = progress.add_task("嵌入分片中", total=len(pending))
+            if pending:
+                run_async(process_all())
+        vectors = [hash2vec[h] for h in hashes]
+        for slice_text, (doc_id, slice_index), title, raw_id in slice_infos:
+            meta_table.add_slice(next_id, doc_id, slice_index)
+            # 近重复分片引用代表分片的同一字符串对象，归档中只存一份
+            id2content[next_id] = slice_infos[canonical[next_id]][0] if canonical is not None else slice_text
+            id2title[next_id] = title
+            title2ids.setdefault(title, []).append(next_id)
+            next_id += 1
+        id2meta = meta_table.build()
+        vectors_np = np.stack(vectors)
+        id_index, index_config = build_index(vectors_np, ids=rep_rows, index_type=index_type, params=index_params)
+        save_archive(db_zip_path, id_index, id2meta, id2content, id2title, id2raw, title2ids, index_config,
+                     canonical=canonical)
+        print(f"已写入 {db_zip_path}，共{len(slice_infos)}条（分片）")
+        if canonical is not None:
+            from .dedup import dedup_report, describe_dedup
+            print(describe_dedup(dedup_report([info[0] for info in slice_infos], canonical, dim=vectors_np.shape[1])))
+        print(describe_index_memory(id_index, index_config))
+        if cache:
+            # 归档写入成功后再清理已删除/已变化页面的旧向量；近重复的非代表分片文本仍存在，
+            # 其缓存向量同样保留（关闭去重或调整阈值后无需重新嵌入）
+            keep = hashes if canonical is None else [text_hash(info[0]) for info in slice_infos]
+            removed = cache.prune(model, keep)
+            print(f"嵌入缓存：命中{cache_hits}条，新嵌入{len(pending)}条，清理{removed}条")
+    finally:
+        if cache:
+            cache.close()
 
 def search_all_in_one(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3'):
-    from .embed_utils import embed_text
-    index, id2meta, id2content, id2title, id2raw = load_from_zip(db_zip_path)
-    query_vec = embed_text(api_url, api_key, query, model).reshape(1, -1)
-    D, I = index.search(query_vec, top_k)
+    archive = get_archive(db_zip_path)
+    id2meta, id2raw = archive.id2meta, archive.id2raw
+    query_vec = embed_query(api_url, api_key, query, model).reshape(1, -1)
+    D, I = archive.search(query_vec, top_k)
     # 只返回唯一原始数据
     raw_ids = set()
     results = []
@@ -116,20 +171,232 @@ def search_all_in_one(query, db_zip_path, api_url, api_key, top_k=10, model='BAA
                 results.append({'title': raw_id})
     return results
 
-def search_all_in_one_meta(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3'):
-    from .embed_utils import embed_text
-    index, id2meta, id2content, id2title, id2raw = load_from_zip(db_zip_path)
-    query_vec = embed_text(api_url, api_key, query, model).reshape(1, -1)
-    D, I = index.search(query_vec, top_k)
-    # 只返回唯一meta
+def _unique_page_hits(archive, ids):
+    # 每个页面只保留排名最高的分片
     raw_ids = set()
-    results = []
-    for idx in I[0]:
+    hits = []
+    for idx in ids:
         if idx == -1:
             continue
-        meta = id2meta.get(idx, {})
+        idx = int(idx)
+        meta = archive.id2meta.get(idx, {})
         raw_id = meta.get('origin_title')
         if raw_id and raw_id not in raw_ids:
             raw_ids.add(raw_id)
-            results.append(meta)
-    return results
+            hits.append((idx, meta))
+    return hits
+
+def _diversify(archive, candidates, query_vecs, diversity):
+    """
+    对每条查询的候选分片做 MMR 重排，所有查询一起批量计算。
+    candidates 为 [(候选id列表, 相关性得分或 None)]；得分为 None 的查询以 query_vecs 中对应行
+    与候选向量的余弦相似度作为相关性。候选向量由索引重建，不调用嵌入API。
+    """
+    n = max((len(ids) for ids, _ in candidates), default=0)
+    if n < 2:
+        return [list(ids) for ids, _ in candidates]
+    flat = [idx for ids, _ in candidates for idx in ids]
+    flat_vecs = archive.reconstruct(flat)
+    vecs = np.zeros((len(candidates), n, flat_vecs.shape[1]), dtype='float32')
+    relevance = np.zeros((len(candidates), n), dtype='float32')
+    valid = np.zeros((len(candidates), n), dtype=bool)
+    pos = 0
+    for q, (ids, scores) in enumerate(candidates):
+        m = len(ids)
+        vecs[q, :m] = flat_vecs[pos:pos + m]
+        valid[q, :m] = True
+        pos += m
+        if scores is not None:
+            relevance[q, :m] = scale_scores(scores)
+        elif m:
+            relevance[q, :m] = cosine_relevance(query_vecs[q].reshape(1, -1), vecs[q:q + 1, :m])[0]
+    order = mmr_rerank(relevance, vecs, diversity=diversity, valid=valid)
+    return [[ids[i] for i in order[q] if i >= 0] for q, (ids, _) in enumerate(candidates)]
+
+def _page_hits(archive, candidates, query_vecs, top_k, diversity):
+    """候选 -> 每条查询的 [(分片id, meta)]；diversity 指定时先做 MMR 重排。"""
+    if diversity:
+        ranked = _diversify(archive, candidates, query_vecs, diversity)
+    else:
+        ranked = [ids for ids, _ in candidates]
+    return [_unique_page_hits(archive, ids)[:top_k] for ids in ranked]
+
+def search_all_in_one_hits(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', ef_search=None, nprobe=None,
+                           filters=None, diversity=None, candidates=None):
+    """
+    返回 [(分片id, meta)]，每个页面只保留排名最高的分片。
+    ef_search / nprobe 可覆盖归档中保存的查询参数。
+    filters 按元数据限定范围，如 {'category': '光锥', '稀有度': '5'}，可用字段见 meta_filter.FILTER_FIELDS。
+    diversity（0~1）指定时先多召回 candidates 个分片（默认 top_k 的 4 倍），再以 MMR 重排，
+    值越大结果越分散，避免同一长页面的相邻分片占满结果。
+    """
+    archive = get_archive(db_zip_path)
+    query_vec = embed_query(api_url, api_key, query, model).reshape(1, -1)
+    k = (candidates or top_k * 4) if diversity else top_k
+    D, I = archive.search(query_vec, k, ef_search=ef_search, nprobe=nprobe, filters=filters)
+    return _page_hits(archive, [(_valid_ids(I[0]), None)], query_vec, top_k, diversity)[0]
+
+async def async_search_all_in_one_hits(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', ef_search=None, nprobe=None,
+                                       filters=None, diversity=None, candidates=None):
+    """
+    search_all_in_one_hits 的异步版本：嵌入请求走共享的 httpx.AsyncClient，
+    归档加载与 faiss 检索放到线程池执行，不阻塞事件循环。
+    """
+    import asyncio
+    archive, query_vec = await asyncio.gather(
+        asyncio.to_thread(get_archive, db_zip_path),
+        async_embed_query(api_url, api_key, query, model),
+    )
+    query_vec = query_vec.reshape(1, -1)
+    k = (candidates or top_k * 4) if diversity else top_k
+    D, I = await asyncio.to_thread(archive.search, query_vec, k, ef_search, nprobe, None, filters)
+    hits = await asyncio.to_thread(_page_hits, archive, [(_valid_ids(I[0]), None)], query_vec, top_k, diversity)
+    return hits[0]
+
+def search_all_in_one_meta(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', ef_search=None, nprobe=None,
+                           filters=None, diversity=None):
+    # 只返回唯一meta
+    hits = search_all_in_one_hits(query, db_zip_path, api_url, api_key, top_k=top_k, model=model,
+                                  ef_search=ef_search, nprobe=nprobe, filters=filters, diversity=diversity)
+    return [meta for _, meta in hits]
+
+async def async_search_all_in_one_meta(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', ef_search=None, nprobe=None,
+                                       filters=None, diversity=None):
+    hits = await async_search_all_in_one_hits(query, db_zip_path, api_url, api_key, top_k=top_k, model=model,
+                                              ef_search=ef_search, nprobe=nprobe, filters=filters, diversity=diversity)
+    return [meta for _, meta in hits]
+
+SEARCH_MODES = ('auto', 'hybrid', 'lexical', 'vector')
+# rag.db 与批量检索接口的默认模式：保持原有的纯向量检索，词法/融合检索需显式传 mode='auto' 或 'hybrid'
+DEFAULT_SEARCH_MODE = 'vector'
+
+def _resolve_search_mode(archive, query, mode):
+    if mode not in SEARCH_MODES:
+        raise ValueError(f'未知检索模式: {mode}，可选 {SEARCH_MODES}')
+    if mode == 'auto':
+        # 查询恰为页面标题（角色、光锥、任务名称等）时词法检索已足够精确
+        return 'lexical' if query.strip() in archive.title2ids else 'hybrid'
+    return mode
+
+def _valid_ids(row):
+    return [int(idx) for idx in row if idx != -1]
+
+def _ranked_candidates(lexical_hits, I, mode, rrf_k):
+    """
+    返回 (候选分片id列表, 相关性得分)；vector 模式得分为 None，需要时由查询向量现算。
+    """
+    vector_ids = _valid_ids(I[0]) if I is not None else []
+    if mode == 'vector':
+        return vector_ids, None
+    if mode == 'lexical':
+        return [idx for idx, _ in lexical_hits], [score for _, score in lexical_hits]
+    fused = reciprocal_rank_fusion([[idx for idx, _ in lexical_hits], vector_ids], k=rrf_k)
+    return [idx for idx, _ in fused], [score for _, score in fused]
+
+def _vector_k(mode, top_k, n, diversity):
+    # 纯向量且不重排时只需 top_k 个分片，否则按候选数多召回
+    return top_k if mode == 'vector' and not diversity else n
+
+def hybrid_search_hits(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', mode='hybrid',
+                       rrf_k=60, candidates=None, ef_search=None, nprobe=None, filters=None, diversity=None):
+    """
+    词法（BM25）与向量检索的倒数排名融合，返回 [(分片id, meta)]，每个页面只保留排名最高的分片。
+    mode: hybrid 融合；lexical 纯词法，不调用嵌入API；vector 等同 search_all_in_one_hits；
+    auto 查询恰为页面标题时走纯词法，否则融合。candidates 为每一路召回的分片数，默认 top_k 的 4 倍。
+    filters 同时作用于词法与向量两路召回。
+    diversity（0~1）指定时对候选做 MMR 重排（融合/词法得分缩放后作为相关性），见 search_all_in_one_hits。
+    """
+    archive = get_archive(db_zip_path)
+    mode = _resolve_search_mode(archive, query, mode)
+    n = candidates or top_k * 4
+    lexical_hits = archive.lexical_search(query, n, filters=filters) if mode != 'vector' else []
+    I = query_vec = None
+    if mode != 'lexical':
+        query_vec = embed_query(api_url, api_key, query, model).reshape(1, -1)
+        D, I = archive.search(query_vec, _vector_k(mode, top_k, n, diversity), ef_search=ef_search, nprobe=nprobe,
+                              filters=filters)
+    return _page_hits(archive, [_ranked_candidates(lexical_hits, I, mode, rrf_k)], query_vec, top_k, diversity)[0]
+
+async def async_hybrid_search_hits(query, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', mode='hybrid',
+                                   rrf_k=60, candidates=None, ef_search=None, nprobe=None, filters=None, diversity=None):
+    """
+    hybrid_search_hits 的异步版本：词法检索与查询嵌入并发进行。
+    """
+    import asyncio
+    archive = await asyncio.to_thread(get_archive, db_zip_path)
+    mode = _resolve_search_mode(archive, query, mode)
+    n = candidates or top_k * 4
+
+    async def lexical():
+        if mode == 'vector':
+            return []
+        return await asyncio.to_thread(archive.lexical_search, query, n, filters)
+
+    async def vector():
+        if mode == 'lexical':
+            return None, None
+        query_vec = (await async_embed_query(api_url, api_key, query, model)).reshape(1, -1)
+        D, I = await asyncio.to_thread(archive.search, query_vec, _vector_k(mode, top_k, n, diversity),
+                                       ef_search, nprobe, None, filters)
+        return I, query_vec
+
+    lexical_hits, (I, query_vec) = await asyncio.gather(lexical(), vector())
+    hits = await asyncio.to_thread(_page_hits, archive, [_ranked_candidates(lexical_hits, I, mode, rrf_k)],
+                                   query_vec, top_k, diversity)
+    return hits[0]
+
+def _many_plan(archive, queries, top_k, mode, candidates, diversity):
+    modes = [_resolve_search_mode(archive, query, mode) for query in queries]
+    vec_rows = [i for i, m in enumerate(modes) if m != 'lexical']
+    n = candidates or top_k * 4
+    k = max((_vector_k(modes[i], top_k, n, diversity) for i in vec_rows), default=top_k)
+    return modes, vec_rows, k
+
+def _many_results(archive, queries, modes, vec_rows, query_vecs, I, top_k, rrf_k, n, filters, diversity):
+    rows = {}
+    vecs = [None] * len(queries)
+    for row, i in enumerate(vec_rows):
+        rows[i] = I[row:row + 1, :_vector_k(modes[i], top_k, n, diversity)]
+        vecs[i] = query_vecs[row]
+    candidates = []
+    for i, query in enumerate(queries):
+        lexical_hits = archive.lexical_search(query, n, filters=filters) if modes[i] != 'vector' else []
+        candidates.append(_ranked_candidates(lexical_hits, rows.get(i), modes[i], rrf_k))
+    return _page_hits(archive, candidates, vecs, top_k, diversity)
+
+def search_many_hits(queries, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', mode=DEFAULT_SEARCH_MODE,
+                     rrf_k=60, candidates=None, ef_search=None, nprobe=None, filters=None, diversity=None):
+    """
+    多条查询一次完成：所有查询的嵌入合并为一次API请求，堆叠后只做一次批量 index.search，
+    diversity 指定时所有查询的 MMR 重排也合并为一次批量计算。
+    返回与 queries 等长的列表，每项为该查询的 [(分片id, meta)]；mode 等参数同 hybrid_search_hits。
+    """
+    queries = list(queries)
+    archive = get_archive(db_zip_path)
+    modes, vec_rows, k = _many_plan(archive, queries, top_k, mode, candidates, diversity)
+    I = query_vecs = None
+    if vec_rows:
+        query_vecs = embed_queries(api_url, api_key, [queries[i] for i in vec_rows], model)
+        D, I = archive.search(query_vecs, k, ef_search=ef_search, nprobe=nprobe, filters=filters)
+    return _many_results(archive, queries, modes, vec_rows, query_vecs, I, top_k, rrf_k, candidates or top_k * 4,
+                         filters, diversity)
+
+async def async_search_many_hits(queries, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', mode=DEFAULT_SEARCH_MODE,
+                                 rrf_k=60, candidates=None, ef_search=None, nprobe=None, filters=None, diversity=None):
+    import asyncio
+    queries = list(queries)
+    archive = await asyncio.to_thread(get_archive, db_zip_path)
+    modes, vec_rows, k = _many_plan(archive, queries, top_k, mode, candidates, diversity)
+    I = query_vecs = None
+    if vec_rows:
+        query_vecs = await async_embed_queries(api_url, api_key, [queries[i] for i in vec_rows], model)
+        D, I = await asyncio.to_thread(archive.search, query_vecs, k, ef_search, nprobe, None, filters)
+    return await asyncio.to_thread(_many_results, archive, queries, modes, vec_rows, query_vecs, I, top_k, rrf_k,
+                                   candidates or top_k * 4, filters, diversity)
+
+def search_many(queries, db_zip_path, api_url, api_key, top_k=10, model='BAAI/bge-m3', **kwargs):
+    """
+    search_all_in_one_meta 的批量版本，返回每条查询的唯一 meta 列表。
+    """
+    hits = search_many_hits(queries, db_zip_path, api_url, api_key, top_k=top_k, model=model, **kwargs)
+    return [[meta for _, meta in query_hits] for query_hits in hits]
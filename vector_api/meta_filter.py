@@ -0,0 +1,131 @@
+"""
+元数据过滤位图：构建归档时为常用字段的每个取值预先生成分片 id 位图（bit i 即分片 i，小端位序，
+与 faiss.IDSelectorBitmap 一致），检索时按条件做位运算后直接交给 faiss 作为 IDSelector。
+
+存储为 3 个数组：
+    fields   每个位图对应的字段名（unicode 数组）
+    values   每个位图对应的字段取值
+    bitmaps  uint8 矩阵，每行一个位图，长度 ceil(分片数/8)
+"""
+import io
+import os
+import numpy as np
+
+FILTER_FIELDS = ('category', '命途', '稀有度', '所属版本', '实装版本')
+ARRAY_NAMES = ('fields', 'values', 'bitmaps')
+ZIP_ENTRY = 'meta_bitmaps.npz'
+
+
+def _norm_values(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(v).strip() for v in value if v is not None and str(v).strip()]
+    value = str(value).strip()
+    return [value] if value else []
+
+
+class MetaBitmapBuilder:
+    """逐条 add() 分片的 meta，build() 生成 MetaBitmaps。"""
+    def __init__(self, fields=FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self._ids = {}
+        self._n = 0
+
+    def add(self, idx, meta):
+        self._n = max(self._n, idx + 1)
+        for field in self.fields:
+            for value in _norm_values((meta or {}).get(field)):
+                self._ids.setdefault((field, value), []).append(idx)
+
+    def build(self):
+        keys = sorted(self._ids)
+        bitmaps = np.zeros((len(keys), (self._n + 7) // 8), dtype='uint8')
+        for row, key in enumerate(keys):
+            bits = np.zeros(self._n, dtype=bool)
+            bits[self._ids[key]] = True
+            bitmaps[row] = np.packbits(bits, bitorder='little')
+        return MetaBitmaps({
+            'fields': np.asarray([f for f, _ in keys], dtype=str) if keys else np.zeros(0, dtype='<U1'),
+            'values': np.asarray([v for _, v in keys], dtype=str) if keys else np.zeros(0, dtype='<U1'),
+            'bitmaps': bitmaps,
+        }, n_ids=self._n)
+
+
+class MetaBitmaps:
+    def __init__(self, arrays, n_ids=None):
+        self.fields = arrays['fields']
+        self.values = arrays['values']
+        self.bitmaps = arrays['bitmaps']
+        self.n_ids = n_ids if n_ids is not None else self.bitmaps.shape[1] * 8
+        self._rows = {}
+        for row, (field, value) in enumerate(zip(self.fields.tolist(), self.values.tolist())):
+            self._rows.setdefault(field, {})[value] = row
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def available(self):
+        """{字段: [取值]}，供界面列出可选的过滤条件。"""
+        return {field: sorted(rows) for field, rows in self._rows.items()}
+
+    def mask(self, filters):
+        """
+        filters: {字段: 取值或取值列表}，同一字段内取并集，不同字段间取交集。
+        返回打包后的 uint8 位图；filters 为空时返回 None（不过滤）。
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+        if not filters:
+            return None
+        result = None
+        for field, value in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f'不支持按 {field} 过滤，可选字段: {FILTER_FIELDS}')
+            rows = [self._rows.get(field, {}).get(v) for v in _norm_values(value)]
+            rows = [r for r in rows if r is not None]
+            if rows:
+                field_mask = np.bitwise_or.reduce(self.bitmaps[rows], axis=0)
+            else:
+                field_mask = np.zeros(self.bitmaps.shape[1], dtype='uint8')
+            result = field_mask if result is None else result & field_mask
+        return np.ascontiguousarray(result)
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, **self.arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            return cls({name: npz[name] for name in ARRAY_NAMES})
+
+    def save_dir(self, dir_path):
+        for name, arr in self.arrays.items():
+            np.save(os.path.join(dir_path, f'filters.{name}.npy'), arr)
+
+    @classmethod
+    def load_dir(cls, dir_path):
+        """目录归档中不存在过滤位图时返回 None。"""
+        if not os.path.exists(os.path.join(dir_path, 'filters.bitmaps.npy')):
+            return None
+        return cls({name: np.load(os.path.join(dir_path, f'filters.{name}.npy'), mmap_mode='r')
+                    for name in ARRAY_NAMES})
+
+
+def build_meta_bitmaps(id2meta):
+    builder = MetaBitmapBuilder()
+    for idx in sorted(id2meta):
+        builder.add(idx, id2meta[idx])
+    return builder.build()
+
+
+def bitmap_contains(bitmap, ids):
+    """ids 中每个分片 id 是否在位图内（越界视为不在）。"""
+    ids = np.asarray(ids, dtype='int64')
+    inside = (ids >= 0) & (ids < len(bitmap) * 8)
+    out = np.zeros(len(ids), dtype=bool)
+    valid = ids[inside]
+    out[inside] = (bitmap[valid >> 3] >> (valid & 7)) & 1 == 1
+    return out
@@ -0,0 +1,206 @@
+"""
+列式元数据表：页面 meta 每个页面只存一份，分片只记 (页面号, slice_index)。
+
+同一页面的各分片 meta 只有 slice_index 不同，逐条保存整份字典（任务页面还带着整段任务流程）
+会让 id2meta 占满归档体积与加载时间。这里把取值按 JSON 编码后字典化，所有字段共用一个取值池，
+页面表只存取值编号（category 等低基数字段因此变为整数编码）。
+
+存储为 6 个数组：
+    slice_doc    int32，每个分片所属的页面号（-1 表示该 id 不存在）
+    slice_index  int32，每个分片的 slice_index（-1 表示 meta 中没有该字段）
+    fields       字段名（unicode 数组）
+    doc_codes    int32 矩阵，每行一个页面，取值池编号（-1 表示页面没有该字段）
+    pool         uint8，取值池：逐条 JSON 拼接
+    pool_off     uint64，取值池偏移表
+
+按 id 访问时才解码出字典，检索只为返回的命中分片付出解码开销。
+"""
+import io
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+
+ARRAY_NAMES = ('slice_doc', 'slice_index', 'fields', 'doc_codes', 'pool', 'pool_off')
+ZIP_ENTRY = 'meta_table.npz'
+SLICE_FIELD = 'slice_index'
+TITLE_FIELD = 'origin_title'
+
+
+def _encode_value(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class MetaTableBuilder:
+    """
+    add_doc() 登记页面 meta 返回页面号，add_slice() 登记分片；
+    也可直接 add(idx, meta)，内容相同的页面 meta 自动合并。build() 生成 MetaTable。
+    """
+    def __init__(self):
+        self._fields = {}
+        self._pool = {}
+        self._docs = []
+        self._doc_keys = {}
+        self._slices = {}
+
+    def add_doc(self, meta):
+        row = {}
+        for field, value in (meta or {}).items():
+            col = self._fields.setdefault(field, len(self._fields))
+            row[col] = self._pool.setdefault(_encode_value(value), len(self._pool))
+        self._docs.append(row)
+        return len(self._docs) - 1
+
+    def add_slice(self, idx, doc_id, slice_index=None):
+        self._slices[idx] = (doc_id, slice_index if isinstance(slice_index, int) else -1)
+
+    def add(self, idx, meta):
+        meta = dict(meta or {})
+        slice_index = meta.pop(SLICE_FIELD, None)
+        key = json.dumps(meta, ensure_ascii=False, sort_keys=True, default=str)
+        doc_id = self._doc_keys.get(key)
+        if doc_id is None:
+            doc_id = self._doc_keys[key] = self.add_doc(meta)
+        self.add_slice(idx, doc_id, slice_index)
+
+    def build(self):
+        n = max(self._slices, default=-1) + 1
+        slice_doc = np.full(n, -1, dtype='int32')
+        slice_index = np.full(n, -1, dtype='int32')
+        for idx, (doc_id, s) in self._slices.items():
+            slice_doc[idx] = doc_id
+            slice_index[idx] = s
+        doc_codes = np.full((len(self._docs), len(self._fields)), -1, dtype='int32')
+        for doc_id, row in enumerate(self._docs):
+            for col, code in row.items():
+                doc_codes[doc_id, col] = code
+        values = [v.encode('utf-8') for v in self._pool]
+        pool_off = np.zeros(len(values) + 1, dtype='uint64')
+        np.cumsum([len(v) for v in values], out=pool_off[1:])
+        return MetaTable({
+            'slice_doc': slice_doc,
+            'slice_index': slice_index,
+            'fields': np.asarray(list(self._fields), dtype=str) if self._fields else np.zeros(0, dtype='<U1'),
+            'doc_codes': doc_codes,
+            'pool': np.frombuffer(b''.join(values), dtype='uint8'),
+            'pool_off': pool_off,
+        })
+
+
+class MetaTable(Mapping):
+    """
+    只读的 分片id -> meta 字典 视图，与原先的 id2meta 字典用法一致。
+    """
+    def __init__(self, arrays):
+        self.slice_doc = arrays['slice_doc']
+        self.slice_index = arrays['slice_index']
+        self.fields = arrays['fields']
+        self.doc_codes = arrays['doc_codes']
+        self.pool = arrays['pool']
+        self.pool_off = arrays['pool_off']
+        self._field_names = self.fields.tolist()
+        self._col = {field: col for col, field in enumerate(self._field_names)}
+        self._len = int(np.count_nonzero(np.asarray(self.slice_doc) >= 0))
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return (int(idx) for idx in np.flatnonzero(np.asarray(self.slice_doc) >= 0))
+
+    def __contains__(self, idx):
+        return isinstance(idx, (int, np.integer)) and 0 <= idx < len(self.slice_doc) and self.slice_doc[idx] >= 0
+
+    def _value(self, code):
+        start, end = int(self.pool_off[code]), int(self.pool_off[code + 1])
+        return json.loads(bytes(self.pool[start:end]).decode('utf-8'))
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        codes = self.doc_codes[self.slice_doc[idx]]
+        slice_index = int(self.slice_index[idx])
+        meta = {}
+        for field, code in zip(self._field_names, codes.tolist()):
+            if field == TITLE_FIELD and slice_index >= 0:
+                # 与构建时 dict(meta) + slice_index + origin_title 的键顺序一致
+                meta[SLICE_FIELD] = slice_index
+            if code >= 0:
+                meta[field] = self._value(code)
+        if slice_index >= 0:
+            meta.setdefault(SLICE_FIELD, slice_index)
+        return meta
+
+    def doc_id(self, idx):
+        return int(self.slice_doc[idx])
+
+    def value(self, idx, field, default=None):
+        """只解码单个字段，不构造整份字典。"""
+        if field == SLICE_FIELD:
+            s = int(self.slice_index[idx])
+            return s if s >= 0 else default
+        col = self._col.get(field)
+        if col is None:
+            return default
+        code = int(self.doc_codes[self.slice_doc[idx], col])
+        return self._value(code) if code >= 0 else default
+
+    def field_view(self, field):
+        return _FieldView(self, field)
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, **self.arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            return cls({name: npz[name] for name in ARRAY_NAMES})
+
+    def save_dir(self, dir_path):
+        for name, arr in self.arrays.items():
+            np.save(os.path.join(dir_path, f'meta.{name}.npy'), arr)
+
+    @classmethod
+    def load_dir(cls, dir_path):
+        """目录归档中不存在元数据表（旧格式）时返回 None。"""
+        if not os.path.exists(os.path.join(dir_path, 'meta.slice_doc.npy')):
+            return None
+        return cls({name: np.load(os.path.join(dir_path, f'meta.{name}.npy'), mmap_mode='r')
+                    for name in ARRAY_NAMES})
+
+
+class _FieldView(Mapping):
+    """分片id -> 单个字段取值（如 id2title 即 origin_title 列）。"""
+    def __init__(self, table, field):
+        self._table = table
+        self._field = field
+
+    def __len__(self):
+        return len(self._table)
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __contains__(self, idx):
+        return idx in self._table
+
+    def __getitem__(self, idx):
+        if idx not in self._table:
+            raise KeyError(idx)
+        return self._table.value(idx, self._field)
+
+
+def build_meta_table(id2meta):
+    """由 {分片id: meta} 字典构建；已是 MetaTable 时原样返回。"""
+    if isinstance(id2meta, MetaTable):
+        return id2meta
+    builder = MetaTableBuilder()
+    for idx in sorted(id2meta):
+        builder.add(idx, id2meta[idx])
+    return builder.build()
@@ -0,0 +1,340 @@
+"""
+可内存映射的归档格式（目录形式，默认后缀 .aadb）：
+
+    manifest.json         格式名、版本号、分片数、构建id
+    faiss.index           faiss 索引，支持时以 mmap 方式打开
+    content.bin/.off.npy  分片文本：UTF-8 拼接 + uint64 偏移表
+    meta.*.npy            分片元数据：列式元数据表，页面 meta 只存一份（见 meta_table）
+    raw.bin/.off.npy      页面原始数据（id2raw）+ raw_keys.json
+    title2ids.json        origin_title -> [分片id]
+    lexical.*.npy         BM25 倒排索引（见 lexical_index）
+    filters.*.npy         元数据过滤位图（见 meta_filter）
+    canonical.npy         近重复分组（见 dedup，可选），重复分片的文本只存代表分片一份
+
+读取时只映射文件、不反序列化全部数据，多个 worker 进程经由系统页缓存共享同一份物理页。
+
+归档路径本身是指向同级构建目录 <路径>.build-<构建id> 的符号链接，重建时原子替换链接（见 _publish），
+读者任何时刻都能打开一个完整的版本。
+"""
+import json
+import mmap
+import os
+import shutil
+import uuid
+from collections.abc import Mapping
+import numpy as np
+from .lexical_index import LexicalIndexBuilder
+from .meta_filter import MetaBitmapBuilder
+from .meta_table import MetaTable, MetaTableBuilder
+from .dedup import DuplicateGroups, FILE_NAME as CANONICAL_NAME
+
+FORMAT_NAME = 'astral-archive'
+# 2：元数据改为列式表（meta.*.npy），版本 1 的 meta.bin 仍可读取
+FORMAT_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+BUILD_SUFFIX = '.build-'
+
+
+def is_dir_archive(db_path):
+    """非 .zip 路径一律视为目录归档。"""
+    db_path = str(db_path)
+    return os.path.isdir(db_path) or not db_path.endswith('.zip')
+
+
+def _encode_json(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class _BlobWriter:
+    """顺序追加写入 blob，同时记录偏移表。"""
+    def __init__(self, bin_path):
+        self._f = open(bin_path, 'wb')
+        self.offsets = [0]
+
+    def append(self, data):
+        self._f.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        return len(self.offsets) - 2
+
+    def close(self, off_path):
+        self._f.close()
+        np.save(off_path, np.asarray(self.offsets, dtype='uint64'))
+
+
+class OffsetBlob(Mapping):
+    """
+    只读的 id -> 记录 视图，按偏移表从 mmap 的 blob 中切片并按需解码。
+    alias[i] 指定分片 i 实际读取的记录（近重复分片读取其代表分片的文本）。
+    """
+    def __init__(self, bin_path, off_path, decode, alias=None):
+        self._offsets = np.load(off_path, mmap_mode='r')
+        self._decode = decode
+        self._alias = alias
+        self._file = open(bin_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b''
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __contains__(self, idx):
+        return isinstance(idx, (int, np.integer)) and 0 <= idx < len(self)
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        if self._alias is not None:
+            idx = int(self._alias[idx])
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._decode(self._data[start:end])
+
+
+class _TitleView(Mapping):
+    """id2title 由 meta['origin_title'] 推出，不单独存储。"""
+    def __init__(self, id2meta):
+        self._id2meta = id2meta
+
+    def __len__(self):
+        return len(self._id2meta)
+
+    def __iter__(self):
+        return iter(self._id2meta)
+
+    def __getitem__(self, idx):
+        return self._id2meta[idx].get('origin_title')
+
+
+class _RawView(Mapping):
+    def __init__(self, keys, blob):
+        self._key2pos = {k: i for i, k in enumerate(keys)}
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._key2pos)
+
+    def __iter__(self):
+        return iter(self._key2pos)
+
+    def __getitem__(self, key):
+        return self._blob[self._key2pos[key]]
+
+
+class MmapArchiveWriter:
+    """
+    流式写入目录归档：append() 逐条追加分片，finalize() 写入索引并原子替换目标目录。
+    分片 id 即追加顺序（0..N-1）。
+    """
+    def __init__(self, db_path):
+        self.db_path = str(db_path).rstrip('/\\')
+        self._tmp_path = f"{self.db_path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self._tmp_path)
+        self._content = _BlobWriter(os.path.join(self._tmp_path, 'content.bin'))
+        self._meta = MetaTableBuilder()
+        self._raw = _BlobWriter(os.path.join(self._tmp_path, 'raw.bin'))
+        self._raw_keys = []
+        self._title2ids = {}
+        self._aliases = {}
+        self._lexical = LexicalIndexBuilder()
+        self._filters = MetaBitmapBuilder()
+
+    @property
+    def count(self):
+        return len(self._content.offsets) - 1
+
+    def append(self, text, meta, same_as=None):
+        """
+        same_as 为已追加的代表分片 id 时，text 与其文本相同，不再重复写入 content.bin。
+        """
+        idx = self._content.append(b'' if same_as is not None else text.encode('utf-8'))
+        if same_as is not None:
+            self._aliases[idx] = same_as
+        self._meta.add(idx, meta)
+        self._lexical.add(idx, text, meta)
+        self._filters.add(idx, meta)
+        title = meta.get('origin_title')
+        if title is not None:
+            # 流式写入时到达顺序不固定，先记下分片序号，finalize 时排序
+            self._title2ids.setdefault(title, []).append((meta.get('slice_index', 0), idx))
+        return idx
+
+    def add_raw(self, key, record):
+        self._raw_keys.append(key)
+        self._raw.append(_encode_json(record))
+
+    def finalize(self, index, extra_manifest=None):
+        import faiss
+        tmp = self._tmp_path
+        self._content.close(os.path.join(tmp, 'content.off.npy'))
+        self._raw.close(os.path.join(tmp, 'raw.off.npy'))
+        with open(os.path.join(tmp, 'raw_keys.json'), 'w', encoding='utf-8') as f:
+            json.dump(self._raw_keys, f, ensure_ascii=False)
+        with open(os.path.join(tmp, 'title2ids.json'), 'w', encoding='utf-8') as f:
+            json.dump({title: [idx for _, idx in sorted(pairs)] for title, pairs in self._title2ids.items()},
+                      f, ensure_ascii=False)
+        self._meta.build().save_dir(tmp)
+        self._lexical.build().save_dir(tmp)
+        self._filters.build().save_dir(tmp)
+        if self._aliases:
+            canonical = np.arange(self.count, dtype=np.int64)
+            canonical[list(self._aliases)] = list(self._aliases.values())
+            DuplicateGroups(canonical).save_dir(tmp)
+        faiss.write_index(index, os.path.join(tmp, 'faiss.index'))
+        manifest = {
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+            'count': self.count,
+            'build_id': uuid.uuid4().hex,
+        }
+        if extra_manifest:
+            manifest.update(extra_manifest)
+        # manifest 最后写入，其存在即代表目录完整
+        with open(os.path.join(tmp, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        _publish(tmp, self.db_path, manifest['build_id'])
+        return manifest
+
+    def abort(self):
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+def _build_dirs(db_path):
+    """db_path 的全部构建目录（同级的 <名称>.build-*）。"""
+    parent = os.path.dirname(db_path) or '.'
+    prefix = os.path.basename(db_path) + BUILD_SUFFIX
+    return [os.path.join(parent, name) for name in os.listdir(parent) if name.startswith(prefix)]
+
+
+def _publish(src, db_path, build_id):
+    """
+    把写好的目录 src 发布为 db_path：src 改名为构建目录，再用 os.replace 原子替换指向它的符号链接，
+    替换前后 db_path 始终存在。上一版本保留（刚解析到旧路径、仍在逐个打开文件的读者不受影响），更早的删除；
+    已映射旧文件的读者同样不受影响（文件被删除后映射仍然有效）。
+    """
+    build = f"{db_path}{BUILD_SUFFIX}{build_id}"
+    os.rename(src, build)
+    previous = None
+    if os.path.islink(db_path):
+        previous = os.path.realpath(db_path)
+    elif os.path.isdir(db_path):
+        # 旧布局的实体目录无法原子替换为链接，只在首次迁移时移开一次
+        previous = f"{db_path}{BUILD_SUFFIX}legacy-{uuid.uuid4().hex[:8]}"
+        os.rename(db_path, previous)
+    link = f"{db_path}.link-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    os.symlink(os.path.basename(build), link)
+    os.replace(link, db_path)
+    keep = {os.path.realpath(build), previous}
+    for path in _build_dirs(db_path):
+        if os.path.realpath(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_dir_archive(db_path):
+    """删除目录归档：链接及其全部构建目录（旧布局的实体目录直接删除）。"""
+    db_path = str(db_path).rstrip('/\\')
+    if os.path.islink(db_path):
+        os.remove(db_path)
+        for path in _build_dirs(db_path):
+            shutil.rmtree(path, ignore_errors=True)
+    elif os.path.isdir(db_path):
+        shutil.rmtree(db_path, ignore_errors=True)
+
+
+def save_to_dir(db_path, index, id2meta, id2content, id2raw=None, extra_manifest=None, canonical=None):
+    """
+    一次性写入目录归档；要求分片 id 为 0..N-1。canonical 为近重复分组（见 dedup），重复分片的文本只写一份。
+    """
+    ids = sorted(id2content)
+    if ids != list(range(len(ids))):
+        raise ValueError('目录归档要求分片 id 连续（0..N-1）')
+    writer = MmapArchiveWriter(db_path)
+    try:
+        for idx in ids:
+            same_as = int(canonical[idx]) if canonical is not None and canonical[idx] != idx else None
+            writer.append(id2content[idx], id2meta.get(idx, {}), same_as=same_as)
+        for key, record in (id2raw or {}).items():
+            writer.add_raw(key, record)
+        return writer.finalize(index, extra_manifest=extra_manifest)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def read_manifest(db_path):
+    with open(os.path.join(str(db_path), MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_NAME:
+        raise ValueError(f'{db_path} 不是有效的归档目录')
+    if manifest.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f"归档版本 {manifest.get('version')} 高于当前支持的 {FORMAT_VERSION}")
+    return manifest
+
+
+def _read_index(path):
+    import faiss
+    # faiss>=1.9 支持以 mmap 方式打开 Flat 类索引的向量区
+    flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+def load_from_dir(db_path):
+    """
+    返回 (index, id2meta, id2content, id2title, id2raw, title2ids, manifest)，
+    其中各映射均为按需解码的只读视图。
+    """
+    # 只解析一次链接，加载过程中即使发布了新版本，读到的也都是同一个构建目录
+    db_path = os.path.realpath(str(db_path))
+    manifest = read_manifest(db_path)
+
+    def p(name):
+        return os.path.join(db_path, name)
+
+    index = _read_index(p('faiss.index'))
+    alias = np.load(p(CANONICAL_NAME), mmap_mode='r') if os.path.exists(p(CANONICAL_NAME)) else None
+    id2content = OffsetBlob(p('content.bin'), p('content.off.npy'), lambda b: b.decode('utf-8'), alias=alias)
+    id2meta = MetaTable.load_dir(db_path)
+    if id2meta is not None:
+        id2title = id2meta.field_view('origin_title')
+    else:
+        id2meta = OffsetBlob(p('meta.bin'), p('meta.off.npy'), json.loads)
+        id2title = _TitleView(id2meta)
+    with open(p('raw_keys.json'), 'r', encoding='utf-8') as f:
+        raw_keys = json.load(f)
+    id2raw = _RawView(raw_keys, OffsetBlob(p('raw.bin'), p('raw.off.npy'), json.loads)) if raw_keys else None
+    with open(p('title2ids.json'), 'r', encoding='utf-8') as f:
+        title2ids = json.load(f)
+    return index, id2meta, id2content, id2title, id2raw, title2ids, manifest
+
+
+def convert_zip_to_dir(db_zip_path, db_path):
+    """
+    将旧的 wiki_allinone.zip 一次性转换为目录归档。
+    """
+    from .storage_utils import load_from_zip, load_bytes_from_zip
+    from .dedup import ZIP_ENTRY
+    index, id2meta, id2content, id2title, id2raw = load_from_zip(db_zip_path)
+    canonical = load_bytes_from_zip(db_zip_path, ZIP_ENTRY)
+    manifest = save_to_dir(db_path, index, id2meta, id2content, id2raw,
+                           extra_manifest={'converted_from': os.path.basename(str(db_zip_path))},
+                           canonical=DuplicateGroups.from_bytes(canonical).canonical if canonical else None)
+    return manifest
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='将 zip 归档转换为可 mmap 的目录归档')
+    parser.add_argument('src', help='源 zip 归档，如 db/wiki_allinone.zip')
+    parser.add_argument('dst', nargs='?', help='目标目录，默认与源同名、后缀 .aadb')
+    args = parser.parse_args()
+    dst = args.dst or os.path.splitext(args.src)[0] + '.aadb'
+    manifest = convert_zip_to_dir(args.src, dst)
+    print(f"已写入 {dst}，共{manifest['count']}条（分片）")
@@ -0,0 +1,53 @@
+"""
+最大边际相关（MMR）重排：在相关性与候选之间的冗余度之间折中，
+避免同一长任务页面的相邻分片占满结果。
+
+候选向量由索引重建（见 VectorArchive.reconstruct），全部计算为批量 numpy：
+候选两两相似度一次算出，逐步选择时只循环 k 次（每次对所有查询、所有候选同时打分）。
+"""
+import numpy as np
+
+
+def _normalize(vecs):
+    norms = np.linalg.norm(vecs, axis=-1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+def cosine_relevance(query_vecs, vectors):
+    """query_vecs (Q, d)，vectors (Q, n, d) -> (Q, n) 余弦相似度。"""
+    return np.einsum('qd,qnd->qn', _normalize(np.asarray(query_vecs, dtype='float32')), _normalize(vectors))
+
+
+def scale_scores(scores):
+    """词法/融合得分按每行最大值缩放到 [0, 1]，与余弦相似度处于同一量级。"""
+    scores = np.asarray(scores, dtype='float32')
+    top = np.max(np.where(np.isfinite(scores), scores, 0), axis=-1, keepdims=True)
+    return np.where(top > 0, scores / np.where(top > 0, top, 1), 0)
+
+
+def mmr_rerank(relevance, vectors, diversity=0.3, k=None, valid=None):
+    """
+    relevance: (Q, n) 相关性；vectors: (Q, n, d) 候选向量；valid: (Q, n) 布尔掩码（补齐位为 False）。
+    diversity 为冗余惩罚的权重（0 即按相关性排序，越大越分散）。
+    返回 (Q, k) 的候选下标，按 MMR 选择顺序排列，不足时以 -1 补齐。
+    """
+    relevance = np.atleast_2d(np.asarray(relevance, dtype='float32'))
+    vectors = _normalize(np.asarray(vectors, dtype='float32').reshape(relevance.shape + (-1,)))
+    n_queries, n = relevance.shape
+    k = n if k is None else min(k, n)
+    available = np.ones((n_queries, n), dtype=bool) if valid is None else np.asarray(valid, dtype=bool).copy()
+    sim = np.einsum('qnd,qmd->qnm', vectors, vectors)
+    max_sim = np.full((n_queries, n), -np.inf, dtype='float32')
+    rows = np.arange(n_queries)
+    order = np.full((n_queries, k), -1, dtype='int64')
+    for step in range(k):
+        # 尚未选中任何候选时冗余项为 0
+        penalty = np.where(np.isneginf(max_sim), 0, max_sim)
+        score = (1 - diversity) * relevance - diversity * penalty
+        score = np.where(available, score, -np.inf)
+        pick = np.argmax(score, axis=1)
+        ok = available[rows, pick]
+        order[:, step] = np.where(ok, pick, -1)
+        available[rows[ok], pick[ok]] = False
+        max_sim = np.where(ok[:, None], np.maximum(max_sim, sim[rows, pick]), max_sim)
+    return order
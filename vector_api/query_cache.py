@@ -0,0 +1,157 @@
+"""
+查询向量缓存：进程内 LRU（按条数与字节数双重限制），可选以 sqlite 持久化到磁盘。
+键为 (模型, 查询文本)，命中时完全跳过嵌入API的网络往返。
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+from .embed_cache import EmbeddingCache, text_hash
+from .embed_utils import embed_text, embed_texts, async_embed_text, async_embed_texts, get_async_client
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=4096, max_bytes=64 << 20, persist_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 持久层访问同样在锁内进行，因此可跨线程共享连接
+        self._store = EmbeddingCache(persist_path, check_same_thread=False) if persist_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vec):
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._lru[key] = vec
+        self._bytes += vec.nbytes
+        while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def get(self, model, text):
+        key = (model, text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vec
+            if self._store is not None:
+                h = text_hash(text)
+                vec = self._store.get_many(model, [h]).get(h)
+                if vec is not None:
+                    self._remember(key, vec)
+                    self.disk_hits += 1
+                    return vec
+            self.misses += 1
+            return None
+
+    def put(self, model, text, vec):
+        with self._lock:
+            self._remember((model, text), vec)
+            if self._store is not None:
+                self._store.put_many(model, [(text_hash(text), vec)])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+                'entries': len(self._lru),
+                'bytes': self._bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._bytes = 0
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+
+
+_query_cache = QueryEmbeddingCache()
+
+
+def get_query_cache():
+    return _query_cache
+
+
+def configure_query_cache(max_entries=4096, max_bytes=64 << 20, persist_path=None):
+    """
+    替换进程级查询缓存；persist_path 例如 db/query_cache.sqlite（勿与嵌入缓存共用文件，后者会被清理）。
+    """
+    global _query_cache
+    old = _query_cache
+    _query_cache = QueryEmbeddingCache(max_entries, max_bytes, persist_path)
+    old.close()
+    return _query_cache
+
+
+def embed_query(api_url, api_key, text, model='BAAI/bge-m3'):
+    """
+    带缓存的查询嵌入，返回 float32 一维向量。
+    """
+    cache = _query_cache
+    vec = cache.get(model, text)
+    if vec is None:
+        vec = embed_text(api_url, api_key, text, model)
+        cache.put(model, text, vec)
+    return vec
+
+
+async def async_embed_query(api_url, api_key, text, model='BAAI/bge-m3'):
+    """
+    embed_query 的异步版本，经由共享的长连接客户端请求。
+    """
+    cache = _query_cache
+    vec = cache.get(model, text)
+    if vec is None:
+        vec = await async_embed_text(get_async_client(), api_url, api_key, text, model)
+        cache.put(model, text, vec)
+    return vec
+
+
+def _lookup_queries(cache, model, texts):
+    vecs = [cache.get(model, text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vec in zip(texts, vecs) if vec is None))
+    return vecs, missing
+
+
+def _fill_queries(cache, model, texts, vecs, missing, embedded):
+    got = dict(zip(missing, embedded))
+    for text, vec in got.items():
+        cache.put(model, text, vec)
+    return np.stack([vec if vec is not None else got[text] for text, vec in zip(texts, vecs)])
+
+
+def embed_queries(api_url, api_key, texts, model='BAAI/bge-m3', batch_size=64):
+    """
+    批量查询嵌入，返回 (len(texts), dim) 矩阵。未命中缓存的查询去重后合并为一次请求
+    （超过 batch_size 条时分批）。
+    """
+    texts = list(texts)
+    cache = _query_cache
+    vecs, missing = _lookup_queries(cache, model, texts)
+    embedded = []
+    for i in range(0, len(missing), batch_size):
+        embedded.extend(embed_texts(api_url, api_key, missing[i:i + batch_size], model))
+    return _fill_queries(cache, model, texts, vecs, missing, embedded)
+
+
+async def async_embed_queries(api_url, api_key, texts, model='BAAI/bge-m3', batch_size=64):
+    texts = list(texts)
+    cache = _query_cache
+    vecs, missing = _lookup_queries(cache, model, texts)
+    embedded = []
+    for i in range(0, len(missing), batch_size):
+        embedded.extend(await async_embed_texts(get_async_client(), api_url, api_key, missing[i:i + batch_size], model))
+    return _fill_queries(cache, model, texts, vecs, missing, embedded)
@@ -0,0 +1,286 @@
+"""
+按 meta['category'] 分片的向量库：一个目录下每个分类一个独立归档，外加清单 shards.json。
+
+    shards.json     格式名、版本号、构建id、[{no, category, path, count}]
+    shard-000.aadb  各分类的归档（目录或 zip 格式，与单库完全相同）
+
+全局分片 id = 分片号 << 32 | 分片内 id。检索时在线程池中并发查询各分片（faiss 检索期间释放 GIL）
+再合并 top_k；带 category 过滤时不相关的分片直接跳过。重新抓取某个分类后只需重建该分类的分片。
+"""
+import json
+import os
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+FORMAT_NAME = 'astral-shards'
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'shards.json'
+SHARD_BITS = 32
+LOCAL_MASK = (1 << SHARD_BITS) - 1
+DEFAULT_CATEGORY = '未分类'
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4),
+                                       thread_name_prefix='shard-search')
+    return _executor
+
+
+def is_shard_set(db_path):
+    return os.path.isfile(os.path.join(str(db_path), MANIFEST_NAME))
+
+
+def global_id(shard_no, local_id):
+    return (shard_no << SHARD_BITS) | local_id
+
+
+def split_id(gid):
+    return gid >> SHARD_BITS, gid & LOCAL_MASK
+
+
+def read_shard_manifest(db_path):
+    with open(os.path.join(str(db_path), MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_NAME:
+        raise ValueError(f'{db_path} 不是有效的分片库目录')
+    if manifest.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f"分片库版本 {manifest.get('version')} 高于当前支持的 {FORMAT_VERSION}")
+    return manifest
+
+
+def write_shard_manifest(db_path, shards):
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'build_id': uuid.uuid4().hex,
+        'shards': sorted(shards, key=lambda s: s['no']),
+    }
+    path = os.path.join(str(db_path), MANIFEST_NAME)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return manifest
+
+
+class _GlobalView(Mapping):
+    """以全局 id 访问各分片的 id 映射（id2meta / id2content / id2title）。"""
+    def __init__(self, shards, attr):
+        self._shards = shards
+        self._attr = attr
+
+    def __len__(self):
+        return sum(len(getattr(archive, self._attr)) for archive in self._shards.values())
+
+    def __iter__(self):
+        for no, archive in self._shards.items():
+            for local in getattr(archive, self._attr):
+                yield global_id(no, local)
+
+    def __contains__(self, gid):
+        if not isinstance(gid, (int, np.integer)) or gid < 0:
+            return False
+        no, local = split_id(int(gid))
+        archive = self._shards.get(no)
+        return archive is not None and local in getattr(archive, self._attr)
+
+    def __getitem__(self, gid):
+        if gid not in self:
+            raise KeyError(gid)
+        no, local = split_id(int(gid))
+        return getattr(self._shards[no], self._attr)[local]
+
+
+class _RawChain(Mapping):
+    """id2raw 以页面标题为键，依次在各分片中查找。"""
+    def __init__(self, shards):
+        self._maps = [archive.id2raw for archive in shards.values() if archive.id2raw]
+
+    def __len__(self):
+        return sum(len(m) for m in self._maps)
+
+    def __iter__(self):
+        for m in self._maps:
+            yield from m
+
+    def __getitem__(self, key):
+        for m in self._maps:
+            if key in m:
+                return m[key]
+        raise KeyError(key)
+
+
+class ShardedArchive:
+    """
+    与 VectorArchive 接口一致的分片库：映射表与检索结果均使用全局 id。
+    """
+    def __init__(self, path, manifest, shards):
+        self.path = path
+        self.manifest = manifest
+        self.checksum = manifest['build_id']
+        self.shards = shards  # {分片号: VectorArchive}
+        self.categories = {s['no']: s['category'] for s in manifest['shards']}
+        self.id2meta = _GlobalView(shards, 'id2meta')
+        self.id2content = _GlobalView(shards, 'id2content')
+        self.id2title = _GlobalView(shards, 'id2title')
+        self.id2raw = _RawChain(shards)
+        self.title2ids = {}
+        for no, archive in shards.items():
+            for title, ids in archive.title2ids.items():
+                self.title2ids.setdefault(title, []).extend(global_id(no, i) for i in ids)
+
+    def _route(self, filters):
+        """
+        按 category 过滤选出需要查询的分片，其余过滤条件交给各分片自己的位图。
+        """
+        filters = dict(filters or {})
+        wanted = filters.pop('category', None)
+        if wanted is None:
+            return list(self.shards), filters or None
+        wanted = {wanted} if isinstance(wanted, str) else set(wanted)
+        nos = [no for no in self.shards if self.categories.get(no) in wanted]
+        return nos, filters or None
+
+    def search(self, query_vecs, top_k, ef_search=None, nprobe=None, k_factor=None, filters=None):
+        query_vecs = np.ascontiguousarray(query_vecs, dtype='float32')
+        query_vecs = query_vecs.reshape(-1, query_vecs.shape[-1])
+        nos, shard_filters = self._route(filters)
+        D = np.full((len(query_vecs), top_k), np.inf, dtype='float32')
+        I = np.full((len(query_vecs), top_k), -1, dtype='int64')
+        if not nos:
+            return D, I
+
+        def search_shard(no):
+            Ds, Is = self.shards[no].search(query_vecs, top_k, ef_search=ef_search, nprobe=nprobe,
+                                            k_factor=k_factor, filters=shard_filters)
+            Is = np.where(Is == -1, -1, (np.int64(no) << SHARD_BITS) | Is)
+            return Ds, Is
+
+        if len(nos) == 1:
+            results = [search_shard(nos[0])]
+        else:
+            results = list(_get_executor().map(search_shard, nos))
+        D_all = np.concatenate([r[0] for r in results], axis=1)
+        I_all = np.concatenate([r[1] for r in results], axis=1)
+        D_all = np.where(I_all == -1, np.inf, D_all)
+        order = np.argsort(D_all, axis=1, kind='stable')[:, :top_k]
+        n = order.shape[1]
+        D[:, :n] = np.take_along_axis(D_all, order, axis=1)
+        I[:, :n] = np.take_along_axis(I_all, order, axis=1)
+        return D, I
+
+    def lexical_search(self, query, top_k, filters=None):
+        """
+        各分片的 BM25 得分按各自的语料统计计算，合并时直接按得分排序（近似）。
+        """
+        nos, shard_filters = self._route(filters)
+
+        def search_shard(no):
+            return [(global_id(no, idx), score)
+                    for idx, score in self.shards[no].lexical_search(query, top_k, filters=shard_filters)]
+
+        merged = [hit for hits in _get_executor().map(search_shard, nos) for hit in hits]
+        merged.sort(key=lambda hit: -hit[1])
+        return merged[:top_k]
+
+    def reconstruct(self, ids):
+        ids = np.asarray(ids, dtype='int64')
+        out = None
+        nos = ids >> SHARD_BITS
+        for no in np.unique(nos):
+            rows = np.flatnonzero(nos == no)
+            vecs = self.shards[int(no)].reconstruct(ids[rows] & LOCAL_MASK)
+            if out is None:
+                out = np.empty((len(ids), vecs.shape[1]), dtype='float32')
+            out[rows] = vecs
+        return out if out is not None else np.empty((0, 0), dtype='float32')
+
+    def ids_for_title(self, origin_title):
+        return self.title2ids.get(origin_title, [])
+
+    def ids_for_meta(self, meta):
+        return [idx for idx in self.ids_for_title(meta.get('origin_title'))
+                if self.id2meta.get(idx) == meta]
+
+    def fragments(self, slice_ids):
+        return [self.id2content[idx] for idx in slice_ids if idx in self.id2content]
+
+
+def load_sharded(db_path):
+    from .archive import get_archive
+    manifest = read_shard_manifest(db_path)
+    # 各分片经由进程级归档缓存加载，单个分片重建后只重载该分片
+    shards = {s['no']: get_archive(os.path.join(str(db_path), s['path'])) for s in manifest['shards']}
+    return ShardedArchive(db_path, manifest, shards)
+
+
+def group_files_by_category(data_dir):
+    groups = {}
+    for file in sorted(Path(data_dir).glob('*.json')):
+        with open(file, 'r', encoding='utf-8') as f:
+            category = json.load(f).get('meta', {}).get('category') or DEFAULT_CATEGORY
+        groups.setdefault(category, []).append(file)
+    return groups
+
+
+def _shard_cache_path(db_path, cache_path, no):
+    if cache_path:
+        return f'{os.path.splitext(str(cache_path))[0]}-{no:03d}.sqlite'
+    return os.path.join(str(db_path), f'embed_cache-{no:03d}.sqlite')
+
+
+def embed_and_store_sharded(data_dir, db_path, api_url, api_key, categories=None, shard_format='aadb',
+                            cache_path=None, **kwargs):
+    """
+    按分类分别构建分片并更新清单。categories 指定时只重建这些分类，其它分片保持不变；
+    未指定时重建全部分类，并移除数据中已不存在的分类。
+    每个分片使用独立的嵌入缓存文件，避免按分片清理缓存时误删其它分片的向量。
+    kwargs 透传给 embed_and_store_all_in_one（模型、并发、索引类型等）。
+    """
+    from .main_embedding import embed_and_store_all_in_one
+    from .archive import get_archive
+    db_path = str(db_path)
+    os.makedirs(db_path, exist_ok=True)
+    groups = group_files_by_category(data_dir)
+    existing = {s['category']: s for s in read_shard_manifest(db_path)['shards']} if is_shard_set(db_path) else {}
+    targets = list(groups) if categories is None else [c for c in categories if c in groups]
+    for category in categories or []:
+        if category not in groups:
+            print(f'[分类 {category} 无数据，跳过]')
+    next_no = max((s['no'] for s in existing.values()), default=-1) + 1
+    shards = dict(existing)
+    for category in targets:
+        entry = existing.get(category)
+        if entry is None:
+            entry = {'no': next_no, 'category': category, 'path': f'shard-{next_no:03d}.{shard_format}'}
+            next_no += 1
+        shard_path = os.path.join(db_path, entry['path'])
+        print(f'构建分片 {entry["no"]}（{category}，{len(groups[category])}页）')
+        embed_and_store_all_in_one(data_dir, shard_path, api_url, api_key, files=groups[category],
+                                   cache_path=_shard_cache_path(db_path, cache_path, entry['no']), **kwargs)
+        if not os.path.exists(shard_path):
+            continue
+        shards[category] = dict(entry, count=len(get_archive(shard_path).id2content))
+    if categories is None:
+        for category in list(shards):
+            if category not in groups:
+                print(f'移除分片 {shards[category]["no"]}（{category}，数据中已不存在）')
+                _remove_path(os.path.join(db_path, shards.pop(category)['path']))
+    manifest = write_shard_manifest(db_path, shards.values())
+    print(f'分片清单已写入 {os.path.join(db_path, MANIFEST_NAME)}，共{len(manifest["shards"])}个分片')
+    return manifest
+
+
+def _remove_path(path):
+    from .mmap_store import remove_dir_archive
+    if os.path.isdir(path):
+        remove_dir_archive(path)
+    elif os.path.exists(path):
+        os.remove(path)
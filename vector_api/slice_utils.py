@@ -1,20 +1,88 @@
-def slice_content(content, max_length=5000, context_length=50):
+import re
+from bisect import bisect_right
+
+# 句子边界：切分点落在边界字符之前，边界字符归入下一片段
+_BOUNDARY_RE = re.compile(r'[。！？\n]')
+
+
+def default_token_counter():
     """
-    切片算法：将content字段切片为不超过max_length字符的片段，
-    每个片段包含context_length字符的上下文。
+    默认的 token 计数：与资料拼接、服务端用量统计共用 tokens.count_tokens（cl100k_base，编码器只加载一次）。
+    与嵌入模型的分词器不完全一致，需要精确上限时请传入模型自己的计数函数。
+    """
+    from .tokens import count_tokens
+    return count_tokens
+
+
+def boundary_offsets(content):
+    """content 中所有句子边界字符的位置（升序）。"""
+    return [m.start() for m in _BOUNDARY_RE.finditer(content)]
+
+
+def _last_fitting(lo, hi, fits):
+    """[lo, hi] 内满足 fits 的最大整数（fits 单调：小的满足则更小的也满足），都不满足时返回 None。"""
+    found = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            found = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return found
+
+
+def slice_offsets(content, max_length=5000, context_length=50, max_tokens=None, count_tokens=None):
+    """
+    返回各片段在 content 中的 (起, 止) 偏移（已含前后 context_length 字符的上下文），不复制文本。
+    切分点取 max_length 范围内最后一个句子边界，边界位置预先算好、以二分查找选取，整体线性。
+    max_tokens 指定时，片段（含上下文）同时不超过该 token 数，count_tokens 默认为 default_token_counter()；
+    此时在候选边界上二分查找，单句超限时退化为按字符二分。
     """
-    slices = []
+    n = len(content)
+    bounds = boundary_offsets(content)
+    if max_tokens is not None and count_tokens is None:
+        count_tokens = default_token_counter()
+    offsets = []
     start = 0
-    while start < len(content):
-        end = min(start + max_length, len(content))
-        if end < len(content):
-            while end > start and content[end] not in ['。', '！', '？', '\n']:
-                end -= 1
-            if end == start:
-                end = start + max_length
-        slice_start = max(0, start - context_length)
-        slice_end = min(len(content), end + context_length)
-        sliced_content = content[slice_start:slice_end]
-        slices.append(sliced_content)
+    while start < n:
+        end = min(start + max_length, n)
+        if end < n:
+            j = bisect_right(bounds, end) - 1
+            end = bounds[j] if j >= 0 and bounds[j] > start else start + max_length
+        if max_tokens is not None:
+            end = _token_capped_end(content, start, end, bounds, context_length, max_tokens, count_tokens)
+        offsets.append((max(0, start - context_length), min(n, end + context_length)))
         start = end
-    return slices
+    return offsets
+
+
+def _token_capped_end(content, start, end, bounds, context_length, max_tokens, count_tokens):
+    n = len(content)
+    ctx_start = max(0, start - context_length)
+
+    def fits(cut):
+        return count_tokens(content[ctx_start:min(n, cut + context_length)]) <= max_tokens
+
+    if fits(end):
+        return end
+    lo = bisect_right(bounds, start)
+    hi = bisect_right(bounds, end - 1) - 1
+    j = _last_fitting(lo, hi, lambda i: fits(bounds[i]))
+    if j is not None:
+        return bounds[j]
+    # 没有可用的句子边界（单句过长），按字符切分
+    cut = _last_fitting(start + 1, end - 1, fits)
+    if cut is None:
+        # 上下文本身已超出预算：只保证正文部分不超限，至少前进一个字符
+        cut = _last_fitting(start + 1, end - 1, lambda c: count_tokens(content[start:c]) <= max_tokens)
+    return cut if cut is not None else start + 1
+
+
+def slice_content(content, max_length=5000, context_length=50, max_tokens=None, count_tokens=None):
+    """
+    切片算法：将content字段切片为不超过max_length字符的片段，
+    每个片段包含context_length字符的上下文。
+    max_tokens 指定时再按 token 数限制片段长度，见 slice_offsets。
+    """
+    return [content[a:b] for a, b in slice_offsets(content, max_length, context_length, max_tokens, count_tokens)]
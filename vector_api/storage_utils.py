@@ -1,29 +1,94 @@
+import json
 import pickle
 import zipfile
 import os
+import uuid
 
-def save_to_zip(db_zip_path, faiss_index_path, id2meta, id2content, id2title, id2raw=None):
+def save_to_zip(db_zip_path, faiss_index, id2meta, id2content, id2title, id2raw=None, title2ids=None, index_config=None,
+                lexical=None, filters=None, dedup=None):
+    """
+    faiss_index 可为索引对象（直接序列化进 zip），也可为已写出的索引文件路径（兼容旧用法，写入后删除）。
+    dedup 为近重复分组（见 dedup），重复分片在 id2content 中引用同一字符串对象，pickle 只存一份。
+    id2meta 以列式元数据表（见 meta_table）写入，页面 meta 只存一份。
+    先写入同目录的临时文件再 os.replace 原子替换，正在服务的旧归档在写入期间始终完整可读。
+    """
+    tmp_path = f"{db_zip_path}.tmp-{uuid.uuid4().hex[:8]}"
+    try:
+        _write_zip(tmp_path, faiss_index, id2meta, id2content, id2title, id2raw, title2ids, index_config,
+                   lexical, filters, dedup)
+        os.replace(tmp_path, db_zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _write_zip(db_zip_path, faiss_index, id2meta, id2content, id2title, id2raw, title2ids, index_config,
+               lexical, filters, dedup):
+    from .meta_table import build_meta_table, ZIP_ENTRY as META_TABLE_ENTRY
     with zipfile.ZipFile(db_zip_path, 'w') as zf:
-        zf.write(faiss_index_path)
-        os.remove(faiss_index_path)
-        zf.writestr('id2meta.pkl', pickle.dumps(id2meta))
+        if isinstance(faiss_index, (str, os.PathLike)):
+            zf.write(faiss_index)
+            os.remove(faiss_index)
+        else:
+            import faiss
+            zf.writestr('faiss.index', faiss.serialize_index(faiss_index).tobytes())
+        zf.writestr(META_TABLE_ENTRY, build_meta_table(id2meta).to_bytes())
         zf.writestr('id2content.pkl', pickle.dumps(id2content))
         zf.writestr('id2title.pkl', pickle.dumps(id2title))
         if id2raw is not None:
             zf.writestr('id2raw.pkl', pickle.dumps(id2raw))
+        if title2ids is not None:
+            zf.writestr('title2ids.pkl', pickle.dumps(title2ids))
+        if index_config is not None:
+            zf.writestr('index_config.json', json.dumps(index_config, ensure_ascii=False, indent=2))
+        if lexical is not None:
+            zf.writestr('lexical.npz', lexical.to_bytes())
+        if filters is not None:
+            zf.writestr('meta_bitmaps.npz', filters.to_bytes())
+        if dedup is not None:
+            zf.writestr('canonical.npy', dedup.to_bytes())
 
 def load_from_zip(db_zip_path):
+    import faiss
+    import numpy as np
+    from .meta_table import MetaTable, ZIP_ENTRY as META_TABLE_ENTRY
     with zipfile.ZipFile(db_zip_path, 'r') as zf:
-        with zf.open('faiss.index') as fidx:
-            with open('tmp_faiss.index', 'wb') as fout:
-                fout.write(fidx.read())
-            import faiss
-            index = faiss.read_index('tmp_faiss.index')
-            os.remove('tmp_faiss.index')
-        id2meta = pickle.loads(zf.read('id2meta.pkl'))
+        # 直接在内存中反序列化，避免多个进程争用当前目录下的临时文件
+        index = faiss.deserialize_index(np.frombuffer(zf.read('faiss.index'), dtype='uint8'))
+        if META_TABLE_ENTRY in zf.namelist():
+            id2meta = MetaTable.from_bytes(zf.read(META_TABLE_ENTRY))
+        else:
+            id2meta = pickle.loads(zf.read('id2meta.pkl'))
         id2content = pickle.loads(zf.read('id2content.pkl'))
         id2title = pickle.loads(zf.read('id2title.pkl'))
         id2raw = None
         if 'id2raw.pkl' in zf.namelist():
             id2raw = pickle.loads(zf.read('id2raw.pkl'))
     return index, id2meta, id2content, id2title, id2raw
+
+def load_pickle_from_zip(db_zip_path, name):
+    """
+    读取归档中的单个可选 pickle 条目，不存在时返回 None。
+    """
+    with zipfile.ZipFile(db_zip_path, 'r') as zf:
+        if name not in zf.namelist():
+            return None
+        return pickle.loads(zf.read(name))
+
+def load_json_from_zip(db_zip_path, name):
+    """
+    读取归档中的单个可选 JSON 条目，不存在时返回 None。
+    """
+    with zipfile.ZipFile(db_zip_path, 'r') as zf:
+        if name not in zf.namelist():
+            return None
+        return json.loads(zf.read(name).decode('utf-8'))
+
+def load_bytes_from_zip(db_zip_path, name):
+    """
+    读取归档中的单个可选二进制条目，不存在时返回 None。
+    """
+    with zipfile.ZipFile(db_zip_path, 'r') as zf:
+        if name not in zf.namelist():
+            return None
+        return zf.read(name)
@@ -0,0 +1,212 @@
+"""
+流式嵌入流水线：文件 -> 分片 -> 嵌入批次 -> 索引/归档写入，各阶段之间用有界异步队列连接。
+内存占用只与队列容量和并发数有关，与语料规模无关（faiss 索引本身除外）；
+目标为目录归档时分片文本与元数据直接追加写盘。
+"""
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+import httpx
+import numpy as np
+from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn
+from .slice_utils import slice_content
+from .batch_utils import embed_batch, estimate_tokens
+from .embed_cache import EmbeddingCache, default_cache_path, text_hash
+from .archive import open_archive_writer
+from .async_utils import run_async
+from .faiss_utils import create_index, index_needs_training, describe_index_memory
+
+_DONE = object()
+
+
+def _read_json(file):
+    with open(file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class _IndexAppender:
+    """
+    按块把向量追加进索引，维度由第一个向量决定。
+    需要训练的索引（IVF、PQ、SQ 类）先缓冲 train_size 条向量用于训练，之后再逐块添加。
+    """
+    def __init__(self, index_type='flat', index_params=None, chunk_size=1024, train_size=65536):
+        self.index = None
+        self.config = None
+        self.index_type = index_type
+        self.index_params = index_params
+        self.chunk_size = chunk_size
+        self._train_size = train_size
+        self.train_size = None  # 收到第一个向量、知道维度后确定
+        self._vecs = []
+        self._ids = []
+
+    def add(self, idx, vec):
+        if self.train_size is None:
+            needs_training = index_needs_training(len(vec), self.index_type, self.index_params)
+            self.train_size = self._train_size if needs_training else 0
+        self._vecs.append(vec)
+        self._ids.append(idx)
+        if len(self._vecs) >= max(self.chunk_size, self.train_size if self.index is None else 0):
+            self.flush()
+
+    def flush(self):
+        if not self._vecs:
+            return
+        vecs = np.stack(self._vecs).astype('float32')
+        if self.index is None:
+            self.index, self.config = create_index(vecs.shape[1], self.index_type, self.index_params, n_train=len(vecs))
+            if not self.index.is_trained:
+                self.index.train(vecs)  # type: ignore
+        self.index.add_with_ids(vecs, np.asarray(self._ids, dtype='int64'))  # type: ignore
+        self._vecs, self._ids = [], []
+
+
+async def _run_pipeline(files, writer, api_url, api_key, model, max_length, context_length, max_tokens,
+                        max_concurrency, batch_size, batch_tokens, queue_size, cache, progress, appender):
+    slice_q = asyncio.Queue(maxsize=queue_size)
+    batch_q = asyncio.Queue(maxsize=max_concurrency * 2)
+    result_q = asyncio.Queue(maxsize=queue_size)
+    file_task = progress.add_task("读取文件", total=len(files))
+    slice_task = progress.add_task("嵌入分片中", total=None)
+    stats = {'slices': 0, 'cache_hits': 0, 'embedded': 0}
+
+    async def read_files():
+        for file in files:
+            data = await asyncio.to_thread(_read_json, file)
+            content = data.get('content', '')
+            meta = data.get('meta', {})
+            title = file.stem
+            writer.add_raw(title, {'content': content, 'meta': meta, 'title': title})
+            slices = slice_content(content, max_length=max_length, context_length=context_length, max_tokens=max_tokens)
+            for slice_idx, slice_text in enumerate(slices):
+                meta_with_slice = dict(meta)
+                meta_with_slice['slice_index'] = slice_idx + 1
+                meta_with_slice['origin_title'] = title
+                await slice_q.put((slice_text, meta_with_slice, text_hash(slice_text)))
+                stats['slices'] += 1
+            progress.update(file_task, advance=1)
+        # 分片总数此时才确定
+        progress.update(slice_task, total=stats['slices'])
+        await slice_q.put(_DONE)
+
+    async def make_batches():
+        batch, tokens = [], 0
+
+        async def flush():
+            hits = cache.get_many(model, [item[2] for item in batch]) if cache else {}
+            if hits:
+                cache.touch_many(model, hits)
+            misses = []
+            for item in batch:
+                vec = hits.get(item[2])
+                if vec is None:
+                    misses.append(item)
+                else:
+                    stats['cache_hits'] += 1
+                    await result_q.put((item, vec))
+            if misses:
+                await batch_q.put(misses)
+
+        while True:
+            item = await slice_q.get()
+            if item is _DONE:
+                break
+            n = estimate_tokens(item[0])
+            if batch and (len(batch) >= batch_size or tokens + n > batch_tokens):
+                await flush()
+                batch, tokens = [], 0
+            batch.append(item)
+            tokens += n
+        if batch:
+            await flush()
+        for _ in range(max_concurrency):
+            await batch_q.put(_DONE)
+
+    async def embed_worker(session):
+        while True:
+            batch = await batch_q.get()
+            if batch is _DONE:
+                return
+            pairs = await embed_batch(session, api_url, api_key,
+                                      [(i, item[0]) for i, item in enumerate(batch)], model)
+            if cache:
+                cache.put_many(model, [(batch[i][2], vec) for i, vec in pairs])
+            stats['embedded'] += len(pairs)
+            for i, vec in pairs:
+                await result_q.put((batch[i], vec))
+
+    async def write_results():
+        while True:
+            got = await result_q.get()
+            if got is _DONE:
+                break
+            (slice_text, meta_with_slice, _), vec = got
+            appender.add(writer.append(slice_text, meta_with_slice), vec)
+            progress.update(slice_task, advance=1)
+        appender.flush()
+
+    async with httpx.AsyncClient() as session:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(read_files())
+            batcher = tg.create_task(make_batches())
+            workers = [tg.create_task(embed_worker(session)) for _ in range(max_concurrency)]
+            tg.create_task(write_results())
+
+            async def close_results():
+                await batcher
+                await asyncio.gather(*workers)
+                await result_q.put(_DONE)
+            tg.create_task(close_results())
+    return stats
+
+
+def embed_and_store_streaming(data_dir, db_path, api_url, api_key, model='BAAI/bge-m3', max_length=5000, context_length=50,
+                              max_concurrency=32, batch_size=32, batch_tokens=32000, queue_size=1024,
+                              use_cache=True, cache_path=None, index_type='flat', index_params=None, train_size=65536,
+                              files=None, max_tokens=None):
+    """
+    embed_and_store_all_in_one 的流式版本，归档格式按 db_path 自动选择（目录归档可真正做到常量内存）。
+    分片 id 按写入顺序分配，同一页面的 title2ids 仍按分片序号排列。
+    IVF 类索引用最先到达的 train_size 条向量训练，nlist 未指定时按训练样本数推算。
+    """
+    files = list(sorted(Path(data_dir).glob('*.json'))) if files is None else list(files)
+    if not files:
+        print('[无可嵌入的数据]')
+        return
+    parent = os.path.dirname(str(db_path))
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    started_at = time.time()
+    writer = open_archive_writer(db_path)
+    cache = EmbeddingCache(cache_path or default_cache_path(db_path)) if use_cache else None
+    try:
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+            transient=False
+        ) as progress:
+            appender = _IndexAppender(index_type, index_params, train_size=train_size)
+            stats = run_async(_run_pipeline(
+                files, writer, api_url, api_key, model, max_length, context_length, max_tokens,
+                max_concurrency, batch_size, batch_tokens, queue_size, cache, progress, appender))
+        index = appender.index
+        if index is None:
+            writer.abort()
+            print('[无可嵌入的数据]')
+            return
+        writer.finalize(index, extra_manifest={'index': appender.config})
+        print(f"已写入 {db_path}，共{index.ntotal}条（分片）")
+        print(describe_index_memory(index, appender.config))
+        if cache:
+            removed = cache.prune_older_than(model, started_at)
+            print(f"嵌入缓存：命中{stats['cache_hits']}条，新嵌入{stats['embedded']}条，清理{removed}条")
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if cache:
+            cache.close()
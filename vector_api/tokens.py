@@ -0,0 +1,88 @@
+"""
+进程级共享的 token 计数：编码器只加载一次，分片、资料拼接、服务端、命令行与用量统计共用同一套计数。
+
+- count_tokens(text)            单条文本
+- count_tokens_batch(texts)     多条文本一次编码（tiktoken 内部多线程）
+- StreamTokenCounter            流式输出逐块喂入，已确定的 token 不再重复编码
+
+tiktoken 不可用（未安装或无法下载编码文件）时退化为按字符计数。
+"""
+import threading
+
+DEFAULT_ENCODING = "cl100k_base"
+
+_encoders = {}
+_lock = threading.Lock()
+
+
+def get_encoder(encoding_name=DEFAULT_ENCODING):
+    """返回缓存的 tiktoken 编码器；不可用时返回 None（同样只尝试一次）。"""
+    if encoding_name in _encoders:
+        return _encoders[encoding_name]
+    with _lock:
+        if encoding_name not in _encoders:
+            try:
+                import tiktoken
+                _encoders[encoding_name] = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                _encoders[encoding_name] = None
+    return _encoders[encoding_name]
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    if not text:
+        return 0
+    enc = get_encoder(encoding_name)
+    if enc is None:
+        return len(text)  # fallback: char count
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts, encoding_name=DEFAULT_ENCODING, num_threads=8):
+    """返回与 texts 等长的 token 数列表。"""
+    texts = [text or "" for text in texts]
+    enc = get_encoder(encoding_name)
+    if enc is None:
+        return [len(text) for text in texts]
+    return [len(tokens) for tokens in enc.encode_batch(texts, num_threads=num_threads, disallowed_special=())]
+
+
+class StreamTokenCounter:
+    """
+    流式输出的增量计数：feed() 逐块喂入文本，total 为当前累计 token 数。
+    只有末尾 keep 个 token 对应的文本会与下一块一起重新编码（它们可能与后续字符合并），
+    之前的 token 已确定、不再重复编码，总开销与输出长度成线性关系。
+    """
+    def __init__(self, encoding_name=DEFAULT_ENCODING, keep=8):
+        self._enc = get_encoder(encoding_name)
+        self._keep = keep
+        self._settled = 0
+        self._tail = ""
+        self._tail_tokens = 0
+
+    @property
+    def total(self):
+        return self._settled + self._tail_tokens
+
+    def feed(self, text):
+        """喂入一块文本，返回当前累计 token 数。"""
+        if not text:
+            return self.total
+        if self._enc is None:
+            self._settled += len(text)
+            return self.total
+        buf = self._tail + text
+        tokens = self._enc.encode(buf, disallowed_special=())
+        cut = len(tokens) - self._keep
+        # 切分点不能落在多字节字符中间，否则该字符会被重复计数
+        while cut > 0 and 0x80 <= self._enc.decode_single_token_bytes(tokens[cut])[0] < 0xC0:
+            cut -= 1
+        if cut > 0:
+            _, offsets = self._enc.decode_with_offsets(tokens)
+            self._settled += cut
+            self._tail = buf[offsets[cut]:]
+            self._tail_tokens = len(tokens) - cut
+        else:
+            self._tail = buf
+            self._tail_tokens = len(tokens)
+        return self.total